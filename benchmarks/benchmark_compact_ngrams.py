@@ -0,0 +1,174 @@
+"""
+This module reports the memory, time and testset F1 of fitting the stance
+model with the default n-gram featurization vs. the compact one (see
+model_svm.CompactCountVectorizer and CompactFeatureUnion).
+
+Each variant is fitted in a fresh (spawned) process, whose peak RSS growth
+during the fit is reported, as model_build --compact would see it. It runs on
+a trainset, testset and word vectors file in dataset_path, as model_build/
+model_test do, or, by default, on a synthetic split (see synthetic_tweets.py)
+with label_noise of the trainset's stances flipped, since the synthetic
+stances are otherwise learned perfectly and every variant scores an F1 of 1.0.
+
+See benchmarks/README.md for measured results.
+"""
+import logging
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from benchmarks.benchmark_pipeline import get_normalized_frame
+from benchmarks.synthetic_tweets import write_word_vectors
+
+logger = logging.getLogger(__name__)
+
+STANCES = ['against', 'for', 'neutral']
+
+
+def get_synthetic_inputs(size, label_noise, seed, work_dirpath):
+    """Write a synthetic trainset/testset split, with label_noise of the
+    trainset's stances flipped, and its word vectors, and return their paths.
+    """
+    data_frame = get_normalized_frame(size)
+    split = size * 4 // 5
+    trainset, testset = data_frame.iloc[:split].copy(), data_frame.iloc[split:]
+    rng = np.random.default_rng(seed)
+    flipped = np.flatnonzero(rng.random(len(trainset)) < label_noise)
+    stances = trainset['stance'].to_numpy(dtype=object)
+    stances[flipped] = [
+        rng.choice([other for other in STANCES if other != stance]) for stance in stances[flipped]
+        ]
+    trainset['stance'] = stances
+
+    trainset_filepath, testset_filepath = work_dirpath / 'trainset.csv', work_dirpath / 'testset.csv'
+    trainset.to_csv(trainset_filepath, index=False)
+    testset.to_csv(testset_filepath, index=False)
+    word_vectors_filepath = work_dirpath / 'wordvec.vec'
+    write_word_vectors(
+        word_vectors_filepath, data_frame['tweet_norm'].tolist() + data_frame['profile_norm'].tolist()
+        )
+    return trainset_filepath, testset_filepath, word_vectors_filepath
+
+
+def get_max_rss_mb():
+    """Return the peak RSS of this process so far, in MB."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 2**20 if sys.platform == 'darwin' else peak_rss / 2**10
+
+
+def fit_variant(trainset_filepath, testset_filepath, word_vectors_filepath, compact, min_df):
+    """Fit the model variant (in a fresh process) and return its fit memory,
+    time, n-gram vocabulary sizes and testset macro-F1.
+    """
+    import psutil
+    from src.model_svm import get_model
+    from src.model_utilities import load_dataset, set_labels, compute_macro_f1
+
+    labels = set_labels(None)
+    x_train, y_train = load_dataset(trainset_filepath, labels)
+    x_test, y_test = load_dataset(testset_filepath, labels)
+    model = get_model(word_vectors_filepath, profile=True, compact=compact, min_df=min_df)
+    # The loading peak is well below the fit's, so the process peak after the
+    # fit is the fit's.
+    rss_before = psutil.Process().memory_info().rss / 2**20
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        start = time.perf_counter()
+        model.fit(x_train, y_train)
+        fit_seconds = time.perf_counter() - start
+    y_predicted = model.predict(x_test)
+    branches = dict(model.named_steps['vect'].transformer_list)
+    return {
+        'fit_peak_rss_growth_mb': get_max_rss_mb() - rss_before,
+        'fit_s': fit_seconds,
+        'word_ngrams': len(branches['ngram_w'].vocabulary_),
+        'char_ngrams': len(branches['ngram_c'].vocabulary_),
+        'f1': compute_macro_f1(y_test, y_predicted),
+        'predictions': y_predicted,
+        }
+
+
+def benchmark_compact_ngrams(
+        dataset_path=None,
+        trainset_filename='autocode.csv',
+        testset_filename='testset.csv',
+        word_vectors_filename='wordvec.vec',
+        size=20000,
+        label_noise=0.3,
+        seed=0,
+        min_df=2,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the fit memory, fit time and testset F1 of the model
+    with the default and the compact n-gram featurization.
+
+    Keyword Arguments:
+        dataset_path -- the directory of the trainset, testset and word vectors
+            files
+            (default: None -- a synthetic split, in a temporary directory)
+        trainset_filename -- the name of the trainset file
+            (default: 'autocode.csv')
+        testset_filename -- the name of the (coded) testset file
+            (default: 'testset.csv')
+        word_vectors_filename -- the name of the word vectors file
+            (default: 'wordvec.vec')
+        size -- the number of synthetic items (4/5 train, 1/5 test)
+            (default: 20000)
+        label_noise -- the fraction of synthetic trainset stances flipped
+            (default: 0.3)
+        seed -- the random seed of the label noise
+            (default: 0)
+        min_df -- the compact variant's n-gram min_df
+            (default: 2)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking compact n-gram featurization...')
+
+    work_dirpath = Path(tempfile.mkdtemp(prefix='slo-benchmark-'))
+    try:
+        if dataset_path is None:
+            inputs = get_synthetic_inputs(size, label_noise, seed, work_dirpath)
+        else:
+            inputs = tuple(
+                Path(dataset_path, filename)
+                for filename in (trainset_filename, testset_filename, word_vectors_filename)
+                )
+        rows = []
+        reference = None
+        for name, compact in [('default', False), ('compact', True)]:
+            # A fresh process per variant, so that each one's peak RSS is its own.
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                row = executor.submit(fit_variant, *inputs, compact, min_df).result()
+            y_predicted = row.pop('predictions')
+            if reference is None:
+                reference = y_predicted
+            row = {'variant': name, **row, 'agreement': float(np.mean(y_predicted == reference))}
+            rows.append(row)
+            logger.info('\t%s', row)
+    finally:
+        shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    results['f1_change'] = results['f1'] - results['f1'].iloc[0]
+    results['memory_saved'] = 1 - results['fit_peak_rss_growth_mb'] / results['fit_peak_rss_growth_mb'].iloc[0]
+    print(results.round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(benchmark_compact_ngrams)
@@ -0,0 +1,182 @@
+"""
+This module reports, for each word vector precision (see
+src/compact_vectors.py), with and without vocabulary pruning:
+- the word vectors' size on disk and in memory, and the size of the pickled
+    model (which includes the word vectors)
+- the time to load the (memory-mapped) word vectors and read them all
+- the model's macro-F1 on a testset, as model_test computes it, and its change
+    and prediction agreement vs. the float32 vectors
+
+It runs on a trainset, testset, word vectors and corpus (tokens) file in
+dataset_path, as model_build/model_test do, or, by default, on a synthetic
+split (see synthetic_tweets.py) whose word vectors also cover extra_words
+words that aren't in the corpus, as a pre-trained vocabulary would.
+"""
+import logging
+import pickle
+import shutil
+import tempfile
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from benchmarks.benchmark_pipeline import get_normalized_frame
+from benchmarks.synthetic_tweets import write_word_vectors
+
+logger = logging.getLogger(__name__)
+
+# The (precision, pruned) variants, float32 first as the reference.
+VARIANTS = [
+    ('float32', False),
+    ('float16', False),
+    ('int8', False),
+    ('float32', True),
+    ('float16', True),
+    ('int8', True),
+    ]
+
+
+def get_synthetic_inputs(size, extra_words, work_dirpath):
+    """Write a synthetic trainset/testset split, its word vectors and its
+    tokens file, and return their paths.
+    """
+    data_frame = get_normalized_frame(size)
+    split = size * 4 // 5
+    trainset_filepath, testset_filepath = work_dirpath / 'trainset.csv', work_dirpath / 'testset.csv'
+    data_frame.iloc[:split].to_csv(trainset_filepath, index=False)
+    data_frame.iloc[split:].to_csv(testset_filepath, index=False)
+
+    texts = data_frame['tweet_norm'].tolist() + data_frame['profile_norm'].tolist()
+    corpus_filepath = work_dirpath / 'dataset_norm.txt'
+    with open(corpus_filepath, 'w', encoding='utf-8') as fout:
+        fout.writelines(text + '\n' for text in texts)
+    word_vectors_filepath = work_dirpath / 'wordvec.vec'
+    write_word_vectors(word_vectors_filepath, texts + [f'slo_extra_{index}' for index in range(extra_words)])
+    return trainset_filepath, testset_filepath, word_vectors_filepath, corpus_filepath
+
+
+def get_file_size(filepath):
+    """Return the size (in bytes) of the given word vectors file and its arrays."""
+    return sum(path.stat().st_size for path in filepath.parent.glob(filepath.name + '*'))
+
+
+def time_load(filepath, repeats):
+    """Return the best time (in seconds) to load the given word vectors and
+    read all their values, and the loaded vectors.
+    """
+    from src.compact_vectors import load_word_vectors
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        wordvec = load_word_vectors(filepath)
+        np.array(wordvec.vectors)
+        timings.append(time.perf_counter() - start)
+    return min(timings), wordvec
+
+
+def benchmark_compact_vectors(
+        dataset_path=None,
+        trainset_filename='autocode.csv',
+        testset_filename='testset.csv',
+        word_vectors_filename='wordvec.vec',
+        corpus_filename='dataset_norm.txt',
+        size=5000,
+        extra_words=50000,
+        repeats=3,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the memory, load time and testset F1 of the model for
+    each word vector precision, with and without vocabulary pruning.
+
+    Keyword Arguments:
+        dataset_path -- the directory of the trainset, testset, word vectors
+            and corpus files
+            (default: None -- a synthetic split, in a temporary directory)
+        trainset_filename -- the name of the trainset file
+            (default: 'autocode.csv')
+        testset_filename -- the name of the (coded) testset file
+            (default: 'testset.csv')
+        word_vectors_filename -- the name of the word vectors file
+            (default: 'wordvec.vec')
+        corpus_filename -- the name of the tokens file to prune the word
+            vectors' vocabulary to
+            (default: 'dataset_norm.txt')
+        size -- the number of synthetic items (4/5 train, 1/5 test)
+            (default: 5000)
+        extra_words -- the number of synthetic words outside the corpus
+            (default: 50000)
+        repeats -- the number of timed loads (the best is kept)
+            (default: 3)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking compact word vectors...')
+    from src.compact_vectors import get_compact_embedding_filepath
+    from src.model_artifact import get_mmap_embedding_filepath
+    from src.model_svm import get_model
+    from src.model_utilities import load_dataset, set_labels, compute_macro_f1
+
+    work_dirpath = Path(tempfile.mkdtemp(prefix='slo-benchmark-'))
+    try:
+        if dataset_path is None:
+            trainset_filepath, testset_filepath, word_vectors_filepath, corpus_filepath = \
+                get_synthetic_inputs(size, extra_words, work_dirpath)
+        else:
+            trainset_filepath, testset_filepath, word_vectors_filepath, corpus_filepath = (
+                Path(dataset_path, filename)
+                for filename in (trainset_filename, testset_filename, word_vectors_filename, corpus_filename)
+                )
+        labels = set_labels(None)
+        x_train, y_train = load_dataset(trainset_filepath, labels)
+        x_test, y_test = load_dataset(testset_filepath, labels)
+
+        rows = []
+        reference = None
+        for precision, pruned in VARIANTS:
+            if precision == 'float32' and not pruned:
+                filepath = get_mmap_embedding_filepath(word_vectors_filepath)
+            else:
+                filepath = get_compact_embedding_filepath(
+                    word_vectors_filepath, precision, corpus_filepath if pruned else None
+                    )
+            load_seconds, wordvec = time_load(filepath, repeats)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                model = get_model(filepath, profile=True).fit(x_train, y_train)
+            y_predicted = model.predict(x_test)
+            if reference is None:
+                reference = y_predicted
+            row = {
+                'precision': precision,
+                'pruned': pruned,
+                'words': len(wordvec.index_to_key),
+                'file_mb': get_file_size(filepath) / 2**20,
+                'vectors_mb': np.asarray(wordvec.vectors).nbytes / 2**20,
+                'model_pickle_mb': len(pickle.dumps(model)) / 2**20,
+                'load_ms': load_seconds * 1000,
+                'f1': compute_macro_f1(y_test, y_predicted),
+                'agreement': float(np.mean(y_predicted == reference)),
+                }
+            rows.append(row)
+            logger.info('\t%s', row)
+    finally:
+        shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    results['f1_change'] = results['f1'] - results['f1'].iloc[0]
+    results['memory_saved'] = 1 - results['vectors_mb'] / results['vectors_mb'].iloc[0]
+    print(results.round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(benchmark_compact_vectors)
@@ -0,0 +1,150 @@
+"""
+This module compares the fused, in-memory dataset pipeline (see
+src/dataset_pipeline.py) with the Makefile's file-based steps
+(dataset_preprocessor, dataset_normalizer, token_extractor and
+autocoding_processor) on synthetic raw tweets (see synthetic_tweets.py).
+
+Each step runs in its own interpreter, via slo.py, as make runs it, and is
+measured for wall-clock time and peak resident memory (the maximum RSS that
+the OS reports for the process). The Makefile path's runtime is the sum of its
+steps' and its peak memory is the largest of its steps'. The final outputs of
+the two paths are compared as well (the auto-coded samples are random, so
+only their sizes).
+
+The pre-processor runs polyglot on the non-English tweets, so polyglot must be
+installed.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import pandas as pd
+from fire import Fire
+
+from benchmarks.synthetic_tweets import write_raw_tweets
+
+logger = logging.getLogger(__name__)
+
+BASE_DIRPATH = Path(__file__).parent.parent
+SLO_FILEPATH = BASE_DIRPATH / 'src' / 'slo.py'
+
+# The Makefile's steps, from the raw tweets to the tokens/auto-coded files.
+MAKEFILE_STEPS = [
+    ('dataset_preprocessor', ['--input_filename=dataset.json', '--output_filename=dataset.csv']),
+    ('dataset_normalizer', ['--input_filename=dataset.csv', '--output_filename=dataset_norm.csv']),
+    ('token_extractor', ['--input_filename=dataset_norm.csv', '--output_filename=dataset_norm.txt']),
+    ('autocoding_processor', ['--input_filename=dataset_norm.csv', '--output_filename=dataset_autocode.csv']),
+    ]
+FUSED_STEPS = [
+    ('dataset_pipeline', ['--input_filename=dataset.json', '--tokens_filename=dataset_norm.txt',
+                          '--autocode_filename=dataset_autocode.csv']),
+    ]
+OUTPUT_FILENAMES = ['dataset_norm.txt', 'dataset_autocode.csv']
+
+
+def run_step(command, arguments, dirpath):
+    """Run the given slo.py command on the given directory and return its
+    wall-clock time (in seconds) and peak RSS (in MB).
+    """
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [str(BASE_DIRPATH)] + [path for path in [environment.get('PYTHONPATH')] if path]
+        )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(SLO_FILEPATH), command, f'--dataset_path={dirpath}', '--report_dirname=None']
+        + arguments,
+        env=environment, cwd=dirpath, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+    # wait4() returns the resource usage of this process only.
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f'{command} failed: {process.stderr.read().decode().strip()}')
+    process.stderr.close()
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS).
+    return seconds, usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def run_path(name, steps, raw_filepath, work_dirpath):
+    """Run the given steps on a copy of the raw tweets and return the path's
+    result row and its directory.
+    """
+    dirpath = work_dirpath / name
+    dirpath.mkdir()
+    shutil.copy(raw_filepath, dirpath / 'dataset.json')
+    row = {'path': name, 'seconds': 0.0, 'peak_mb': 0.0}
+    for command, arguments in steps:
+        seconds, peak_mb = run_step(command, arguments, dirpath)
+        logger.info('\t\t%s: %.2fs, %.0f MB', command, seconds, peak_mb)
+        row['seconds'] += seconds
+        row['peak_mb'] = max(row['peak_mb'], peak_mb)
+    row['files_mb'] = sum(
+        filepath.stat().st_size for filepath in dirpath.iterdir() if filepath.name != 'dataset.json'
+        ) / 1024 ** 2
+    return row, dirpath
+
+
+def benchmark_dataset_pipeline(
+        sizes=(10000, 50000),
+        chunk_size=50000,
+        work_path=None,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the runtime, peak memory and written file sizes of the
+    Makefile's dataset steps and of the fused pipeline, by raw tweet count.
+
+    Keyword Arguments:
+        sizes -- the numbers of raw tweets
+            (default: (10000, 50000))
+        chunk_size -- the fused pipeline's chunk size
+            (default: 50000)
+        work_path -- the directory in which to write the datasets
+            (default: None -- a temporary directory, deleted afterwards)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking the fused dataset pipeline...')
+    sizes = [sizes] if isinstance(sizes, int) else sorted(sizes)
+    fused_steps = [(command, arguments + [f'--chunk_size={chunk_size}']) for command, arguments in FUSED_STEPS]
+
+    rows = []
+    for size in sizes:
+        work_dirpath = Path(work_path, str(size)) if work_path else Path(tempfile.mkdtemp(prefix='slo-benchmark-'))
+        work_dirpath.mkdir(parents=True, exist_ok=True)
+        try:
+            raw_filepath = work_dirpath / 'raw.json'
+            write_raw_tweets(raw_filepath, size)
+            logger.info('\t%s tweets:', size)
+            makefile_row, makefile_dirpath = run_path('makefile', MAKEFILE_STEPS, raw_filepath, work_dirpath)
+            fused_row, fused_dirpath = run_path('fused', fused_steps, raw_filepath, work_dirpath)
+            tokens_match = (makefile_dirpath / OUTPUT_FILENAMES[0]).read_bytes() == \
+                (fused_dirpath / OUTPUT_FILENAMES[0]).read_bytes()
+            autocode_rows = [
+                pd.read_csv(dirpath / OUTPUT_FILENAMES[1]).shape[0] for dirpath in (makefile_dirpath, fused_dirpath)
+                ]
+            for row in (makefile_row, fused_row):
+                row.update(size=size, tokens_match=tokens_match, autocode_rows_match=len(set(autocode_rows)) == 1)
+                rows.append(row)
+        finally:
+            if work_path is None:
+                shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    results = pd.DataFrame(rows)[
+        ['size', 'path', 'seconds', 'peak_mb', 'files_mb', 'tokens_match', 'autocode_rows_match']
+        ].round(2)
+    print(results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(benchmark_dataset_pipeline)
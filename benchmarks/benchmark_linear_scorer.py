@@ -0,0 +1,126 @@
+"""
+This module measures single-tweet prediction latencies of the stance model's
+scikit-learn pipeline vs. its LinearScorer export (see src/linear_scorer.py).
+
+A model is trained on synthetic tweets (see synthetic_tweets.py) and exported.
+Each of a stream of new x values is then predicted on its own, as a
+low-latency service would, by (1) Pipeline.predict() of a one-item batch and
+(2) LinearScorer.predict_one(), recording each request's latency. The
+scorer's predictions are checked against the pipeline's, and its decision
+function values against the pipeline's of both the plain strings and their
+ParsedDocuments.
+"""
+import logging
+import pickle
+import shutil
+import tempfile
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from benchmarks.benchmark_pipeline import get_model_inputs
+
+logger = logging.getLogger(__name__)
+
+
+def time_requests(predict, x_values):
+    """Predict the given x values one at a time and return the predictions
+    and each request's latency (in ms).
+    """
+    y_predicted = []
+    latencies = np.empty(len(x_values))
+    for index, x_value in enumerate(x_values):
+        start = time.perf_counter()
+        y_predicted.append(predict(x_value))
+        latencies[index] = time.perf_counter() - start
+    return np.asarray(y_predicted), latencies * 1000
+
+
+def benchmark_linear_scorer(
+        size=2000,
+        train_size=5000,
+        compact=False,
+        warmup=100,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the single-tweet latency percentiles of the pipeline
+    and of its linear scorer, and whether their predictions match.
+
+    Keyword Arguments:
+        size -- the number of x values predicted one at a time
+            (default: 2000)
+        train_size -- the number of synthetic trainset items
+            (default: 5000)
+        compact -- whether to train the compact model variant (see
+            model_svm.get_model())
+            (default: False)
+        warmup -- the number of untimed requests before each run
+            (default: 100)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking the linear scorer...')
+    from src.model_svm import get_model
+    from src.linear_scorer import get_linear_scorer
+    from src.model_utilities import ParsedDocuments
+
+    work_dirpath = Path(tempfile.mkdtemp(prefix='slo-benchmark-'))
+    try:
+        x_values, y_values, word_vectors_filepath = get_model_inputs(train_size, work_dirpath)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model = get_model(word_vectors_filepath, profile=True, compact=compact).fit(x_values, y_values)
+        start = time.perf_counter()
+        scorer = get_linear_scorer(model)
+        export_seconds = time.perf_counter() - start
+        # The requests (mostly) differ from the trainset's items.
+        request_x_values = np.asarray(get_model_inputs(size, work_dirpath)[0]).tolist()[::-1]
+
+        # The pipeline's decision function of plain strings and of parsed
+        # documents (as load_dataset() returns them) alike.
+        scores = scorer.decision_function(request_x_values)
+        decision_matches = all(
+            np.array_equal(model.decision_function(inputs), scores)
+            for inputs in (request_x_values, ParsedDocuments(request_x_values))
+            )
+        runs = {
+            'pipeline': lambda x_value: model.predict([x_value])[0],
+            'linear_scorer': scorer.predict_one,
+            }
+        rows = []
+        y_expected = None
+        for name, predict in runs.items():
+            time_requests(predict, request_x_values[:warmup])
+            y_predicted, latencies = time_requests(predict, request_x_values)
+            if y_expected is None:
+                y_expected = y_predicted
+            rows.append({
+                'run': name,
+                'p50_ms': np.percentile(latencies, 50),
+                'p90_ms': np.percentile(latencies, 90),
+                'p99_ms': np.percentile(latencies, 99),
+                'max_ms': latencies.max(),
+                'pickle_mb': len(pickle.dumps(model if name == 'pipeline' else scorer)) / 2**20,
+                'matches': bool(np.array_equal(y_predicted, y_expected)),
+                })
+            logger.info('\t%s: %s', name, rows[-1])
+    finally:
+        shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    results['p99_speedup'] = results['p99_ms'].iloc[0] / results['p99_ms']
+    print(results.round(3).to_string(index=False))
+    print(f'export: {export_seconds:.3f}s, identical decision function values: {decision_matches}')
+
+
+if __name__ == '__main__':
+    Fire(benchmark_linear_scorer)
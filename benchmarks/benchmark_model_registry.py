@@ -0,0 +1,214 @@
+"""
+This module measures the predict() latencies of a ModelRegistry (see
+src/model_registry.py) under steady load while a new model version is
+published and swapped in, and then rolled back.
+
+Two versions of the stance model are trained on synthetic tweets (see
+synthetic_tweets.py). The second is saved in a staging directory and renamed
+into the model directory mid-run, as save_model_artifact() publishes versions.
+A client thread predicts small batches back to back, recording each request's
+latency and the version that served it. The latencies are reported for the
+windows before the swap, during it (from the version's publication until one
+second after it is swapped in) and after it. For comparison, the same load is
+measured with a stop-the-world reload, i.e., loading the new version on the
+request path as a restarted process would.
+"""
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from benchmarks.benchmark_pipeline import get_model_inputs
+
+logger = logging.getLogger(__name__)
+
+
+def build_version(size, work_dirpath, model_dirpath, version, seed):
+    """Train a model on a (seeded) sample of the synthetic trainset and save
+    it as the given version in the given model directory.
+    """
+    from src.model_svm import get_model
+    from src.model_artifact import save_model_artifact
+
+    x_values, y_values, word_vectors_filepath = get_model_inputs(size, work_dirpath)
+    sample = np.random.default_rng(seed).choice(len(x_values), size=len(x_values) * 3 // 4, replace=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = get_model(word_vectors_filepath, profile=True).fit(x_values[sample], y_values[sample])
+    return save_model_artifact(model, model_dirpath, word_vectors_filepath, version=version)
+
+
+def run_load(predict, batches, stop_event, records):
+    """Predict the given batches round robin until the stop event is set,
+    recording (start time, latency, version) per request.
+    """
+    index = 0
+    while not stop_event.is_set():
+        batch = batches[index % len(batches)]
+        start = time.perf_counter()
+        version = predict(batch)
+        records.append((start, time.perf_counter() - start, version))
+        index += 1
+
+
+def summarize(records, windows):
+    """Return the latency percentiles (in ms) of the records in each of the
+    given {name: (start, stop)} windows.
+    """
+    data_frame = pd.DataFrame(records, columns=['start', 'latency', 'version'])
+    rows = []
+    for name, (start, stop) in windows.items():
+        latencies = data_frame.loc[(data_frame['start'] >= start) & (data_frame['start'] < stop), 'latency'] * 1000
+        if latencies.empty:
+            continue
+        rows.append({
+            'window': name,
+            'requests': len(latencies),
+            'p50_ms': latencies.quantile(0.5),
+            'p99_ms': latencies.quantile(0.99),
+            'max_ms': latencies.max(),
+            })
+    return rows
+
+
+def benchmark_registry(model_dirpath, staged_dirpath, batches, phase_seconds, poll_seconds):
+    """Measure the registry's latencies around a swap and a rollback."""
+    from src.model_registry import ModelRegistry
+
+    registry = ModelRegistry(model_dirpath, warmup_x=batches[0], poll_seconds=poll_seconds).start()
+    first_version = registry.get_version()
+    records, stop_event = [], threading.Event()
+
+    def predict(batch):
+        model_version = registry.current
+        model_version.model.predict(batch)
+        return model_version.version
+
+    client = threading.Thread(target=run_load, args=(predict, batches, stop_event, records))
+    client.start()
+    time.sleep(phase_seconds)
+    published = time.perf_counter()
+    staged_dirpath.rename(model_dirpath / staged_dirpath.name)
+    while registry.get_version() == first_version:
+        time.sleep(0.01)
+    swapped = time.perf_counter()
+    logger.info('\tswapped in %s %.3fs after its publication', registry.get_version(), swapped - published)
+    time.sleep(phase_seconds)
+    rollback_start = time.perf_counter()
+    registry.rollback()
+    time.sleep(phase_seconds)
+    stop_event.set()
+    client.join()
+    registry.stop()
+
+    rows = summarize(records, {
+        'before_swap': (0, published),
+        'swap': (published, swapped + 1),
+        'after_swap': (swapped + 1, rollback_start),
+        'rollback': (rollback_start, rollback_start + 1),
+        })
+    for row in rows:
+        row['mode'] = 'registry'
+    return rows, swapped - published
+
+
+def benchmark_reload(model_dirpath, staged_dirpath, batches, phase_seconds):
+    """Measure the latencies of a stop-the-world reload on the request path."""
+    from src.model_artifact import list_model_versions, load_model_artifact
+
+    state = {'model': load_model_artifact(model_dirpath), 'version': list_model_versions(model_dirpath)[-1].name}
+    state['model'].predict(batches[0])
+    records, stop_event = [], threading.Event()
+
+    def predict(batch):
+        # A new version is loaded by the first request that sees it.
+        latest = list_model_versions(model_dirpath)[-1]
+        if latest.name != state['version']:
+            state['model'], state['version'] = load_model_artifact(latest), latest.name
+        state['model'].predict(batch)
+        return state['version']
+
+    client = threading.Thread(target=run_load, args=(predict, batches, stop_event, records))
+    client.start()
+    time.sleep(phase_seconds)
+    published = time.perf_counter()
+    staged_dirpath.rename(model_dirpath / staged_dirpath.name)
+    time.sleep(phase_seconds)
+    stop_event.set()
+    client.join()
+
+    rows = summarize(records, {
+        'before_swap': (0, published),
+        'swap': (published, published + 1),
+        'after_swap': (published + 1, float('inf')),
+        })
+    for row in rows:
+        row['mode'] = 'reload'
+    return rows
+
+
+def benchmark_model_registry(
+        size=5000,
+        batch_size=8,
+        phase_seconds=3.0,
+        poll_seconds=0.2,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the p50/p99/max predict() latencies of batch_size
+    items, under steady load, before/during/after a model version swap (and a
+    rollback), for the registry and for a stop-the-world reload.
+
+    Keyword Arguments:
+        size -- the number of synthetic trainset items
+            (default: 5000)
+        batch_size -- the number of items per request
+            (default: 8)
+        phase_seconds -- the duration of each load phase
+            (default: 3.0)
+        poll_seconds -- the registry's polling interval
+            (default: 0.2)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking the model registry...')
+
+    work_dirpath = Path(tempfile.mkdtemp(prefix='slo-benchmark-'))
+    try:
+        x_values, _, _ = get_model_inputs(size, work_dirpath)
+        x_values = [str(x_value) for x_value in np.asarray(x_values)]
+        batches = [x_values[start:start + batch_size] for start in range(0, len(x_values), batch_size)]
+
+        rows = []
+        for mode in ('registry', 'reload'):
+            model_dirpath, staging_dirpath = work_dirpath / mode, work_dirpath / f'{mode}-staging'
+            build_version(size, work_dirpath, model_dirpath, 'v1', seed=1)
+            staged_dirpath = build_version(size, work_dirpath, staging_dirpath, 'v2', seed=2)
+            if mode == 'registry':
+                registry_rows, swap_seconds = benchmark_registry(
+                    model_dirpath, staged_dirpath, batches, phase_seconds, poll_seconds
+                    )
+                rows.extend(registry_rows)
+            else:
+                rows.extend(benchmark_reload(model_dirpath, staged_dirpath, batches, phase_seconds))
+    finally:
+        shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    results = pd.DataFrame(rows)[['mode', 'window', 'requests', 'p50_ms', 'p99_ms', 'max_ms']].round(2)
+    print(results.to_string(index=False))
+    print(f'\nthe registry swapped the new version in {swap_seconds:.2f}s after its publication')
+
+
+if __name__ == '__main__':
+    Fire(benchmark_model_registry)
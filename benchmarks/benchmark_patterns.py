@@ -0,0 +1,177 @@
+"""
+This module fuzzes the tweet sub-string pattern catalogue (see
+src/pattern_registry.py) with adversarial texts: it checks that the registry's
+patterns transform random hostile texts exactly as the original settings.py
+patterns do, and times each pattern on adversarial texts of growing length.
+
+The scaling exponent of each pattern (the slope of log time vs. log length,
+see benchmark_pipeline.compute_scaling_exponent()) should stay close to 1.0
+(linear); the original PTN_cash, for instance, is quadratic in the number of $s.
+"""
+import logging
+import random
+import re
+import time
+import pandas as pd
+from fire import Fire
+
+import src.settings
+from src.pattern_registry import CATALOGUE, PatternRegistry
+from benchmarks.benchmark_pipeline import compute_scaling_exponent
+from benchmarks.synthetic_tweets import get_dataset_rows
+
+logger = logging.getLogger(__name__)
+
+# The catalogue patterns as they were before the linear rewrites.
+LEGACY_PATTERNS = dict(
+    {name: getattr(src.settings, name) for name in CATALOGUE},
+    PTN_url=re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
+    )
+
+# The replacement dataset_normalizer uses for each pattern.
+REPLACEMENTS = {
+    'PTN_rt': '',
+    'PTN_whitespace': ' ',
+    'PTN_concatenated_url': r'\1 http',
+    'PTN_mention': 'slo_mention',
+    'PTN_url': 'slo_url',
+    'PTN_elongation': r'\1\1\1',
+    'PTN_year': 'slo_year',
+    'PTN_time': 'slo_time',
+    'PTN_cash': 'slo_cash',
+    'PTN_hash': 'slo_hash',
+}
+
+# Adversarial texts of a given length, by name.
+ADVERSARIAL_TEXTS = {
+    'dollars': lambda length: ('$1 ' * length)[:length - 1] + '(',
+    'dollar_parens': lambda length: ('$(1 ' * length)[:length],
+    'dollar_lines': lambda length: ('$(1\n)' * length)[:length],
+    'url_escapes': lambda length: ('http://' + '%a0' * length)[:length],
+    'http_runs': lambda length: ('xhttp' * length)[:length],
+    'elongation': lambda length: ('aab' * length)[:length],
+    'long_run': lambda length: 'a' * length,
+    'digits': lambda length: ('12:3' * length)[:length],
+    'mentions_hashes': lambda length: ('@a#b' * length)[:length],
+    'whitespace': lambda length: ' \u00a0\n\t' * (length // 4),
+    # Not adversarial: synthetic tweets, for the engines' cost on typical texts.
+    'tweets': lambda length: ' '.join(row['text'] for row in get_dataset_rows(length // 100 + 1))[:length],
+}
+
+# The characters of the random fuzz texts, biased towards the patterns' syntax.
+FUZZ_ALPHABET = list('$$$(()),.0123456789:%@#_aAbBkmxé \n ') + \
+    ['http', 'https://', ' hundred', ' million', 'RT @', '٣']
+
+
+def get_fuzz_texts(count, max_length, seed=0):
+    """Return count random texts of the fuzz alphabet's characters/tokens."""
+    rng = random.Random(seed)
+    return [
+        ''.join(rng.choices(FUZZ_ALPHABET, k=rng.randint(0, max_length)))
+        for _ in range(count)
+        ]
+
+
+def find_mismatches(registry, texts):
+    """Return the (pattern, text) pairs that the registry and the legacy
+    patterns transform (or, for the findall() patterns, match) differently.
+    """
+    mismatches = []
+    for name in CATALOGUE:
+        legacy, current = LEGACY_PATTERNS[name], registry[name]
+        for text in texts:
+            if legacy.sub(REPLACEMENTS[name], text) != current.sub(REPLACEMENTS[name], text) or (
+                    name in ('PTN_mention', 'PTN_url') and legacy.findall(text) != current.findall(text)):
+                mismatches.append((name, text))
+    return mismatches
+
+
+def time_sub(pattern, replacement, text, repeats):
+    """Return the best time of the given number of pattern.sub() runs, in seconds."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pattern.sub(replacement, text)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_patterns(
+        lengths=(280, 2800, 28000),
+        repeats=3,
+        engine='auto',
+        legacy=True,
+        fuzz_count=20000,
+        fuzz_max_length=60,
+        max_exponent=1.5,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the registry's report, checks the registry against the
+    legacy patterns on random fuzz texts and prints each pattern's time on
+    each adversarial text, by length, with its scaling exponent.
+
+    Keyword Arguments:
+        lengths -- the adversarial text lengths (280 is a full tweet)
+            (default: (280, 2800, 28000))
+        repeats -- the number of timed runs per pattern/text (the best is kept)
+            (default: 3)
+        engine -- the registry's engine: 'auto', 're2' or 're'
+            (default: 'auto' -- RE2, if installed)
+        legacy -- whether to time the legacy patterns as well
+            (default: True)
+        fuzz_count -- the number of random fuzz texts
+            (default: 20000)
+        fuzz_max_length -- the maximum number of characters/tokens per fuzz text
+            (default: 60)
+        max_exponent -- the scaling exponent above which a pattern is flagged
+            as superlinear
+            (default: 1.5)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking patterns...')
+    registry = PatternRegistry(engine=engine)
+    print(registry.get_report().to_string(index=False))
+
+    mismatches = find_mismatches(registry, get_fuzz_texts(fuzz_count, fuzz_max_length))
+    print(f'\n{len(mismatches)} mismatch(es) with the legacy patterns on {fuzz_count} fuzz texts')
+    for name, text in mismatches[:10]:
+        logger.warning('\t%s mismatch on %r', name, text)
+        print(f'\t{name}: {text!r}')
+
+    lengths = [lengths] if isinstance(lengths, int) else sorted(lengths)
+    versions = {'registry': registry, 'legacy': LEGACY_PATTERNS} if legacy else {'registry': registry}
+    rows = []
+    for text_name, get_text in ADVERSARIAL_TEXTS.items():
+        texts = {length: get_text(length) for length in lengths}
+        for name in CATALOGUE:
+            for version, patterns in versions.items():
+                timings = {
+                    str(length): time_sub(patterns[name], REPLACEMENTS[name], text, repeats)
+                    for length, text in texts.items()
+                    }
+                row = {'text': text_name, 'pattern': name, 'version': version}
+                row.update({f'us_{length}': round(seconds * 1e6, 1) for length, seconds in timings.items()})
+                row['exponent'] = compute_scaling_exponent(timings)
+                rows.append(row)
+                logger.info('\t%s', row)
+    results = pd.DataFrame(rows)
+
+    # Adversarial texts are the worst case per tweet, so show the catalogue's
+    # total per-tweet cost on each (at the first length) and the flagged rows.
+    first_column = f'us_{lengths[0]}'
+    print(f'\ncatalogue cost per adversarial text of {lengths[0]} characters (us):')
+    print(results.pivot_table(index='text', columns='version', values=first_column, aggfunc='sum').to_string())
+    superlinear = results[results['exponent'].astype(float) > max_exponent]
+    print(f'\npatterns scaling above {max_exponent}:')
+    print(superlinear.to_string(index=False) if not superlinear.empty else '\tnone')
+
+
+if __name__ == '__main__':
+    Fire(benchmark_patterns)
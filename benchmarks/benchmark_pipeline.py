@@ -0,0 +1,350 @@
+"""
+This module times the pipeline's hot paths on synthetic tweets (see
+synthetic_tweets.py) at several data sizes, and compares the timings against
+a saved baseline so that scaling regressions show up over time.
+
+Each benchmark is timed as the best of several repeats (after an untimed
+setup) and reported both as seconds and as microseconds per item. The scaling
+exponent of each benchmark (the slope of log time vs. log size; ~1.0 for
+linear) is compared as well, since it catches regressions that absolute
+timings on different machines hide.
+"""
+import json
+import logging
+import platform
+import shutil
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from benchmarks.synthetic_tweets import \
+    write_raw_tweets, get_dataset_rows, write_word_vectors
+
+logger = logging.getLogger(__name__)
+
+BASELINE_FILEPATH = Path(__file__).parent / 'baselines' / 'baseline.json'
+
+
+def setup_create_dataset(size, work_dirpath):
+    """Benchmarks dataset_preprocessor.create_dataset on raw JSON-lines tweets."""
+    from src.dataset_preprocessor import create_dataset
+
+    input_filepath = work_dirpath / f'raw-{size}.json'
+    output_filepath = work_dirpath / f'dataset-{size}.csv'
+    write_raw_tweets(input_filepath, size)
+
+    def run():
+        output_filepath.unlink(missing_ok=True)
+        create_dataset(input_filepath, output_filepath, 'utf-8', True, True)
+    return run
+
+
+def setup_normalize_tokenize_text(size, work_dirpath):
+    """Benchmarks dataset_normalizer.normalize_tokenize_text on tweet texts."""
+    from src.dataset_normalizer import normalize_tokenize_text
+
+    texts = [row['text'] for row in get_dataset_rows(size)]
+    return lambda: [normalize_tokenize_text(text) for text in texts]
+
+
+def setup_compute_company(size, work_dirpath):
+    """Benchmarks dataset_preprocessor.compute_company on tweet rows."""
+    from src.dataset_preprocessor import compute_company
+
+    rows = get_dataset_rows(size)
+    return lambda: [compute_company(row) for row in rows]
+
+
+def get_normalized_frame(size):
+    """Returns a normalized (dataset_norm.csv-shaped) frame of synthetic tweets."""
+    from src.dataset_normalizer import normalize_tokenize_text
+
+    data_frame = pd.DataFrame(get_dataset_rows(size))
+    data_frame['tweet_norm'] = data_frame['text'].apply(normalize_tokenize_text)
+    data_frame['profile_norm'] = data_frame['user_description'].apply(normalize_tokenize_text)
+    return data_frame.drop(columns=['text', 'user_description'])
+
+
+def setup_autocoding(size, work_dirpath):
+    """Benchmarks the auto-coding rules of autocoding_processor over all the
+    trainset companies.
+    """
+    from src.autocoding_processor import code_company_tweets
+    from src.settings import company_list
+
+    data_frame = get_normalized_frame(size).drop(columns=['stance'])
+
+    def run():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for company in company_list:
+                code_company_tweets(data_frame, company, None, None, False)
+    return run
+
+
+def get_model_inputs(size, work_dirpath):
+    """Returns the x/y values of a synthetic trainset (x as load_dataset()
+    returns it) and the path of matching word vectors, writing the vectors the
+    first time they are requested.
+    """
+    from src.model_utilities import get_x, ParsedDocuments
+
+    data_frame = get_normalized_frame(size)
+    x_values = ParsedDocuments([
+        get_x(row, auto_tagged=False, profile=True)
+        for row in data_frame.to_dict('records')
+        ])
+    y_values = data_frame['stance'].map({'against': 0, 'for': 1, 'neutral': 2}).to_numpy()
+    word_vectors_filepath = work_dirpath / f'wordvec-{size}.vec'
+    if not word_vectors_filepath.exists():
+        write_word_vectors(
+            word_vectors_filepath,
+            data_frame['tweet_norm'].tolist() + data_frame['profile_norm'].tolist()
+            )
+    return x_values, y_values, word_vectors_filepath
+
+
+def setup_embedding_transform(size, work_dirpath):
+    """Benchmarks model_svm.EmbeddingVectorizer.transform."""
+    from gensim.models import KeyedVectors
+    from src.model_svm import EmbeddingVectorizer
+
+    x_values, _, word_vectors_filepath = get_model_inputs(size, work_dirpath)
+    vectorizer = EmbeddingVectorizer(
+        KeyedVectors.load_word2vec_format(word_vectors_filepath, binary=False),
+        profile=True
+        )
+    return lambda: vectorizer.transform(x_values)
+
+
+def setup_model_fit(size, work_dirpath):
+    """Benchmarks fitting the full stance model (features and SVM)."""
+    from src.model_svm import get_model
+
+    x_values, y_values, word_vectors_filepath = get_model_inputs(size, work_dirpath)
+    model = get_model(word_vectors_filepath, profile=True)
+    return lambda: model.fit(x_values, y_values)
+
+
+def setup_model_predict(size, work_dirpath):
+    """Benchmarks predicting with the full stance model, fitted on the same items."""
+    from src.model_svm import get_model
+
+    x_values, y_values, word_vectors_filepath = get_model_inputs(size, work_dirpath)
+    model = get_model(word_vectors_filepath, profile=True).fit(x_values, y_values)
+    return lambda: model.predict(x_values)
+
+
+BENCHMARKS = {
+    'create_dataset': setup_create_dataset,
+    'normalize_tokenize_text': setup_normalize_tokenize_text,
+    'compute_company': setup_compute_company,
+    'autocoding': setup_autocoding,
+    'embedding_transform': setup_embedding_transform,
+    'model_fit': setup_model_fit,
+    'model_predict': setup_model_predict,
+    }
+
+
+def time_benchmark(setup, size, repeats, work_dirpath):
+    """Runs the given benchmark setup and returns the best time of the given
+    number of repeats, in seconds.
+    """
+    run = setup(size, work_dirpath)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def compute_scaling_exponent(timings):
+    """Returns the least-squares slope of log(time) vs. log(size) for the
+    given {size: seconds} timings, or None if there are fewer than two sizes.
+    """
+    points = [(int(size), seconds) for size, seconds in timings.items() if seconds]
+    if len(points) < 2:
+        return None
+    log_sizes = np.log([size for size, _ in points])
+    log_times = np.log([seconds for _, seconds in points])
+    return float(np.polyfit(log_sizes, log_times, 1)[0])
+
+
+def run_benchmarks(names, sizes, repeats, work_dirpath):
+    """Runs the given benchmarks at the given sizes and returns the results as
+    {benchmark: {'timings': {size: seconds}, 'scaling_exponent': ...}}.
+    Benchmarks whose module can't be imported (e.g., missing polyglot) are
+    recorded as skipped.
+    """
+    results = {}
+    for name in names:
+        logger.info('\tbenchmarking %s...', name)
+        result = {'timings': {}, 'scaling_exponent': None}
+        try:
+            for size in sizes:
+                seconds = time_benchmark(BENCHMARKS[name], size, repeats, work_dirpath)
+                result['timings'][str(size)] = seconds
+                logger.info('\t\t%s items: %.4fs (%.1fus/item)', size, seconds, seconds / size * 1e6)
+        except ImportError as error:
+            logger.warning('\t\tskipping %s: %s', name, error)
+            result['skipped'] = str(error)
+        result['scaling_exponent'] = compute_scaling_exponent(result['timings'])
+        results[name] = result
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    """Compares the given results against the given baseline results, returning
+    a table of time ratios (current/baseline) and scaling exponents, with the
+    rows where either exceeds the given relative tolerance flagged.
+    """
+    rows = []
+    for name, result in results.items():
+        baseline_result = baseline['results'].get(name)
+        if baseline_result is None:
+            continue
+        for size, seconds in result['timings'].items():
+            baseline_seconds = baseline_result['timings'].get(size)
+            if baseline_seconds is None:
+                continue
+            rows.append({
+                'benchmark': name,
+                'size': int(size),
+                'seconds': seconds,
+                'baseline_seconds': baseline_seconds,
+                'ratio': seconds / baseline_seconds,
+                'regression': seconds / baseline_seconds > 1 + tolerance,
+                })
+        exponent = result['scaling_exponent']
+        baseline_exponent = baseline_result['scaling_exponent']
+        if exponent is not None and baseline_exponent is not None:
+            rows.append({
+                'benchmark': name,
+                'size': 'scaling',
+                'seconds': exponent,
+                'baseline_seconds': baseline_exponent,
+                'ratio': exponent / baseline_exponent,
+                'regression': exponent - baseline_exponent > tolerance,
+                })
+    return pd.DataFrame(rows)
+
+
+def format_results(results):
+    """Returns a table of the given results, one row per benchmark and size."""
+    rows = []
+    for name, result in results.items():
+        if 'skipped' in result:
+            rows.append({'benchmark': name, 'size': None, 'seconds': None, 'us_per_item': None})
+        for size, seconds in result['timings'].items():
+            rows.append({
+                'benchmark': name,
+                'size': int(size),
+                'seconds': round(seconds, 4),
+                'us_per_item': round(seconds / int(size) * 1e6, 1),
+                })
+    return pd.DataFrame(rows)
+
+
+def benchmark_pipeline(
+        benchmarks=None,
+        sizes=(1000, 4000, 16000),
+        repeats=3,
+        output_filepath=None,
+        baseline_filepath=str(BASELINE_FILEPATH),
+        save_baseline=False,
+        tolerance=0.25,
+        work_path=None,
+        logging_level=logging.INFO
+        ):
+    """This tool times the pipeline's hot paths on synthetic tweets at several
+    data sizes, prints the timings and compares them against the saved baseline,
+    if there is one.
+
+    Keyword Arguments:
+        benchmarks -- the names of the benchmarks to run
+            (default: None -- all of: create_dataset, normalize_tokenize_text,
+            compute_company, autocoding, embedding_transform, model_fit,
+            model_predict)
+        sizes -- the numbers of tweets to benchmark with
+            (default: (1000, 4000, 16000))
+        repeats -- the number of timed runs per benchmark/size (the best is kept)
+            (default: 3)
+        output_filepath -- the file (.json) in which to save the results
+            (default: None -- don't save the results)
+        baseline_filepath -- the baseline results file (.json) to compare against
+            (default: benchmarks/baselines/baseline.json)
+        save_baseline -- whether to save the results as the new baseline
+            (default: False)
+        tolerance -- the relative slow-down (and the absolute increase in the
+            scaling exponent) flagged as a regression
+            (default: 0.25)
+        work_path -- the directory in which to write the synthetic input files
+            (default: None -- a temporary directory)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking pipeline...')
+
+    names = list(BENCHMARKS) if benchmarks is None else \
+        [benchmarks] if isinstance(benchmarks, str) else list(benchmarks)
+    unknown_names = set(names) - set(BENCHMARKS)
+    if unknown_names:
+        raise ValueError(f'unknown benchmarks: {sorted(unknown_names)}')
+    sizes = [sizes] if isinstance(sizes, int) else sorted(sizes)
+
+    work_dirpath = Path(work_path or tempfile.mkdtemp(prefix='slo-benchmark-'))
+    work_dirpath.mkdir(parents=True, exist_ok=True)
+    try:
+        results = run_benchmarks(names, sizes, repeats, work_dirpath)
+    finally:
+        if work_path is None:
+            shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            },
+        'sizes': sizes,
+        'repeats': repeats,
+        'results': results,
+        }
+    print(format_results(results).to_string(index=False))
+
+    baseline_filepath = Path(baseline_filepath)
+    if baseline_filepath.exists():
+        with open(baseline_filepath, encoding='utf-8') as fin:
+            baseline = json.load(fin)
+        comparison = compare_results(results, baseline, tolerance)
+        if not comparison.empty:
+            print(f'\ncompared with baseline of {baseline["created"]} ({baseline_filepath}):')
+            print(comparison.to_string(index=False, float_format=lambda value: f'{value:.3f}'))
+            regressions = comparison[comparison['regression']]
+            if not regressions.empty:
+                logger.warning('\tregressions:\n%s', regressions)
+                print(f'\n{len(regressions)} regression(s) beyond {tolerance:.0%} tolerance')
+
+    for filepath in [output_filepath, baseline_filepath if save_baseline else None]:
+        if filepath is not None:
+            Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+            with open(filepath, 'w', encoding='utf-8') as fout:
+                json.dump(report, fout, indent=2)
+            logger.info('\tsaved results to %s', filepath)
+
+
+if __name__ == '__main__':
+    Fire(benchmark_pipeline)
@@ -0,0 +1,131 @@
+"""
+This module measures the prediction cache (see src/prediction_cache.py) on a
+stream of synthetic x values (see synthetic_tweets.py) in which a given
+fraction of the items repeats earlier ones, as retweets and copy-paste
+campaigns do.
+
+The stream is predicted in batches (1) without a cache, (2) with a cold cache
+(memory and disk tiers), (3) with a new cache over the same disk tier, as a
+restarted process would, and (4) with that cache again, warm in memory. Each
+run is checked against the uncached predictions.
+"""
+import logging
+import shutil
+import tempfile
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from benchmarks.benchmark_pipeline import get_model_inputs
+
+logger = logging.getLogger(__name__)
+
+
+def get_stream(x_values, size, duplicate_fraction, seed=0):
+    """Return size x values in which about duplicate_fraction of the items
+    repeat an earlier item (popular items more often).
+    """
+    rng = np.random.default_rng(seed)
+    stream = []
+    new_index = 0
+    for _ in range(size):
+        if stream and rng.random() < duplicate_fraction:
+            # Favor the recent items, as bursts of retweets do.
+            stream.append(stream[-1 - min(int(rng.exponential(50)), len(stream) - 1)])
+        else:
+            stream.append(x_values[new_index % len(x_values)])
+            new_index += 1
+    return stream
+
+
+def run_stream(predict, stream, batch_size):
+    """Predict the stream in batches and return the predictions and time."""
+    start = time.perf_counter()
+    y_predicted = np.concatenate([
+        predict(np.asarray(stream[start_index:start_index + batch_size], dtype=str))
+        for start_index in range(0, len(stream), batch_size)
+        ])
+    return y_predicted, time.perf_counter() - start
+
+
+def benchmark_prediction_cache(
+        size=20000,
+        train_size=5000,
+        batch_size=100,
+        duplicate_fraction=0.4,
+        logging_level=logging.INFO
+        ):
+    """This tool prints the time, hit rate and throughput of predicting a
+    stream of x values with and without the prediction cache.
+
+    Keyword Arguments:
+        size -- the number of x values in the stream
+            (default: 20000)
+        train_size -- the number of synthetic trainset items
+            (default: 5000)
+        batch_size -- the number of x values per predict() call
+            (default: 100)
+        duplicate_fraction -- the fraction of the stream that repeats earlier
+            x values
+            (default: 0.4)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking the prediction cache...')
+    from src.model_svm import get_model
+    from src.prediction_cache import PredictionCache
+
+    work_dirpath = Path(tempfile.mkdtemp(prefix='slo-benchmark-'))
+    try:
+        x_values, y_values, word_vectors_filepath = get_model_inputs(train_size, work_dirpath)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model = get_model(word_vectors_filepath, profile=True).fit(x_values, y_values)
+        # The new items of the stream (mostly) differ from the trainset's.
+        stream_x_values, _, _ = get_model_inputs(size, work_dirpath)
+        stream = get_stream(np.asarray(stream_x_values).tolist()[::-1], size, duplicate_fraction)
+        cache_filepath = work_dirpath / 'predictions.sqlite'
+
+        y_expected, seconds = run_stream(model.predict, stream, batch_size)
+        rows = [{'run': 'uncached', 'seconds': seconds, 'hit_rate': 0.0, 'matches': True}]
+        cold_cache = PredictionCache(cache_filepath=cache_filepath, model_version='v1')
+        restarted_cache = None
+        for name in ('cold', 'disk', 'warm'):
+            if name == 'disk':
+                cold_cache.close()
+                restarted_cache = PredictionCache(cache_filepath=cache_filepath, model_version='v1')
+            cache = cold_cache if name == 'cold' else restarted_cache
+            metrics_before = cache.get_metrics()
+            y_predicted, seconds = run_stream(lambda batch: cache.predict(model, batch), stream, batch_size)
+            metrics = cache.get_metrics()
+            requests = metrics['requests'] - metrics_before['requests']
+            hits = metrics['hits'] + metrics['disk_hits'] - metrics_before['hits'] - metrics_before['disk_hits']
+            rows.append({
+                'run': name,
+                'seconds': seconds,
+                'hit_rate': hits / requests,
+                'disk_hits': metrics['disk_hits'] - metrics_before['disk_hits'],
+                'matches': bool(np.array_equal(y_predicted, y_expected)),
+                })
+            logger.info('\t%s: %s', name, rows[-1])
+        restarted_cache.close()
+    finally:
+        shutil.rmtree(work_dirpath, ignore_errors=True)
+
+    results = pd.DataFrame(rows).fillna({'disk_hits': 0})
+    results['items_per_s'] = size / results['seconds']
+    results['speedup'] = results['seconds'].iloc[0] / results['seconds']
+    print(results.round(3).to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(benchmark_prediction_cache)
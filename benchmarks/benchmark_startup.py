@@ -0,0 +1,150 @@
+"""
+This module measures the startup cost of each slo.py command (see
+src/slo.py): the import time of the command's tool module, measured with
+python -X importtime in a fresh interpreter, the heavy dependency stacks that
+the import loads and the wall-clock time of `slo.py <command> --help`.
+
+The import times are the best of several runs, since they vary with the file
+system cache.
+"""
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+import pandas as pd
+from fire import Fire
+
+from src.slo import COMMANDS, NOSQL_DIRPATH
+
+logger = logging.getLogger(__name__)
+
+BASE_DIRPATH = Path(__file__).parent.parent
+SLO_FILEPATH = BASE_DIRPATH / 'src' / 'slo.py'
+
+# The dependency stacks that take (tens of) milliseconds or more to import.
+HEAVY_PACKAGES = [
+    'pandas', 'numpy', 'scipy', 'sklearn', 'gensim', 'nltk', 'polyglot', 'requests', 'pymongo', 're2',
+]
+
+
+def get_environment():
+    """Return the environment of the measured interpreters, with the tool
+    modules on the path.
+    """
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([str(BASE_DIRPATH), str(NOSQL_DIRPATH)])
+    return environment
+
+
+def parse_importtime(stderr):
+    """Return the import times (in microseconds) in the given -X importtime
+    output as {module: (self, cumulative)}.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, module = line[len('import time:'):].split('|')
+        times[module.strip()] = (int(self_time), int(cumulative_time))
+    return times
+
+
+def time_import(module_name):
+    """Import the given module in a fresh interpreter and return its -X
+    importtime times, or raise a RuntimeError if it can't be imported.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        capture_output=True, text=True, env=get_environment(), cwd=BASE_DIRPATH
+        )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    return parse_importtime(process.stderr)
+
+
+def get_package_times(times):
+    """Return the total self import time (in milliseconds) of each heavy
+    package among the given import times.
+    """
+    package_times = defaultdict(float)
+    for module, (self_time, _) in times.items():
+        package = module.split('.')[0]
+        if package in HEAVY_PACKAGES:
+            package_times[package] += self_time / 1000
+    return package_times
+
+
+def time_help(command):
+    """Return the wall-clock time (in seconds) of `slo.py <command> --help`."""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(SLO_FILEPATH), command, '--help'],
+        capture_output=True, env=dict(get_environment(), PAGER='cat'), cwd=BASE_DIRPATH
+        )
+    return time.perf_counter() - start
+
+
+def benchmark_startup(
+        commands=None,
+        repeats=3,
+        output_filepath=None,
+        logging_level=logging.INFO
+        ):
+    """This tool prints, for each slo.py command, the import time of its tool
+    module, the heavy packages (and their import times) it loads and the time
+    of `slo.py <command> --help`.
+
+    Keyword Arguments:
+        commands -- the commands to measure
+            (default: None -- all the slo.py commands)
+        repeats -- the number of runs per command (the best is kept)
+            (default: 3)
+        output_filepath -- the file (.csv) in which to save the results
+            (default: None -- don't save the results)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('benchmarking startup...')
+
+    commands = list(COMMANDS) if commands is None else \
+        [commands] if isinstance(commands, str) else list(commands)
+    rows = []
+    for command in commands:
+        module_name = COMMANDS[command][0]
+        row = {'command': command}
+        try:
+            runs = [time_import(module_name) for _ in range(repeats)]
+        except RuntimeError as error:
+            logger.warning('\tskipping %s: %s', command, error)
+            rows.append(dict(row, error=str(error)))
+            continue
+        best = min(runs, key=lambda times: times[module_name][1])
+        package_times = get_package_times(best)
+        row['import_ms'] = round(best[module_name][1] / 1000, 1)
+        row['help_s'] = round(min(time_help(command) for _ in range(repeats)), 2)
+        row['heavy_packages'] = ' '.join(
+            f'{package}:{package_times[package]:.0f}'
+            for package in sorted(package_times, key=package_times.get, reverse=True)
+            if package_times[package] >= 1
+            )
+        rows.append(row)
+        logger.info('\t%s', row)
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False))
+    if output_filepath is not None:
+        results.to_csv(output_filepath, index=False)
+        logger.info('\tsaved results to %s', output_filepath)
+
+
+if __name__ == '__main__':
+    Fire(benchmark_startup)
@@ -0,0 +1,288 @@
+"""
+This module generates seeded synthetic tweets for the benchmarks, since the real
+dataset (data/dataset.json) is only available through DVC.
+
+The raw records have the shape of the Twitter feed read by dataset_preprocessor
+(full_text, user, entities.hashtags, retweeted_status, lang), mention the
+companies in settings.full_company_list using the surface forms recognized by
+settings.PTN_companies, and use the auto-coding rule keywords often enough for
+autocoding_processor to find for/against/neutral tweets. The same generator can
+also produce pre-processed (dataset.csv-shaped) rows and matching word vectors
+directly, so that each pipeline stage can be benchmarked on its own.
+"""
+import json
+import logging
+import random
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+from fire import Fire
+
+from src.settings import full_company_list, neutral_usernames, PTN_companies
+
+logger = logging.getLogger(__name__)
+
+# The surface forms used for each company in the tweet texts.
+COMPANY_FORMS = {
+    'adani': ['Adani', 'adani', '#Adani', '#StopAdani', '@AdaniAustralia'],
+    'bhp': ['BHP', 'bhp', 'B.H.P.', '#BHP', '@bhp'],
+    'cuesta': ['Cuesta Coal', 'cuesta'],
+    'fortescue': ['Fortescue', 'fortescue metals', '@FortescueNews'],
+    'iluka': ['Iluka', 'iluka resources'],
+    'newmont': ['Newmont', 'newmont mining'],
+    'oilsearch': ['Oil Search', 'oilsearch', 'Oil-Search'],
+    'riotinto': ['Rio Tinto', 'riotinto', 'Rio-Tinto', '@RioTinto'],
+    'santos': ['Santos', 'santos', '#Santos', '@SantosLtd'],
+    'whitehaven': ['Whitehaven', 'whitehaven coal'],
+    'woodside': ['Woodside', 'woodside energy'],
+    }
+
+# Relative mention frequencies, roughly as skewed as the real feed.
+COMPANY_WEIGHTS = {
+    'adani': 40, 'bhp': 15, 'santos': 10, 'riotinto': 10, 'fortescue': 5,
+    'whitehaven': 5, 'woodside': 5, 'oilsearch': 3, 'newmont': 3, 'iluka': 2, 'cuesta': 2,
+    }
+
+# Phrases that trigger (or don't trigger) the auto-coding rules.
+STANCE_PHRASES = {
+    'for': [
+        '#goadani jobs for the region', 'inspiring leadership from', 'great potential at',
+        'innovation award for', 'women in mining at', 'apprentice program by',
+        'record productivity for', 'health and safety win for', '#stopstopadani',
+        ],
+    'against': [
+        '#stopadani', 'protest today against', 'csg risk from', '#nocoal say no to',
+        'nonewcoal', 'climatechange is driven by', 'massive risk to the reef from',
+        ],
+    'neutral': [
+        'shares closed higher for', 'quarterly report released by', 'announced today',
+        'market update on', 'board meeting for',
+        ],
+    }
+
+FILLER_WORDS = (
+    'the a to of and in is for on that with this be are at it as we our they coal mine '
+    'water reef jobs energy gas queensland australia government project approval '
+    'community land future money bank loan export price rail port basin carmichael '
+    'galilee council vote labor liberal greens minister billion million deal workers '
+    'farmers traditional owners native title court appeal environment emissions '
+    'renewables solar wind power climate carbon tax iron ore lng gold copper profit '
+    'loss dividend ceo report news today week year time people country state'
+    ).split()
+
+EMOJIS = ['\U0001F621', '\U0001F44D', '\U0001F30F', '❤️', '\U0001F525']
+
+PROFILE_PHRASES = [
+    'Proud Aussie. Coffee, footy and fishing.',
+    'Climate activist | #StopAdani | she/her',
+    'Mining engineer. Views my own.',
+    'News and analysis from the ASX.',
+    'Farmer, father, Queenslander.',
+    '',
+    ]
+
+START_DATE = datetime(2018, 1, 1)
+
+
+class SyntheticTweets:
+    """A seeded generator of synthetic tweets. The same seed always produces
+    the same tweets, in the same order.
+    """
+
+    def __init__(self, seed=0, vocabulary_size=5000, user_count=2000):
+        self.random = random.Random(seed)
+        self.companies = list(full_company_list)
+        self.company_weights = [COMPANY_WEIGHTS.get(company, 1) for company in self.companies]
+        # A Zipf-distributed vocabulary: common words plus a long tail of rare ones.
+        self.words = FILLER_WORDS + [f'w{i:05d}' for i in range(vocabulary_size)]
+        self.word_weights = [1.0 / rank for rank in range(1, len(self.words) + 1)]
+        self.users = [f'user_{i:05d}' for i in range(user_count)]
+        self.company_usernames = [pattern[2] for pattern in PTN_companies]
+        self.next_id = 1000000000000000000
+
+    def choose_companies(self):
+        """Chooses the companies mentioned by a tweet, mostly one and sometimes two."""
+        companies = self.random.choices(self.companies, self.company_weights)
+        if self.random.random() < 0.05:
+            companies += self.random.choices(self.companies, self.company_weights)
+        return list(dict.fromkeys(companies))
+
+    def choose_author(self, stance, companies):
+        """Chooses the author's screen name, using neutral (news) accounts for
+        neutral tweets and, occasionally, the company's own account.
+        """
+        if stance == 'neutral' and self.random.random() < 0.6:
+            return self.random.choice(neutral_usernames)
+        if self.random.random() < 0.02:
+            return self.random.choice(self.company_usernames)
+        return self.random.choice(self.users)
+
+    def create_text(self, stance, companies, length):
+        """Creates a tweet text with the given stance phrase, company mentions and
+        Zipf-distributed filler words, plus the odd hashtag, URL, amount, time,
+        year, elongation and emoji handled by the normalizer.
+        """
+        tokens = self.random.choices(self.words, self.word_weights, k=length)
+        for company in companies:
+            tokens.insert(self.random.randrange(len(tokens) + 1), self.random.choice(COMPANY_FORMS[company]))
+        tokens.insert(self.random.randrange(len(tokens) + 1), self.random.choice(STANCE_PHRASES[stance]))
+        extras = [
+            (0.3, lambda: f'#{self.random.choice(FILLER_WORDS)}'),
+            (0.4, lambda: f'https://t.co/{self.random.getrandbits(40):010x}'),
+            (0.1, lambda: f'${self.random.randint(1, 999)}{self.random.choice(["", "m", " billion"])}'),
+            (0.05, lambda: f'{self.random.randint(0, 23)}:{self.random.randint(0, 59):02d}'),
+            (0.1, lambda: str(self.random.randint(1990, 2030))),
+            (0.05, lambda: 'sooooo'),
+            (0.1, lambda: self.random.choice(EMOJIS)),
+            (0.2, lambda: f'@{self.random.choice(self.users)}'),
+            ]
+        for probability, create_token in extras:
+            if self.random.random() < probability:
+                tokens.insert(self.random.randrange(len(tokens) + 1), create_token())
+        return ' '.join(tokens)
+
+    def create_user(self, screen_name):
+        """Creates the nested user structure of a tweet."""
+        return {
+            'id': zlib.crc32(screen_name.encode()),
+            'screen_name': screen_name,
+            'name': screen_name.replace('_', ' ').title(),
+            'description': self.random.choice(PROFILE_PHRASES),
+            'followers_count': int(self.random.paretovariate(1.2) * 10),
+            }
+
+    def create_entities(self, text):
+        """Creates the nested entities structure of a tweet, listing its hashtags."""
+        hashtags = []
+        start = text.find('#')
+        while start >= 0:
+            end = start + 1
+            while end < len(text) and (text[end].isalnum() or text[end] == '_'):
+                end += 1
+            if end > start + 1:
+                hashtags.append({'text': text[start + 1:end], 'indices': [start, end]})
+            start = text.find('#', end)
+        return {'hashtags': hashtags, 'symbols': [], 'user_mentions': [], 'urls': []}
+
+    def create_tweet(self):
+        """Creates one raw tweet record, returning it with its intended stance."""
+        self.next_id += self.random.randint(1, 10**6)
+        stance = self.random.choices(['for', 'against', 'neutral'], [25, 45, 30])[0]
+        companies = self.choose_companies()
+        screen_name = self.choose_author(stance, companies)
+        text = self.create_text(stance, companies, self.random.randint(5, 30))
+        created_at = START_DATE + timedelta(seconds=self.random.randint(0, 365 * 24 * 3600))
+        record = {
+            'id': self.next_id,
+            'id_str': str(self.next_id),
+            'created_at': created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+            'full_text': text,
+            'truncated': False,
+            'lang': 'en' if self.random.random() < 0.97 else self.random.choice(['und', 'es']),
+            'user': self.create_user(screen_name),
+            'entities': self.create_entities(text),
+            }
+        if self.random.random() < 0.3:
+            # Retweets start with the original author's mention and are often
+            # truncated, with the full original text in retweeted_status.
+            original_author = self.random.choice(self.users)
+            retweet_text = f'RT @{original_author}: {text}'
+            if len(retweet_text) > 140:
+                retweet_text = retweet_text[:139] + '…'
+            record['full_text'] = retweet_text
+            record['retweeted_status'] = {
+                'id': self.next_id - 1,
+                'full_text': text,
+                'user': self.create_user(original_author),
+                }
+        return record, stance
+
+    def generate(self, count):
+        """Yields the given number of (raw tweet record, intended stance) pairs."""
+        for _ in range(count):
+            yield self.create_tweet()
+
+
+def write_raw_tweets(filepath, count, seed=0):
+    """Writes the given number of synthetic raw tweets as JSON lines, the format
+    read by dataset_preprocessor.
+    """
+    with open(filepath, 'w', encoding='utf-8') as fout:
+        for record, _ in SyntheticTweets(seed).generate(count):
+            fout.write(json.dumps(record))
+            fout.write('\n')
+
+
+def get_dataset_rows(count, seed=0):
+    """Returns the given number of synthetic tweets as rows shaped like the
+    dataset_preprocessor output (dataset.csv), each with its intended stance.
+    The company is taken from the generator rather than computed, so this does
+    not depend on the pre-processor.
+    """
+    rows = []
+    generator = SyntheticTweets(seed)
+    for record, stance in generator.generate(count):
+        rows.append({
+            'id': record['id'],
+            'created_at': record['created_at'],
+            'lang': record['lang'],
+            'lang_polyglot': 'en',
+            'retweeted': record['full_text'].startswith('RT @'),
+            'hashtags': ','.join(hashtag['text'] for hashtag in record['entities']['hashtags']),
+            'company': '|'.join(
+                company for company in generator.companies
+                if any(form in record['full_text'] for form in COMPANY_FORMS[company])
+                ),
+            'text': record['full_text'],
+            'user_screen_name': record['user']['screen_name'],
+            'user_description': record['user']['description'],
+            'stance': stance,
+            })
+    return rows
+
+
+
+def write_word_vectors(filepath, texts, dimension=100, seed=0):
+    """Writes random word vectors (word2vec text format) for the tokens of the
+    given (normalized) texts.
+    """
+    vocabulary = sorted({token for text in texts for token in text.split()})
+    vectors = np.random.default_rng(seed).standard_normal((len(vocabulary), dimension))
+    with open(filepath, 'w', encoding='utf-8') as fout:
+        fout.write(f'{len(vocabulary)} {dimension}\n')
+        for word, vector in zip(vocabulary, vectors):
+            fout.write(f'{word} {" ".join(f"{value:.4f}" for value in vector)}\n')
+
+
+def synthetic_tweets(
+        output_filepath='synthetic_dataset.json',
+        count=10000,
+        seed=0,
+        logging_level=logging.INFO
+        ):
+    """This tool writes seeded synthetic raw tweets (JSON lines), e.g., as a
+    stand-in for dataset.json when running the pipeline without DVC access.
+
+    Keyword Arguments:
+        output_filepath -- the file to write
+            (default: 'synthetic_dataset.json')
+        count -- the number of tweets to generate
+            (default: 10000)
+        seed -- the random seed
+            (default: 0)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    write_raw_tweets(Path(output_filepath), count, seed)
+    logger.info('wrote %s synthetic tweets to %s', count, output_filepath)
+
+
+if __name__ == '__main__':
+    Fire(synthetic_tweets)
@@ -12,6 +12,7 @@ import pandas as pd
 from src.settings import \
     PTN_against, PTN_for, PTN_neutral_screen_names, \
     PTN_company_usernames, company_list
+from src.instrumentation import instrumented, stage
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +49,96 @@ def create_tweet_sample(df_all, sample_size, code, company):
     return df_all
 
 
+def code_company_tweets(df_all, company, testset_filename, testset_ids_pattern, company_tweets):
+    """Select the tweets for the given company and sample them into balanced
+    for/against/neutral auto-coded sets using the company's rule patterns.
+    """
+    df_companies = df_all.loc[(df_all['company'].str.contains(company))]
+    if testset_filename:
+        df_companies = df_all.loc[
+            (~df_all['id'].astype(str).str.match(testset_ids_pattern))
+            ]
+    logger.info('\t\t%s %s items loaded', get_size(df_companies), company)
+
+    # Replace all semicolons to fix column displacement issues.
+    df_companies['tweet_norm'] = df_companies['tweet_norm'].str.replace(";", "")
+    df_companies['profile_norm'] = df_companies['profile_norm'].str.replace(";", "")
+
+    # Annotate tweets with suspected stance values using rule patterns:
+    # - For-stance tweets follow known positive patterns or come from the company itself.
+    df_companies['auto_for'] = df_companies['tweet_norm'].str.contains(PTN_for[company])
+    if company_tweets:
+        df_companies['auto_for'] = pd.concat([
+            df_companies['auto_for'],
+            df_companies['user_screen_name'].str.match(PTN_company_usernames)
+            ], ignore_index=True)
+    # - Against-stance tweets follow known negative patterns.
+    df_companies['auto_against'] = (
+        df_companies['tweet_norm'].str.contains(PTN_against[company])
+    )
+    # - Neutral-stance tweets come from neutral accounts.
+    df_companies['auto_neutral'] = (
+        df_companies['user_screen_name'].str.match(PTN_neutral_screen_names)
+    )
+
+    # Collect tweets that are to be coded for each stance value.
+    df_for = df_companies.loc[
+        df_companies['auto_for'] & ~df_companies['auto_against']
+        & ~df_companies['auto_neutral'] & ~df_companies['retweeted']
+        ]
+    df_against = df_companies.loc[
+        ~df_companies['auto_for'] & df_companies['auto_against']
+        & ~df_companies['auto_neutral'] & ~df_companies['retweeted']
+        ]
+    df_neutral = df_companies.loc[
+        ~df_companies['auto_for'] & ~df_companies['auto_against']
+        & df_companies['auto_neutral'] & ~df_companies['retweeted']
+        ]
+
+    min_sample_size = min(
+        df_for.shape[0],
+        df_against.shape[0],
+        df_neutral.shape[0]
+        )
+    logger.info('\t\twill sample %s items per company', min_sample_size)
+
+
+    # Get samples of for/against/neutral tweets.
+    df_for = create_tweet_sample(df_for, min_sample_size, 'for', company)
+    df_against = create_tweet_sample(df_for, min_sample_size, 'against', company)
+    df_neutral = create_tweet_sample(df_for, min_sample_size, 'neutral', company)
+
+    # ambiguous_df = df.loc[(df['auto_for'] & df['auto_against']) |
+    #                       (~df['auto_for'] & ~df['auto_against'] & ~df['auto_neutral'])]
+
+    # Remove the auto_* fields because they are useful only for computing the stance value.
+    df_companies.drop(columns=['auto_for', 'auto_against', 'auto_neutral'])
+
+    return df_for, df_against, df_neutral
+
+
+def autocode_dataset(df_all, testset_filename, testset_ids_pattern, company_tweets):
+    """Auto-code the tweets of each company in the given dataframe (see
+    code_company_tweets()) and return the combined for/against/neutral samples.
+    """
+    df_combined = pd.DataFrame()
+    for company in company_list:
+        with stage('code_company', rows_in=get_size(df_all)) as metrics:
+            df_for, df_against, df_neutral = code_company_tweets(
+                df_all, company, testset_filename, testset_ids_pattern, company_tweets
+                )
+            metrics.rows_out = get_size(df_for) + get_size(df_against) + get_size(df_neutral)
+
+        df_combined = pd.concat([df_combined, df_for, df_against, df_neutral], ignore_index=True)
+        # logger.info(
+        #     f'\tCompany: {company}\n\t\tfor: {get_size(df_for)} (out of {for_max_size})\n\t\tagainst: '
+        #     f'{get_size(df_against)} (out of {against_max_size})\n\t\tneutral: {get_size(df_neutral)} '
+        #     f'(out of {neutral_max_size})'
+        #     )
+    return df_combined
+
+
+@instrumented
 def main(
     dataset_path='.',
     input_filename='dataset_norm.csv',
@@ -55,7 +146,10 @@ def main(
     testset_filename=None,
     encoding='utf-8',
     logging_level: int=logging.INFO,
-    company_tweets=False
+    company_tweets=False,
+    report_dirname='reports',
+    cprofile=False,
+    trace_memory=False
     ):
     """This function creates a auto-coded dataset using distance supervision,
     for Adani only, using simple hashtag rules. The three stance codings are
@@ -79,6 +173,14 @@ def main(
             the level of logging to use (default: logging.INFO)
         company_tweets:
             whether to include tweets from company accounts (default: False)
+        report_dirname:
+            the directory in which to save the run's performance report
+            (see instrumentation.py), or None for no report (default: 'reports')
+        cprofile:
+            whether to include a cProfile profile in the report (default: False)
+        trace_memory:
+            whether to include tracemalloc allocation statistics in the report
+            (default: False)
 
     """
     logging.basicConfig(
@@ -96,85 +198,17 @@ def main(
 
     testset_ids_pattern = get_testset_ids_pattern(dataset_path, testset_filename, encoding)
 
-    df_all = pd.read_csv(input_filepath, encoding=encoding, engine='python')
+    with stage('read_dataset') as metrics:
+        df_all = pd.read_csv(input_filepath, encoding=encoding, engine='python')
+        metrics.rows_out = get_size(df_all)
     logger.info('\tloaded %s items from %s', get_size(df_all), input_filepath)
 
-    df_combined = pd.DataFrame()
-    for company in company_list:
-        df_companies = df_all.loc[(df_all['company'].str.contains(company))]
-        if testset_filename:
-            df_companies = df_all.loc[
-                (~df_all['id'].astype(str).str.match(testset_ids_pattern))
-                ]
-        logger.info('\t\t%s %s items loaded', get_size(df_companies), company)
-
-        # Replace all semicolons to fix column displacement issues.
-        df_companies['tweet_norm'] = df_companies['tweet_norm'].str.replace(";", "")
-        df_companies['profile_norm'] = df_companies['profile_norm'].str.replace(";", "")
-
-        # Annotate tweets with suspected stance values using rule patterns:
-        # - For-stance tweets follow known positive patterns or come from the company itself.
-        df_companies['auto_for'] = df_companies['tweet_norm'].str.contains(PTN_for[company])
-        if company_tweets:
-            df_companies['auto_for'] = pd.concat([
-                df_companies['auto_for'],
-                df_companies['user_screen_name'].str.match(PTN_company_usernames)
-                ], ignore_index=True)
-        # - Against-stance tweets follow known negative patterns.
-        df_companies['auto_against'] = (
-            df_companies['tweet_norm'].str.contains(PTN_against[company])
-        )
-        # - Neutral-stance tweets come from neutral accounts.
-        df_companies['auto_neutral'] = (
-            df_companies['user_screen_name'].str.match(PTN_neutral_screen_names)
-        )
-
-        # Collect tweets that are to be coded for each stance value.
-        df_for = df_companies.loc[
-            df_companies['auto_for'] & ~df_companies['auto_against']
-            & ~df_companies['auto_neutral'] & ~df_companies['retweeted']
-            ]
-        df_against = df_companies.loc[
-            ~df_companies['auto_for'] & df_companies['auto_against']
-            & ~df_companies['auto_neutral'] & ~df_companies['retweeted']
-            ]
-        df_neutral = df_companies.loc[
-            ~df_companies['auto_for'] & ~df_companies['auto_against']
-            & df_companies['auto_neutral'] & ~df_companies['retweeted']
-            ]
-
-        min_sample_size = min(
-            df_for.shape[0],
-            df_against.shape[0],
-            df_neutral.shape[0]
-            )
-        logger.info('\t\twill sample %s items per company', min_sample_size)
-
-
-        # Get samples of for/against/neutral tweets.
-        df_for = create_tweet_sample(df_for, min_sample_size, 'for', company)
-        df_against = create_tweet_sample(df_for, min_sample_size, 'against', company)
-        df_neutral = create_tweet_sample(df_for, min_sample_size, 'neutral', company)
-
-        # ambiguous_df = df.loc[(df['auto_for'] & df['auto_against']) |
-        #                       (~df['auto_for'] & ~df['auto_against'] & ~df['auto_neutral'])]
-
-        # Remove the auto_* fields because they are useful only for computing the stance value.
-        df_companies.drop(columns=['auto_for', 'auto_against', 'auto_neutral'])
-
-        df_combined = pd.concat([df_combined, df_for, df_against, df_neutral], ignore_index=True)
-        # logger.info(
-        #     f'\tCompany: {company}\n\t\tfor: {get_size(df_for)} (out of {for_max_size})\n\t\tagainst: '
-        #     f'{get_size(df_against)} (out of {against_max_size})\n\t\tneutral: {get_size(df_neutral)} '
-        #     f'(out of {neutral_max_size})'
-        #     )
-        # index = output_filepath.find('.csv')
-        # company_coding_filepath = output_filepath[:index] + "_" + company + output_filepath[index:]
-        # pd.concat([df_for, df_against, df_neutral]).to_csv(company_coding_filepath)
+    df_combined = autocode_dataset(df_all, testset_filename, testset_ids_pattern, company_tweets)
 
     # Save the auto-coded items in one file.
     logger.info('\tstoring auto-coded dataset file: %s', output_filepath)
-    df_combined.to_csv(output_filepath, index=False)
+    with stage('save_dataset', rows_in=get_size(df_combined)):
+        df_combined.to_csv(output_filepath, index=False)
 
 
 if __name__ == '__main__':
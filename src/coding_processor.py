@@ -4,10 +4,10 @@ See main() for the details.
 """
 import logging
 from pathlib import Path
-import requests
 import fire
 import pandas as pd
 from src.settings import PTN_mention
+from src.instrumentation import instrumented, stage
 
 logger = logging.getLogger(__name__)
 
@@ -85,6 +85,7 @@ def check_tweet_accessibility(tweet_url):
     Arguments:
         tweet_url -- the URL for the tweet
     """
+    import requests
     response = requests.get(tweet_url, timeout=5)
     # Accessible tweets give HTTP 200 and include the screen name and tweet
     # ID in the URL. Inaccessible tweets can give 404 responses or redirect
@@ -111,6 +112,7 @@ def create_tweet_url(tweet_id):
     return f'https://twitter.com/-/status/{tweet_id}'
 
 
+@instrumented
 def coding_processor(
     dataset_path='.',
     input_filename='dataset_norm.csv',
@@ -118,6 +120,9 @@ def coding_processor(
     size=10,
     company_names=None,
     encoding='utf-8',
+    report_dirname='reports',
+    cprofile=False,
+    trace_memory=False,
     logging_level=logging.INFO
     ):
     """This method selects a random set of tweets to code for each company of
@@ -150,6 +155,14 @@ def coding_processor(
             (default: None -- collect for all companies)
         encoding -- the file encoding to use
             (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
         logging_level -- the level of logging to use
             (default: logging.INFO)
     """
@@ -166,10 +179,13 @@ def coding_processor(
 
     logging.info('\tloading dataset file: %s', input_filepath)
     # Use the python engine because it is more complete (but slower).
-    data_frame = pd.read_csv(input_filepath, encoding=encoding, engine='python')
+    with stage('read_dataset') as metrics:
+        data_frame = pd.read_csv(input_filepath, encoding=encoding, engine='python')
+        metrics.rows_out = get_size(data_frame)
 
     logging.info('\tbuilding and saving the coding set to: %s', output_filepath)
-    create_save_coding_set(output_filepath, data_frame, size, company_names, encoding)
+    with stage('create_save_coding_set', rows_in=get_size(data_frame)):
+        create_save_coding_set(output_filepath, data_frame, size, company_names, encoding)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+"""
+This module stores word vectors at reduced precision for the embedding
+feature (model_svm.EmbeddingVectorizer), which otherwise holds (and, in a
+pickled model, copies) the full float32 gensim KeyedVectors.
+
+CompactKeyedVectors implements the part of the KeyedVectors interface that the
+models use (vector_size, `word in wordvec`, wordvec[word(s)]) over vectors
+stored as either:
+- float16 -- half the memory, ~3 significant digits
+- int8 -- a quarter of the memory, scalar-quantized per dimension: each
+    dimension's values are scaled by max(|value|) / 127 and rounded, and
+    looked-up vectors are the codes times the scales
+
+Lookups return float32 vectors, so EmbeddingVectorizer averages them in float32
+accumulators. The vocabulary can also be pruned to the tokens of a corpus,
+e.g., the tokens file the word vectors are trained on (dataset_norm.txt), which
+drops most of a pre-trained (e.g., 400k-word GloVe) vocabulary.
+
+Compact vectors are saved as <name>.cwv (a JSON header with the words) next to
+<name>.cwv.vectors.npy (and, for int8, <name>.cwv.scales.npy), which is
+memory-mapped on load. A converted file's name includes a digest of its
+sources' content, so it is never rewritten: model artifacts reference it by
+path, and a reader may have it memory-mapped. load_word_vectors() loads either format, so a .cwv file
+can stand in for a gensim .kv file anywhere the models take word vectors.
+
+See benchmarks/benchmark_compact_vectors.py for the memory, load time and F1
+of each precision.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+COMPACT_FORMAT_VERSION = 1
+COMPACT_SUFFIX = '.cwv'
+PRECISIONS = ['float32', 'float16', 'int8']
+INT8_MAX = 127
+
+
+def quantize(vectors):
+    """Return the given float vectors as int8 codes and per-dimension float32
+    scales.
+    """
+    scales = np.abs(vectors).max(axis=0).astype(np.float32) / INT8_MAX
+    # All-zero dimensions keep a scale of 1 to avoid dividing by zero.
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales).clip(-INT8_MAX, INT8_MAX).astype(np.int8)
+    return codes, scales
+
+
+def get_corpus_vocabulary(corpus_filepath, encoding='utf-8'):
+    """Return the set of space-separated tokens in the given text file."""
+    vocabulary = set()
+    with open(corpus_filepath, encoding=encoding) as fin:
+        for line in fin:
+            vocabulary.update(line.split())
+    return vocabulary
+
+
+class CompactKeyedVectors:
+    """Read-only word vectors stored at reduced precision (see the module
+    docstring).
+    """
+
+    def __init__(self, words, vectors, scales=None):
+        self.index_to_key = list(words)
+        self.key_to_index = {word: index for index, word in enumerate(self.index_to_key)}
+        self.vectors = vectors
+        self.scales = scales
+        self.vector_size = vectors.shape[1]
+
+    @property
+    def precision(self):
+        return 'int8' if self.scales is not None else str(self.vectors.dtype)
+
+    @property
+    def nbytes(self):
+        """The bytes of the vector (and scale) arrays."""
+        return self.vectors.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    @classmethod
+    def from_keyed_vectors(cls, wordvec, precision='float16', vocabulary=None):
+        """Return a compact copy of the given (gensim or compact) word vectors,
+        keeping only the words of the given vocabulary, if any.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f'unknown word vector precision {precision} - use one of {PRECISIONS}')
+        words = wordvec.index_to_key
+        if vocabulary is not None:
+            words = [word for word in words if word in vocabulary]
+        vectors = wordvec[words] if words else np.zeros((0, wordvec.vector_size), dtype=np.float32)
+        if precision == 'int8':
+            return cls(words, *quantize(vectors))
+        return cls(words, np.asarray(vectors, dtype=precision))
+
+    def __len__(self):
+        return len(self.index_to_key)
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def get_vectors(self, indexes):
+        """Return the (float32) vectors of the given word indexes."""
+        vectors = np.asarray(self.vectors[indexes], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales
+        return vectors
+
+    def __getitem__(self, words):
+        if isinstance(words, str):
+            return self.get_vectors(self.key_to_index[words])
+        return self.get_vectors([self.key_to_index[word] for word in words]).reshape(-1, self.vector_size)
+
+    def save(self, filepath, **kwargs):
+        """Save the vectors as the given .cwv file and its arrays. (kwargs,
+        e.g., gensim's separately, are ignored; the arrays are always saved
+        separately.)
+        """
+        filepath = Path(filepath)
+        np.save(f'{filepath}.vectors.npy', self.vectors)
+        if self.scales is not None:
+            np.save(f'{filepath}.scales.npy', self.scales)
+        with open(filepath, 'w', encoding='utf-8') as fout:
+            json.dump({
+                'format_version': COMPACT_FORMAT_VERSION,
+                'precision': self.precision,
+                'vector_size': self.vector_size,
+                'words': self.index_to_key,
+                }, fout)
+
+    @classmethod
+    def load(cls, filepath, mmap='r'):
+        """Load the given .cwv file, memory-mapping its arrays (unless mmap is
+        None).
+        """
+        with open(filepath, encoding='utf-8') as fin:
+            header = json.load(fin)
+        if header['format_version'] > COMPACT_FORMAT_VERSION:
+            raise ValueError(f'word vectors {filepath} have unsupported format version {header["format_version"]}')
+        vectors = np.load(f'{filepath}.vectors.npy', mmap_mode=mmap)
+        scales = np.load(f'{filepath}.scales.npy') if header['precision'] == 'int8' else None
+        return cls(header['words'], vectors, scales)
+
+
+def get_file_digest(filepath, digest_size=6):
+    """Return a (hex) BLAKE2b digest of the given file's content."""
+    digest = hashlib.blake2b(digest_size=digest_size)
+    with open(filepath, 'rb') as fin:
+        while chunk := fin.read(2**20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_word_vectors(wordvec, filepath):
+    """Save the given (gensim or compact) word vectors as the given file, with
+    their arrays saved separately, under a temporary name that is then renamed
+    into place, so the file never exists partially written.
+    """
+    filepath = Path(filepath)
+    tmp_filepath = filepath.with_name(f'{filepath.name}.{os.getpid()}.tmp')
+    wordvec.save(str(tmp_filepath), separately=['vectors'])
+    # The arrays first, so the file only appears with its arrays in place.
+    for array_filepath in filepath.parent.glob(glob.escape(tmp_filepath.name) + '.*'):
+        array_filepath.replace(filepath.with_name(filepath.name + array_filepath.name[len(tmp_filepath.name):]))
+    tmp_filepath.replace(filepath)
+
+
+def load_word_vectors(filepath, mmap='r'):
+    """Load the given gensim .kv or compact .cwv word vectors, memory-mapped."""
+    if Path(filepath).suffix == COMPACT_SUFFIX:
+        return CompactKeyedVectors.load(filepath, mmap=mmap)
+    from gensim.models import KeyedVectors
+    return KeyedVectors.load(str(filepath), mmap=mmap)
+
+
+def get_compact_embedding_filepath(word_vectors_filepath, precision='float16', corpus_filepath=None):
+    """Return the path of a compact (.cwv) copy of the given word vectors file
+    (word2vec text or gensim .kv) at the given precision, pruned to the tokens
+    of the given corpus file, if any, converting it the first time it is
+    requested.
+    """
+    # model_artifact imports the model modules lazily, as this module does.
+    from src.model_artifact import get_mmap_embedding_filepath
+
+    kv_filepath = get_mmap_embedding_filepath(word_vectors_filepath)
+    name = kv_filepath.stem + f'.{precision}'
+    if corpus_filepath is not None:
+        name += f'-{Path(corpus_filepath).stem}.{get_file_digest(corpus_filepath)}'
+    compact_filepath = kv_filepath.with_name(name + COMPACT_SUFFIX)
+    if not compact_filepath.exists():
+        logger.info('\tconverting %s to %s...', kv_filepath, compact_filepath)
+        vocabulary = None if corpus_filepath is None else get_corpus_vocabulary(corpus_filepath)
+        wordvec = CompactKeyedVectors.from_keyed_vectors(load_word_vectors(kv_filepath), precision, vocabulary)
+        save_word_vectors(wordvec, compact_filepath)
+        logger.info('\t\tkept %s words (%s bytes)', len(wordvec), wordvec.nbytes)
+    return compact_filepath
@@ -0,0 +1,221 @@
+"""
+This module removes near-duplicate tweets (retweets, copies and lightly edited
+copies) from a normalized dataset, keeping one representative per cluster of
+near-duplicates with the size of its cluster as a count weight.
+
+Near-duplicates are found using MinHash signatures of the tweets' normalized
+token sets (with mentions/URLs abstracted, see dataset_normalizer) and
+locality-sensitive hashing (LSH): tweets whose signatures agree on all the rows
+of any one band are candidate pairs, which are kept if their estimated Jaccard
+similarity reaches the threshold. The clusters are the connected components of
+the kept pairs.
+
+See main() for the details.
+"""
+import logging
+import zlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+from fire import Fire
+
+from src.dataset_normalizer import post_process_text
+from src.instrumentation import instrumented, stage
+
+logger = logging.getLogger(__name__)
+
+# A prime larger than the 32-bit token hashes, for the MinHash permutations.
+MINHASH_PRIME = np.uint64(4294967311)
+
+
+def get_token_hashes(text):
+    """Return the 32-bit hashes of the distinct tokens of the given normalized
+    text, with mentions and URLs abstracted so that retweets/copies of a tweet
+    by different users, with different short URLs, still match.
+    """
+    tokens = set(post_process_text(text).split())
+    return np.fromiter((zlib.crc32(token.encode()) for token in tokens), np.uint64, len(tokens))
+
+
+def get_permutations(num_perm, seed):
+    """Return the (a, b) coefficients of num_perm random hash permutations
+    h(x) = (a * x + b) mod MINHASH_PRIME. The coefficients are kept below 2**31
+    so that a * x + b doesn't overflow 64 bits.
+    """
+    rng = np.random.default_rng(seed)
+    return (
+        rng.integers(1, 2**31, num_perm, dtype=np.uint64),
+        rng.integers(0, 2**31, num_perm, dtype=np.uint64)
+        )
+
+
+def compute_signatures(texts, num_perm=64, seed=0, chunk_size=10000):
+    """Return the MinHash signatures (one row of num_perm values per text) of
+    the given texts, computed chunk_size texts at a time. Texts with no tokens
+    get a signature of their own (a unique negative value) so they match nothing.
+    """
+    a, b = get_permutations(num_perm, seed)
+    signatures = np.empty((len(texts), num_perm), dtype=np.int64)
+    for start in range(0, len(texts), chunk_size):
+        token_hashes = [get_token_hashes(text) for text in texts[start:start + chunk_size]]
+        lengths = np.array([len(hashes) for hashes in token_hashes])
+        nonempty = lengths > 0
+        all_hashes = np.concatenate(token_hashes) if nonempty.any() else np.empty(0, np.uint64)
+        # Permute all the tokens of the chunk at once, then take the minimum of
+        # each text's (contiguous) tokens.
+        permuted = (a[:, None] * all_hashes[None, :] + b[:, None]) % MINHASH_PRIME
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])[nonempty]
+        chunk_signatures = signatures[start:start + len(token_hashes)]
+        if nonempty.any():
+            chunk_signatures[nonempty] = np.minimum.reduceat(permuted, offsets, axis=1).T
+        empty_indexes = np.flatnonzero(~nonempty)
+        chunk_signatures[empty_indexes] = -(start + empty_indexes[:, None] + 1)
+    return signatures
+
+
+def find_similar_pairs(signatures, bands, threshold):
+    """Return the (i, j) index arrays of the candidate pairs found by LSH over
+    the given number of bands whose estimated Jaccard similarity (the fraction
+    of equal signature values) is at least the threshold. Each item of a bucket
+    is paired with the bucket's first item only, which suffices for clustering.
+    """
+    item_count, num_perm = signatures.shape
+    rows = num_perm // bands
+    pairs = []
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        band_keys = band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows))).ravel()
+        _, first_indexes, inverse = np.unique(band_keys, return_index=True, return_inverse=True)
+        representatives = first_indexes[inverse.ravel()]
+        candidates = np.flatnonzero(representatives != np.arange(item_count))
+        pairs.append(np.stack([candidates, representatives[candidates]]))
+    pairs = np.unique(np.concatenate(pairs, axis=1), axis=1) if pairs else np.empty((2, 0), int)
+    similarities = (signatures[pairs[0]] == signatures[pairs[1]]).mean(axis=1)
+    similar = similarities >= threshold
+    return pairs[0][similar], pairs[1][similar]
+
+
+def cluster_near_duplicates(texts, threshold=0.8, num_perm=64, bands=16, seed=0):
+    """Return the cluster label of each of the given normalized texts, where
+    texts with near-duplicates (Jaccard similarity of at least the threshold,
+    transitively) share a label.
+    """
+    if num_perm % bands != 0:
+        raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands})')
+    signatures = compute_signatures(texts, num_perm, seed)
+    rows, columns = find_similar_pairs(signatures, bands, threshold)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, columns)),
+        shape=(len(texts), len(texts))
+        )
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def select_representatives(data_frame, labels):
+    """Return one row per cluster, preferring original tweets over retweets
+    (then the first row), with the size of its cluster in cluster_size.
+    """
+    data_frame = data_frame.assign(cluster_size=np.bincount(labels)[labels])
+    priority = data_frame['retweeted'].astype(bool) if 'retweeted' in data_frame else \
+        pd.Series(False, index=data_frame.index)
+    order = np.lexsort((np.arange(len(labels)), priority.to_numpy(), labels))
+    first_in_cluster = np.ones(len(order), dtype=bool)
+    first_in_cluster[1:] = labels[order][1:] != labels[order][:-1]
+    return data_frame.iloc[np.sort(order[first_in_cluster])]
+
+
+@instrumented
+def main(
+        dataset_path='.',
+        input_filename='dataset_norm.csv',
+        output_filename='dataset_dedup.csv',
+        text_column_name='tweet_norm',
+        threshold=0.8,
+        num_perm=64,
+        bands=16,
+        seed=0,
+        encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
+        logging_level=logging.INFO
+        ):
+    """This tool loads the normalized tweets, clusters near-duplicate tweets and
+    saves one representative of each cluster, with a cluster_size column
+    giving the number of tweets it represents (e.g., for use as a training
+    sample weight, see model_build). Tweets are only compared with tweets about
+    the same company, and each cluster's representative is an original tweet,
+    if it has one, rather than a retweet.
+
+    Keyword Arguments:
+        dataset_path -- the system path from which to load the datasets
+            (default='.')
+        input_filename -- the name of the normalized dataset file to read
+            (default='dataset_norm.csv')
+        output_filename -- the name of the deduplicated dataset file to save
+            (default='dataset_dedup.csv')
+        text_column_name -- the column of normalized texts to compare
+            (default='tweet_norm')
+        threshold -- the (estimated) Jaccard similarity of the token sets at
+            which two tweets are near-duplicates
+            (default: 0.8)
+        num_perm -- the number of MinHash permutations (signature length)
+            (default: 64)
+        bands -- the number of LSH bands (must divide num_perm); more bands
+            find more of the less similar pairs, at a higher cost
+            (default: 16)
+        seed -- the random seed for the MinHash permutations
+            (default: 0)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('deduplicating dataset...')
+
+    input_filepath = Path(dataset_path, input_filename)
+    output_filepath = Path(dataset_path, output_filename)
+
+    with stage('read_dataset') as metrics:
+        # Adding na_filter here to ensure that empty strings are not converted to NaN.
+        data_frame = pd.read_csv(input_filepath, encoding=encoding, na_filter=False)
+        metrics.rows_out = data_frame.shape[0]
+    logger.info('\tloaded %s items from %s', data_frame.shape[0], input_filepath)
+
+    # Cluster each company's tweets separately, since the company column is
+    # part of the training input.
+    representatives = []
+    with stage('cluster_near_duplicates', rows_in=data_frame.shape[0]) as metrics:
+        for company, group in data_frame.groupby('company', sort=False):
+            labels = cluster_near_duplicates(
+                group[text_column_name].tolist(), threshold, num_perm, bands, seed
+                )
+            representatives.append(select_representatives(group, labels))
+            logger.info('\t\t%s: %s items in %s clusters', company, group.shape[0], labels.max() + 1)
+        df_dedup = pd.concat(representatives).sort_index()
+        metrics.rows_out = df_dedup.shape[0]
+
+    logger.info('\tsaving %s representative items to %s', df_dedup.shape[0], output_filepath)
+    with stage('save_dataset', rows_in=df_dedup.shape[0]):
+        df_dedup.to_csv(output_filepath, index=False)
+
+
+if __name__ == '__main__':
+    Fire(main)
@@ -5,39 +5,51 @@ See main() for the details.
 import csv
 import html
 import logging
+from functools import lru_cache
 from pathlib import Path
 from fire import Fire
 import pandas as pd
-from nltk.tokenize import TweetTokenizer
 
 import src.settings
+from src.pattern_registry import PATTERNS
+from src.instrumentation import instrumented, stage
+from src.dataset_partitioner import PartitionedWriter
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_tweet_tokenizer():
+    """This function returns the shared NLTK TweetTokenizer, importing nltk
+    (which takes seconds) on first use only.
+    """
+    from nltk.tokenize import TweetTokenizer
+    return TweetTokenizer()
+
+
 def normalize_tokenize_text(text: str) -> str:
     """This function normalizes/tokenizes the tweet field values."""
     try:
         text = html.unescape(text)
-        text = src.settings.PTN_rt.sub('', text)
-        text = src.settings.PTN_whitespace.sub(' ', text)
-        text = src.settings.PTN_concatenated_url.sub(r'\1 http', text)
+        text = PATTERNS['PTN_rt'].sub('', text)
+        text = PATTERNS['PTN_whitespace'].sub(' ', text)
+        text = PATTERNS['PTN_concatenated_url'].sub(r'\1 http', text)
 
         # preserve Twitter specific tokens
         # username can contain year notations and elongations
-        mentions = src.settings.PTN_mention.findall(text)
-        text = src.settings.PTN_mention.sub(src.settings.SLO_MENTION_PLACEHOLDER, text)
+        mentions = PATTERNS['PTN_mention'].findall(text)
+        text = PATTERNS['PTN_mention'].sub(src.settings.SLO_MENTION_PLACEHOLDER, text)
         # URLs might be case sensitive
-        urls = src.settings.PTN_url.findall(text)
-        text = src.settings.PTN_url.sub(src.settings.SLO_URL_PLACEHOLDER, text)
+        urls = PATTERNS['PTN_url'].findall(text)
+        text = PATTERNS['PTN_url'].sub(src.settings.SLO_URL_PLACEHOLDER, text)
 
-        text = src.settings.PTN_elongation.sub(r'\1\1\1', text)
+        text = PATTERNS['PTN_elongation'].sub(r'\1\1\1', text)
         text = text.lower()
 
-        text = src.settings.PTN_year.sub('slo_year', text)
-        text = src.settings.PTN_time.sub('slo_time', text)
-        text = src.settings.PTN_cash.sub('slo_cash', text)
-        text = src.settings.PTN_hash.sub('slo_hash', text)
+        text = PATTERNS['PTN_year'].sub('slo_year', text)
+        text = PATTERNS['PTN_time'].sub('slo_time', text)
+        text = PATTERNS['PTN_cash'].sub('slo_cash', text)
+        text = PATTERNS['PTN_hash'].sub('slo_hash', text)
 
         # put back Twitter specific tokens
         for url in urls:
@@ -46,7 +58,7 @@ def normalize_tokenize_text(text: str) -> str:
             text = text.replace(src.settings.SLO_MENTION_PLACEHOLDER, mention, 1)
 
         # Tokenize the text.
-        text = ' '.join(TweetTokenizer().tokenize(text))
+        text = ' '.join(get_tweet_tokenizer().tokenize(text))
 
     except:
         logger.error('pre-precessing error on: %s; %s", text, type(text)')
@@ -65,8 +77,8 @@ def post_process_text(text: str) -> str:
     This does not touch hashtags and cashtags because treating them as different words 
     will work for our task.
     """
-    text = src.settings.PTN_mention.sub(r'slo_mention', text)
-    text = src.settings.PTN_url.sub(r'slo_url', text)
+    text = PATTERNS['PTN_mention'].sub(r'slo_mention', text)
+    text = PATTERNS['PTN_url'].sub(r'slo_url', text)
     return text
 
 
@@ -84,17 +96,59 @@ def read_dataset(file_path: str, extension: str, encoding: str) -> pd.DataFrame:
     return data_frame
 
 
-def save_datasets(data_frame: pd.DataFrame, filepath: str, separate_companies: bool) -> None:
-    """This function saves the tokenized datasets, one for each company or
-    one for all the companies combined.
+def save_datasets(
+        data_frame: pd.DataFrame,
+        filepath: str,
+        separate_companies: bool,
+        partition_by_month: bool=False,
+        multi_company: str='each'
+        ) -> None:
+    """This function saves the tokenized dataset for all the companies
+    combined and, if separate_companies is set, one for each company (and
+    month), named <filepath stem>-<company>[-<YYYY-MM>].csv, in one pass (see
+    dataset_partitioner.py).
     """
+    filepath = Path(filepath)
     data_frame.to_csv(filepath, index=False)
     logger.info('\t\tsaved %s items to %s', data_frame.shape[0], filepath)
     if separate_companies:
-        for company_name, group in data_frame.groupby('company'):
-            filepath = f'{filepath}-{company_name}_norm.csv'
-            group.to_csv(filepath, index=False, quoting=csv.QUOTE_NONNUMERIC)
-            logger.info('\t\tsaved %s items to %s', group.shape[0], filepath)
+        with PartitionedWriter(
+                filepath.parent,
+                filepath.stem,
+                by_month=partition_by_month,
+                multi_company=multi_company,
+                quoting=csv.QUOTE_NONNUMERIC
+                ) as partitioned_writer:
+            partitioned_writer.write(data_frame)
+
+
+def normalize_dataset(
+        data_frame: pd.DataFrame,
+        tweet_column_name: str='text',
+        profile_column_name: str='user_description',
+        post_process: bool=False
+        ) -> pd.DataFrame:
+    """This function replaces the tweet/profile columns of the given dataset
+    with their normalized/tokenized versions (tweet_norm/profile_norm).
+    """
+    logger.info('\tnormalizing/tokenizing tweet/profile texts...')
+    with stage('normalize_tweets', rows_in=data_frame.shape[0]):
+        tweets = data_frame[tweet_column_name].apply(normalize_tokenize_text)
+    with stage('normalize_profiles', rows_in=data_frame.shape[0]):
+        profiles = data_frame[profile_column_name].apply(normalize_tokenize_text)
+    data_frame = data_frame.drop(
+        columns=[tweet_column_name, profile_column_name]
+        )
+
+    if post_process:
+        logger.info('\tpost-processing tweets...')
+        with stage('post_process', rows_in=data_frame.shape[0]):
+            tweets = tweets.apply(post_process_text)
+            profiles = profiles.apply(post_process_text)
+
+    data_frame['tweet_norm'] = tweets
+    data_frame['profile_norm'] = profiles
+    return data_frame
 
 
 def fix_for_tagger(texts):
@@ -105,6 +159,7 @@ def fix_for_tagger(texts):
     return [text if text != '' else 'slo_empty_text' for text in texts]
 
 
+@instrumented
 def dataset_normalizer(
         dataset_path: str='.',
         input_filename: str='dataset.csv',
@@ -113,7 +168,12 @@ def dataset_normalizer(
         profile_column_name: str='user_description',
         encoding: str='utf-8',
         separate_companies: bool=False,
+        partition_by_month: bool=False,
+        multi_company: str='each',
         post_process: bool=False,
+        report_dirname: str='reports',
+        cprofile: bool=False,
+        trace_memory: bool=False,
         logging_level: int=logging.INFO
         ) -> None:
     """This tool loads the preprocessed CSV-formatted tweets from the given
@@ -154,10 +214,30 @@ def dataset_normalizer(
             (default: 'utf-8')
         separate_companies:
             if True, separate files grouped by company name are produced
+            (<output_filename stem>-<company>.csv)
+            (default: False)
+        partition_by_month:
+            if True, the company files are also split by month
+            (<output_filename stem>-<company>-<YYYY-MM>.csv)
             (default: False)
+        multi_company:
+            how to separate tweets that mention several companies: 'each'
+            (add them to each company's file), 'multi' (add them to a separate
+            -multi file) or 'drop'
+            (default: 'each')
         post_process:
             if True, abstract mentions and URLs
             (default: False)
+        report_dirname:
+            the directory in which to save the run's performance report
+            (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile:
+            if True, include a cProfile profile in the report
+            (default: False)
+        trace_memory:
+            if True, include tracemalloc allocation statistics in the report
+            (default: False)
         logging_level
             the level of logging to use
             (default: logging.INFO)
@@ -174,24 +254,15 @@ def dataset_normalizer(
     input_filepath = Path(dataset_path, input_filename)
     output_filepath = Path(dataset_path, output_filename)
 
-    data_frame = read_dataset(input_filepath, extension, encoding)
+    with stage('read_dataset') as metrics:
+        data_frame = read_dataset(input_filepath, extension, encoding)
+        metrics.rows_out = data_frame.shape[0]
 
-    logger.info('\tnormalizing/tokenizing tweet/profile texts...')
-    tweets = data_frame[tweet_column_name].apply(normalize_tokenize_text)
-    profiles = data_frame[profile_column_name].apply(normalize_tokenize_text)
-    data_frame = data_frame.drop(
-        columns=[tweet_column_name, profile_column_name]
-        )
-
-    if post_process:
-        logger.info('\tpost-processing tweets...')
-        tweets = tweets.apply(post_process_text)
-        profiles = profiles.apply(post_process_text)
+    data_frame = normalize_dataset(data_frame, tweet_column_name, profile_column_name, post_process)
 
     logger.info('\tsaving normalized tweets and profiles:')
-    data_frame['tweet_norm'] = tweets
-    data_frame['profile_norm'] = profiles
-    save_datasets(data_frame, output_filepath, separate_companies)
+    with stage('save_datasets', rows_in=data_frame.shape[0]):
+        save_datasets(data_frame, output_filepath, separate_companies, partition_by_month, multi_company)
 
 
 if __name__ == '__main__':
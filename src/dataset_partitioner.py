@@ -0,0 +1,142 @@
+"""
+This module writes per-company (and optionally per-month) dataset files while
+a dataset is streamed chunk by chunk, rather than by re-reading and grouping
+the finished dataset file.
+
+A PartitionedWriter appends each chunk's rows to their partitions' files,
+through buffered file handles. A partition's file is created (with a header)
+the first time the partition gets rows. At most max_open_files handles are
+kept open: the least recently written one is closed to open another, and its
+file is reopened in append mode (without a header) when its partition gets
+rows again, so partitioning by month on a multi-year stream doesn't hold a
+handle and buffer per month. A partition file is named
+<filename_base>-<company>[-<YYYY-MM>].csv, the month being that of the
+created_at column.
+
+Tweets that mention several companies (a company value of, e.g., 'adani|bhp',
+see dataset_preprocessor.compute_company()) are partitioned according to
+multi_company:
+- 'each' -- the row is written to each of its companies' files, unchanged
+- 'multi' -- the row is written to a separate <filename_base>-multi file
+- 'drop' -- the row is not partitioned
+Rows without a company are not partitioned.
+"""
+import logging
+from collections import Counter, OrderedDict
+from pathlib import Path
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MULTI_COMPANY_MODES = ['each', 'multi', 'drop']
+MULTI_COMPANY_PARTITION = 'multi'
+UNKNOWN_MONTH = 'unknown'
+
+
+def get_months(created_at):
+    """Return the YYYY-MM month of each of the given created_at values
+    (datetimes or date strings), or 'unknown'.
+    """
+    return pd.to_datetime(created_at, errors='coerce', utc=True).dt.strftime('%Y-%m').fillna(UNKNOWN_MONTH)
+
+
+class PartitionedWriter:
+    """Per-company (and month) CSV files, appended to chunk by chunk (see the
+    module docstring).
+    """
+
+    def __init__(
+            self,
+            output_path,
+            filename_base,
+            by_month=False,
+            multi_company='each',
+            encoding='utf-8',
+            buffer_size=2**16,
+            max_open_files=64,
+            **to_csv_kwargs
+            ):
+        if multi_company not in MULTI_COMPANY_MODES:
+            raise ValueError(f'unknown multi_company mode {multi_company} - use one of {MULTI_COMPANY_MODES}')
+        self.output_path = Path(output_path)
+        self.filename_base = filename_base
+        self.by_month = by_month
+        self.multi_company = multi_company
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.max_open_files = max_open_files
+        self.to_csv_kwargs = to_csv_kwargs
+        # The open handles, least recently written first.
+        self.handles = OrderedDict()
+        self.counts = Counter()
+
+    def get_filepath(self, partition):
+        return self.output_path / f'{self.filename_base}-{partition}.csv'
+
+    def get_partitions(self, df_chunk):
+        """Return the given chunk's rows to partition and their partitions,
+        with the rows of several companies repeated for 'each'.
+        """
+        # Index the companies by row position, which explode() repeats.
+        companies = df_chunk['company'].astype(str).reset_index(drop=True)
+        multi = companies.str.contains('|', regex=False)
+        if self.multi_company == 'each':
+            partitions = companies.str.split('|').explode()
+        elif self.multi_company == 'multi':
+            partitions = companies.where(~multi, MULTI_COMPANY_PARTITION)
+        else:
+            partitions = companies[~multi]
+        partitions = partitions[partitions != '']
+        positions = partitions.index.to_numpy()
+        partitions = partitions.to_numpy(dtype=object)
+        if self.by_month:
+            months = get_months(df_chunk['created_at']).to_numpy(dtype=object)
+            partitions = partitions + '-' + months[positions]
+        return df_chunk.iloc[positions], partitions
+
+    def get_handle(self, partition):
+        """Return the open handle of the given partition's file, creating the
+        file or reopening it for appending, and closing the least recently
+        written handle if max_open_files are open.
+        """
+        handle = self.handles.get(partition)
+        if handle is not None:
+            self.handles.move_to_end(partition)
+            return handle
+        if len(self.handles) >= self.max_open_files:
+            self.handles.popitem(last=False)[1].close()
+        handle = open(
+            self.get_filepath(partition),
+            'a' if partition in self.counts else 'w',
+            encoding=self.encoding,
+            newline='',
+            buffering=self.buffer_size
+            )
+        self.handles[partition] = handle
+        return handle
+
+    def write(self, df_chunk):
+        """Append the given chunk's rows to their partitions' files."""
+        rows, partitions = self.get_partitions(df_chunk)
+        for partition, group in rows.groupby(partitions, sort=False):
+            include_header = partition not in self.counts
+            group.to_csv(self.get_handle(partition), index=False, header=include_header, **self.to_csv_kwargs)
+            self.counts[partition] += group.shape[0]
+
+    def close(self):
+        """Close the partitions' files and return their row counts, by file
+        path.
+        """
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = OrderedDict()
+        counts = {self.get_filepath(partition): count for partition, count in sorted(self.counts.items())}
+        for filepath, count in counts.items():
+            logger.info('\t\tsaved %s items to %s', count, filepath)
+        return counts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
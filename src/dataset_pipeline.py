@@ -0,0 +1,233 @@
+"""
+This module runs the dataset pipeline of the Makefile's datasets/codesets
+targets -- dataset_preprocessor, dataset_normalizer, token_extractor and
+autocoding_processor -- in one pass over the raw tweets, without the
+intermediate CSV files.
+
+Each stage is a generator over the same in-memory chunks of the raw JSON file:
+the chunks are pre-processed, de-duplicated (by row hash, see
+dataset_preprocessor.drop_seen_rows()) and normalized/tokenized, and their
+unique texts are collected for the tokens file. Only the auto-coding, which
+samples each company's tweets from the whole dataset, waits for the last chunk.
+The intermediate dataset (.csv) and normalized dataset (_norm.csv) files are
+written only on request, as are per-company (and month) normalized datasets,
+which are written chunk by chunk as the rows stream past (see
+dataset_partitioner.py).
+
+See benchmarks/benchmark_dataset_pipeline.py for a runtime/peak memory
+comparison with the Makefile's file-based steps.
+"""
+import csv
+import logging
+from pathlib import Path
+from fire import Fire
+import pandas as pd
+
+from src.instrumentation import instrumented, stage
+from src.dataset_preprocessor import \
+    iter_dataset_chunks, drop_seen_rows, get_size, remove_filepath_if_exists, log_dataset_counts
+from src.dataset_normalizer import normalize_dataset
+from src.dataset_partitioner import PartitionedWriter
+from src.token_extractor import save_tokens
+from src.autocoding_processor import autocode_dataset, get_testset_ids_pattern
+
+logger = logging.getLogger(__name__)
+
+
+def iter_unique_chunks(chunks):
+    """This function yields the given chunks without the rows already seen
+    in this or an earlier chunk.
+    """
+    seen_row_hashes = set()
+    for df_chunk in chunks:
+        with stage('drop_duplicates', rows_in=get_size(df_chunk)) as metrics:
+            df_chunk = drop_seen_rows(df_chunk, seen_row_hashes)
+            metrics.rows_out = get_size(df_chunk)
+        yield df_chunk
+
+
+def iter_normalized_chunks(chunks, post_process):
+    """This function yields the given chunks with their tweet/profile texts
+    normalized/tokenized (see dataset_normalizer.normalize_dataset()).
+    """
+    for df_chunk in chunks:
+        yield normalize_dataset(df_chunk, post_process=post_process)
+
+
+def iter_saved_chunks(chunks, output_filepath, stage_name, **kwargs):
+    """This function appends the given chunks to the given CSV file (with the
+    given to_csv() arguments) and yields them on, or just yields them if the
+    file path is None.
+    """
+    if output_filepath is None:
+        yield from chunks
+        return
+    remove_filepath_if_exists(output_filepath)
+    include_header = True
+    for df_chunk in chunks:
+        with stage(stage_name, rows_in=get_size(df_chunk)):
+            df_chunk.to_csv(output_filepath, index=False, mode='a', header=include_header, **kwargs)
+        include_header = False
+        yield df_chunk
+
+
+def iter_partitioned_chunks(chunks, partitioned_writer):
+    """This function writes the given chunks' rows to their partitions (see
+    dataset_partitioner.py) and yields them on, or just yields them if the
+    writer is None.
+    """
+    if partitioned_writer is None:
+        yield from chunks
+        return
+    for df_chunk in chunks:
+        with stage('partition_chunk', rows_in=get_size(df_chunk)):
+            partitioned_writer.write(df_chunk)
+        yield df_chunk
+
+
+@instrumented
+def dataset_pipeline(
+        dataset_path='.',
+        input_filename='dataset.json',
+        tokens_filename='dataset_norm.txt',
+        autocode_filename='dataset_autocode.csv',
+        dataset_filename=None,
+        norm_filename=None,
+        separate_companies=False,
+        partition_by_month=False,
+        multi_company='each',
+        testset_filename=None,
+        encoding='utf-8',
+        drop_irrelevant_tweets=True,
+        keep_retweets=True,
+        post_process=False,
+        company_tweets=False,
+        chunk_size=50000,
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
+        logging_level=logging.INFO
+        ):
+    """This tool builds the tokens file (.txt) and the auto-coded trainset
+    (.csv) from the given raw JSON file of tweets, as the Makefile's
+    dataset_preprocessor, dataset_normalizer, token_extractor and
+    autocoding_processor steps do, but in one in-memory pass (see the module
+    docstring).
+
+    Keyword Arguments:
+        dataset_path -- the system path of the input/output files
+            (default: '.')
+        input_filename -- the name of the raw JSON file to read
+            (default: 'dataset.json')
+        tokens_filename -- the name of the tokens file to write
+            (default: 'dataset_norm.txt')
+        autocode_filename -- the name of the auto-coded trainset file to write
+            (default: 'dataset_autocode.csv')
+        dataset_filename -- the name of a file in which to also save the
+            pre-processed dataset, as dataset_preprocessor does
+            (default: None -- don't save it)
+        norm_filename -- the name of a file in which to also save the
+            normalized dataset, as dataset_normalizer does
+            (default: None -- don't save it)
+        separate_companies -- whether to also save a normalized dataset per
+            company, as dataset_normalizer does (<norm_filename stem, or
+            <input_filename stem>_norm>-<company>.csv)
+            (default: False)
+        partition_by_month -- whether to split the per-company datasets by
+            month (...-<company>-<YYYY-MM>.csv)
+            (default: False)
+        multi_company -- how to partition tweets that mention several
+            companies: 'each' (add them to each company's dataset), 'multi'
+            (add them to a separate -multi dataset) or 'drop'
+            (default: 'each')
+        testset_filename -- the name of the testset whose tweets should not be
+            auto-coded
+            (default: None)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        drop_irrelevant_tweets -- whether to drop tweets that are either:
+            not in English or talk about an unknown company
+            (default: True)
+        keep_retweets -- whether to keep retweeted tweets
+            (default: True)
+        post_process -- whether to post-process the normalized texts
+            (default: False)
+        company_tweets -- whether to auto-code tweets from company accounts
+            (default: False)
+        chunk_size -- the number of raw tweets per in-memory chunk
+            (default: 50000)
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('running the fused dataset pipeline...')
+
+    pd.options.mode.chained_assignment = None  # default='warn'
+
+    input_filepath = Path(dataset_path, input_filename)
+    dataset_filepath = Path(dataset_path, dataset_filename) if dataset_filename else None
+    norm_filepath = Path(dataset_path, norm_filename) if norm_filename else None
+    testset_ids_pattern = get_testset_ids_pattern(dataset_path, testset_filename, encoding)
+    partitioned_writer = None
+    if separate_companies:
+        partitioned_writer = PartitionedWriter(
+            dataset_path,
+            Path(norm_filename).stem if norm_filename else f'{input_filepath.stem}_norm',
+            by_month=partition_by_month,
+            multi_company=multi_company,
+            encoding=encoding,
+            quoting=csv.QUOTE_NONNUMERIC
+            )
+
+    logger.info('\tloading raw tweets from %s', input_filepath)
+    chunks = iter_dataset_chunks(input_filepath, encoding, drop_irrelevant_tweets, keep_retweets, chunk_size)
+    chunks = iter_unique_chunks(chunks)
+    chunks = iter_saved_chunks(chunks, dataset_filepath, 'save_dataset', quoting=csv.QUOTE_NONNUMERIC)
+    chunks = iter_normalized_chunks(chunks, post_process)
+    chunks = iter_saved_chunks(chunks, norm_filepath, 'save_norm_dataset')
+    chunks = iter_partitioned_chunks(chunks, partitioned_writer)
+
+    # Dicts keep the unique texts in order of first appearance, as unique() does.
+    tweets, profiles = {}, {}
+    norm_chunks = []
+    for df_chunk in chunks:
+        with stage('collect_tokens', rows_in=get_size(df_chunk)):
+            tweets.update(dict.fromkeys(df_chunk['tweet_norm'].tolist()))
+            profiles.update(dict.fromkeys(df_chunk['profile_norm'].tolist()))
+        norm_chunks.append(df_chunk)
+        logger.info('\t\tprocessed %s records...', sum(map(get_size, norm_chunks)))
+    if dataset_filepath is not None:
+        log_dataset_counts(dataset_filepath)
+    if partitioned_writer is not None:
+        partitioned_writer.close()
+
+    with stage('write_tokens', rows_in=len(tweets) + len(profiles)):
+        save_tokens(Path(dataset_path, tokens_filename), tweets, profiles, encoding)
+
+    with stage('combine_chunks') as metrics:
+        df_all = pd.concat(norm_chunks, ignore_index=True)
+        metrics.rows_out = get_size(df_all)
+    del norm_chunks
+    df_combined = autocode_dataset(df_all, testset_filename, testset_ids_pattern, company_tweets)
+
+    autocode_filepath = Path(dataset_path, autocode_filename)
+    logger.info('\tstoring auto-coded dataset file: %s', autocode_filepath)
+    with stage('save_dataset', rows_in=get_size(df_combined)):
+        df_combined.to_csv(autocode_filepath, index=False)
+
+
+if __name__ == '__main__':
+    Fire(dataset_pipeline)
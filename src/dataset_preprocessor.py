@@ -10,15 +10,16 @@ See main() for the details.
 """
 import os
 import csv
-import json
 import re
 import logging
 from pathlib import Path
 from fire import Fire
 import pandas as pd
-from polyglot.text import Text
 
 from src.settings import PTN_rt, PTN_companies, RETWEET_START, REGEX_BAD_CHARS
+from src.instrumentation import instrumented, stage, staged
+from src.dataset_summarizer import DatasetSummary, save_summary
+from src.dataset_partitioner import PartitionedWriter
 
 logger = logging.getLogger(__name__)
 
@@ -26,27 +27,26 @@ logger = logging.getLogger(__name__)
 __unknown_company_count_global__ = 0
 __non_english_count_global__ = 0
 
-def create_dataset(
-        input_filepath,
-        output_filepath,
-        encoding,
-        drop_irrelevant_tweets,
-        keep_retweets
-        ):
-    """This function rebuilds a dataset from the given raw JSON file."""
-    logger.info('\tloading raw tweets from %s', input_filepath)
-
-    # Load/save the file in chunks.
-    count = 0
-    include_header = True
-    for df_chunk in pd.read_json(
-        input_filepath,
-        orient='records',
-        lines=True,
-        chunksize=50000,
-        encoding=encoding,
-        ):
-
+# The columns of the dataset file, in order.
+REQUIRED_FIELDS = [
+    'id',
+    'created_at',
+    'lang',
+    'lang_polyglot',
+    'retweeted',
+    'hashtags',
+    'company',
+    'text',
+    'user_screen_name',
+    'user_description'
+    ]
+
+
+def process_chunk(df_chunk, drop_irrelevant_tweets, keep_retweets):
+    """This function creates/updates/infers the dataset fields of the given
+    chunk of raw tweets and drops the irrelevant tweets and/or retweets.
+    """
+    with stage('process_chunk', rows_in=get_size(df_chunk)) as metrics:
         # Create/update/infer fields.
         df_chunk['retweeted'] = df_chunk.apply(compute_retweet, axis=1)
         df_chunk['text'] = \
@@ -74,27 +74,89 @@ def create_dataset(
         if not keep_retweets:
             logger.info('\t\tdropping retweets...')
             df_chunk = df_chunk[~df_chunk['retweeted']]
+        metrics.rows_out = get_size(df_chunk)
+    return df_chunk[REQUIRED_FIELDS]
+
+
+def iter_dataset_chunks(
+        input_filepath,
+        encoding,
+        drop_irrelevant_tweets,
+        keep_retweets,
+        chunk_size=50000
+        ):
+    """This function loads the given raw JSON file in chunks and yields each
+    chunk's dataset rows (see process_chunk()).
+    """
+    for df_chunk in staged('read_chunk', pd.read_json(
+        input_filepath,
+        orient='records',
+        lines=True,
+        chunksize=chunk_size,
+        encoding=encoding,
+        )):
+        yield process_chunk(df_chunk, drop_irrelevant_tweets, keep_retweets)
+
+
+def drop_seen_rows(data_frame, seen_row_hashes):
+    """This function returns the rows of the given dataframe whose hashes
+    aren't in the given set (nor earlier in the dataframe), adding their
+    hashes to the set. Feeding it successive chunks drops the same duplicate
+    rows as drop_duplicates() on the combined dataframe, without holding more
+    than the rows' hashes.
+    """
+    row_hashes = pd.util.hash_pandas_object(data_frame, index=False).tolist()
+    new_rows = []
+    for row_hash in row_hashes:
+        new_rows.append(row_hash not in seen_row_hashes)
+        seen_row_hashes.add(row_hash)
+    return data_frame[new_rows]
+
+
+def create_dataset(
+        input_filepath,
+        output_filepath,
+        encoding,
+        drop_irrelevant_tweets,
+        keep_retweets,
+        summary=None,
+        partitioned_writer=None
+        ):
+    """This function rebuilds a dataset from the given raw JSON file. If a
+    DatasetSummary is given, it also summarizes the (de-duplicated) dataset,
+    and if a PartitionedWriter (see dataset_partitioner.py) is given, it also
+    writes the (de-duplicated) rows to their company datasets.
+    """
+    logger.info('\tloading raw tweets from %s', input_filepath)
+
+    # Load/save the file in chunks.
+    count = 0
+    include_header = True
+    # The hashes of the rows summarized/partitioned so far, to skip duplicate
+    # rows as drop_duplicates() does below.
+    seen_row_hashes = set()
+    for df_chunk in iter_dataset_chunks(input_filepath, encoding, drop_irrelevant_tweets, keep_retweets):
 
         # Write each chuck to the combined dataset file.
-        required_fields = [
-            'id',
-            'created_at',
-            'lang',
-            'lang_polyglot',
-            'retweeted',
-            'hashtags',
-            'company',
-            'text',
-            'user_screen_name',
-            'user_description'
-            ]
-        df_chunk[required_fields].to_csv(
-            output_filepath,
-            index=False,
-            quoting=csv.QUOTE_NONNUMERIC,
-            mode='a',
-            header=include_header,
-            )
+        with stage('write_chunk', rows_in=get_size(df_chunk)):
+            df_chunk.to_csv(
+                output_filepath,
+                index=False,
+                quoting=csv.QUOTE_NONNUMERIC,
+                mode='a',
+                header=include_header,
+                )
+
+        if summary is not None or partitioned_writer is not None:
+            with stage('drop_seen_rows', rows_in=get_size(df_chunk)) as metrics:
+                df_new = drop_seen_rows(df_chunk, seen_row_hashes)
+                metrics.rows_out = get_size(df_new)
+        if summary is not None:
+            with stage('summarize_chunk', rows_in=get_size(df_new)):
+                summary.add(df_new)
+        if partitioned_writer is not None:
+            with stage('partition_chunk', rows_in=get_size(df_new)):
+                partitioned_writer.write(df_new)
 
         # Print a progress message.
         count += get_size(df_chunk)
@@ -102,10 +164,17 @@ def create_dataset(
         include_header = False
         logger.info('\t\tprocessed %s records...', count)
 
-    # Adding na_filter here to ensure that empty strings are not converted to NaN.
-    df_full = pd.read_csv(output_filepath, na_filter=False)
-    df_full.drop_duplicates(inplace=True)
-    df_full.to_csv(output_filepath, index=False, header=True, quoting=csv.QUOTE_NONNUMERIC)
+    with stage('drop_duplicates', rows_in=count) as metrics:
+        # Adding na_filter here to ensure that empty strings are not converted to NaN.
+        df_full = pd.read_csv(output_filepath, na_filter=False)
+        df_full.drop_duplicates(inplace=True)
+        df_full.to_csv(output_filepath, index=False, header=True, quoting=csv.QUOTE_NONNUMERIC)
+        metrics.rows_out = get_size(df_full)
+    log_dataset_counts(output_filepath)
+
+
+def log_dataset_counts(output_filepath):
+    """This function logs the saved dataset's irrelevant tweet counts."""
     logger.info(
         '\tsaved the dataset to %s' +
         '\n\t\tunknown company count: %s' +
@@ -133,11 +202,7 @@ def compute_full_text(row):
             and full_text.endswith('\u2026') \
             and not pd.isnull(row['retweeted_status']):
         text_header = PTN_rt.search(row['full_text']).group()
-        retweet_full_text = pd.read_json(
-            json.dumps(row['retweeted_status']['full_text']),
-            typ='series'
-            )[0]
-        full_text = f'{text_header}{retweet_full_text}'
+        full_text = f"{text_header}{row['retweeted_status']['full_text']}"
 
     return clean_text(full_text)
 
@@ -162,6 +227,9 @@ def update_language(row):
     else:
         # Compute alternate code for non-English tweets, many of which are
         # actually in English as well.
+        # polyglot (and its cld2 bindings) is only imported for the
+        # non-English tweets that need it.
+        from polyglot.text import Text
         lang2 = Text(remove_bad_chars(row['full_text'])).language.code
         if not lang2.startswith('en'):
             __non_english_count_global__ += 1
@@ -179,17 +247,15 @@ def compute_user_series(row):
     """This function grabs the user name and profile description from the
     nested user JSON structure.
     """
-    user_series =  pd.read_json(json.dumps(row['user']), typ='series')
-    user_series['description'] = clean_text(user_series['description'])
-    return user_series[['screen_name', 'description']]
+    user = row['user']
+    return pd.Series([user['screen_name'], clean_text(user['description'])], index=['screen_name', 'description'])
 
 
 def compute_hashtags(row):
     """This function grabs the list of hashtags from the nested entities
     JSON structure.
     """
-    entity_series =  pd.read_json(json.dumps(row['entities']), typ='series')
-    hashtags = list(map(lambda entry: entry['text'], entity_series['hashtags']))
+    hashtags = list(map(lambda entry: entry['text'], row['entities']['hashtags']))
     return ','.join(hashtags)
 
 
@@ -243,18 +309,7 @@ def remove_filepath_if_exists(filepath):
         os.remove(filepath)
 
 
-def create_separate_company_datasets(input_filepath, output_path, filename_base):
-    """Read the given full/combined dataset file and create/save
-    company-specific groups.
-    """
-    logger.info('\tsplitting dataset into company-specific datasets...')
-    data_frame = pd.read_csv(input_filepath, encoding='utf-8', engine='python')
-    for company_name, group in data_frame.groupby(['company']):
-        group.to_csv(
-            output_path / f'{filename_base}-{company_name}.csv',
-            index=False)
-
-
+@instrumented
 def dataset_preprocessor(
         dataset_path='.',
         input_filename='dataset.json',
@@ -263,6 +318,12 @@ def dataset_preprocessor(
         drop_irrelevant_tweets=True,
         keep_retweets=True,
         add_company_datasets=False,
+        partition_by_month=False,
+        multi_company='each',
+        summary_dirname=None,
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
         logging_level=logging.INFO
         ):
     """This tool loads the raw JSON-formatted tweets from the given
@@ -297,6 +358,27 @@ def dataset_preprocessor(
         keep_retweets -- whether to keep retweeted tweets
             (default: True)
         add_company_datasets -- whether to add company-specific datasets
+            (<output_filename stem>-<company>.csv), written while the
+            dataset is created (see dataset_partitioner.py)
+            (default: False)
+        partition_by_month -- whether to split the company-specific datasets
+            by month (<output_filename stem>-<company>-<YYYY-MM>.csv)
+            (default: False)
+        multi_company -- how to partition tweets that mention several
+            companies: 'each' (add them to each company's dataset), 'multi'
+            (add them to a separate -multi dataset) or 'drop'
+            (default: 'each')
+        summary_dirname -- the name of a directory in which to also save the
+            dataset's EDA summary, computed while the dataset is created (see
+            dataset_summarizer.py)
+            (default: None -- no summary)
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
             (default: False)
         logging_level -- the level of logging to use
             (default: logging.INFO)
@@ -313,20 +395,33 @@ def dataset_preprocessor(
     output_filepath = Path(dataset_path, output_filename)
     remove_filepath_if_exists(output_filepath)
 
-    create_dataset(
-        input_filepath,
-        output_filepath,
-        encoding,
-        drop_irrelevant_tweets,
-        keep_retweets
-        )
-
+    summary = DatasetSummary() if summary_dirname is not None else None
+    partitioned_writer = None
     if add_company_datasets:
-        create_separate_company_datasets(
-            input_filepath,
+        logger.info('\tsplitting dataset into company-specific datasets...')
+        partitioned_writer = PartitionedWriter(
             dataset_path,
-            output_filepath.stem
+            output_filepath.stem,
+            by_month=partition_by_month,
+            multi_company=multi_company,
+            encoding=encoding,
+            quoting=csv.QUOTE_NONNUMERIC
+            )
+    with stage('create_dataset'):
+        create_dataset(
+            input_filepath,
+            output_filepath,
+            encoding,
+            drop_irrelevant_tweets,
+            keep_retweets,
+            summary,
+            partitioned_writer
             )
+    if partitioned_writer is not None:
+        partitioned_writer.close()
+    if summary is not None:
+        with stage('save_summary'):
+            save_summary(summary, Path(dataset_path, summary_dirname))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+"""
+This module computes the exploratory data analysis (EDA) summary of a dataset
+(see notebooks/analysis.ipynb) in one streaming pass, chunk by chunk, and
+saves it as a few small tables that load in milliseconds:
+- company_day -- the number of tweets and retweets per company and day, with
+    multi-company tweets counted once for each of their companies
+- authors -- the author activity histogram: the number (and share) of authors
+    with each number of tweets
+- tokens -- the most frequent tokens of the tweet texts and author profile
+    descriptions (tokenized by nltk's TweetTokenizer)
+- totals -- the overall tweet, retweet, multi-company tweet, author and token
+    counts
+
+The summary can be computed from the dataset file (see main()) or while the
+dataset is created (see dataset_preprocessor --summary_dirname), and loaded
+with load_summary(), e.g.:
+
+    summary = load_summary('../data/dataset_summary')
+    summary['company_day'].groupby('company')['tweets'].sum()
+
+See main() for the details.
+"""
+import json
+import logging
+from collections import Counter
+from pathlib import Path
+import pandas as pd
+from fire import Fire
+
+from src.instrumentation import instrumented, stage
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLUMNS = ['created_at', 'retweeted', 'company', 'text', 'user_screen_name', 'user_description']
+SUMMARY_TABLES = ['company_day', 'authors', 'tokens']
+TOTALS_FILENAME = 'totals.json'
+
+
+class DatasetSummary:
+    """A streaming accumulator of the EDA summary of a dataset: add() the
+    dataset's chunks, then get_tables().
+    """
+
+    def __init__(self, max_tokens=10000):
+        self.max_tokens = max_tokens
+        self.company_day_counts = []
+        self.author_counts = Counter()
+        self.token_counts = Counter()
+        # nltk takes seconds to import, so it is only imported when needed.
+        from nltk.tokenize.casual import TweetTokenizer
+        self.tokenizer = TweetTokenizer()
+        self.totals = Counter()
+
+    def add(self, data_frame):
+        """Count the tweets of the given chunk of the dataset."""
+        retweeted = data_frame['retweeted']
+        if retweeted.dtype == object:
+            retweeted = retweeted.astype(str).str.lower() == 'true'
+        days = pd.to_datetime(data_frame['created_at'], utc=True, format='mixed').dt.tz_localize(None).dt.normalize()
+        companies = data_frame['company'].fillna('').str.split('|')
+        exploded = pd.DataFrame({
+            'company': companies,
+            'day': days,
+            'retweets': retweeted.astype(int),
+            }).explode('company')
+        exploded = exploded[exploded['company'] != '']
+        self.company_day_counts.append(
+            exploded.groupby(['company', 'day']).agg(
+                tweets=('retweets', 'size'), retweets=('retweets', 'sum')
+                )
+            )
+
+        self.author_counts.update(data_frame['user_screen_name'].fillna('').tolist())
+        tokenize = self.tokenizer.tokenize
+        for text in data_frame['text'].fillna('').tolist():
+            self.token_counts.update(tokenize(text))
+        for description in data_frame['user_description'].dropna().tolist():
+            self.token_counts.update(tokenize(description))
+
+        self.totals['tweets'] += len(data_frame)
+        self.totals['retweets'] += int(retweeted.sum())
+        self.totals['multi_company_tweets'] += int((companies.str.len() > 1).sum())
+
+    def get_tables(self):
+        """Return the summary tables (see SUMMARY_TABLES) as data frames and the
+        totals as a dictionary.
+        """
+        if self.company_day_counts:
+            # Merge the chunks' counts (a company's day may span chunks).
+            company_day = pd.concat(self.company_day_counts).groupby(level=['company', 'day']).sum()
+            self.company_day_counts = [company_day]
+            company_day = company_day.reset_index()
+        else:
+            company_day = pd.DataFrame(columns=['company', 'day', 'tweets', 'retweets'])
+
+        authors = pd.Series(self.author_counts).value_counts().sort_index()
+        authors = pd.DataFrame({
+            'tweet_count': authors.index,
+            'authors': authors.to_numpy(),
+            'author_share': authors.to_numpy() / max(len(self.author_counts), 1),
+            })
+        tokens = pd.DataFrame(
+            self.token_counts.most_common(self.max_tokens), columns=['token', 'count']
+            )
+
+        totals = dict(self.totals)
+        totals['authors'] = len(self.author_counts)
+        totals['tokens'] = sum(self.token_counts.values())
+        totals['unique_tokens'] = len(self.token_counts)
+        return {'company_day': company_day, 'authors': authors, 'tokens': tokens}, totals
+
+
+def save_summary(summary, summary_dirpath, output_format='csv'):
+    """Save the given DatasetSummary's tables in the given directory as CSV or
+    (with pyarrow installed) Parquet files.
+    """
+    summary_dirpath = Path(summary_dirpath)
+    summary_dirpath.mkdir(parents=True, exist_ok=True)
+    tables, totals = summary.get_tables()
+    for name, table in tables.items():
+        if output_format == 'parquet':
+            table.to_parquet(summary_dirpath / f'{name}.parquet', index=False)
+        else:
+            table.to_csv(summary_dirpath / f'{name}.csv', index=False)
+    with open(summary_dirpath / TOTALS_FILENAME, 'w', encoding='utf-8') as fout:
+        json.dump(totals, fout, indent=2)
+    logger.info('\tsaved the dataset summary to %s: %s', summary_dirpath, totals)
+
+
+def load_summary(summary_dirpath):
+    """Load the summary tables saved in the given directory (see save_summary())
+    as a dictionary of data frames, with the totals under 'totals'.
+    """
+    summary_dirpath = Path(summary_dirpath)
+    summary = {}
+    for name in SUMMARY_TABLES:
+        if (summary_dirpath / f'{name}.parquet').exists():
+            summary[name] = pd.read_parquet(summary_dirpath / f'{name}.parquet')
+        else:
+            summary[name] = pd.read_csv(
+                summary_dirpath / f'{name}.csv',
+                parse_dates=['day'] if name == 'company_day' else None,
+                keep_default_na=False
+                )
+    with open(summary_dirpath / TOTALS_FILENAME, encoding='utf-8') as fin:
+        summary['totals'] = json.load(fin)
+    return summary
+
+
+@instrumented
+def main(
+        dataset_path='.',
+        input_filename='dataset.csv',
+        summary_dirname='dataset_summary',
+        max_tokens=10000,
+        output_format='csv',
+        chunk_size=50000,
+        encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
+        logging_level=logging.INFO
+        ):
+    """This tool reads the dataset created by dataset_preprocessor chunk by
+    chunk and saves its EDA summary (daily tweet/retweet counts per company,
+    author activity histogram, token frequencies and totals) in the given
+    directory, see load_summary().
+
+    Keyword Arguments:
+        dataset_path -- the system path from which to load the dataset
+            (default='.')
+        input_filename -- the name of the dataset file to read
+            (default='dataset.csv')
+        summary_dirname -- the name of the directory in which to save the
+            summary tables
+            (default='dataset_summary')
+        max_tokens -- the number of most frequent tokens to keep
+            (default: 10000)
+        output_format -- the format of the summary tables, 'csv' or 'parquet'
+            (which requires pyarrow)
+            (default: 'csv')
+        chunk_size -- the number of rows to read at a time
+            (default: 50000)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('summarizing dataset...')
+
+    input_filepath = Path(dataset_path, input_filename)
+    summary = DatasetSummary(max_tokens)
+    count = 0
+    with stage('summarize_chunks') as metrics:
+        for df_chunk in pd.read_csv(
+                input_filepath,
+                usecols=SUMMARY_COLUMNS,
+                encoding=encoding,
+                chunksize=chunk_size
+                ):
+            summary.add(df_chunk)
+            count += df_chunk.shape[0]
+            logger.info('\t\tsummarized %s tweets...', count)
+        metrics.rows_in = count
+
+    with stage('save_summary'):
+        save_summary(summary, Path(dataset_path, summary_dirname), output_format)
+
+
+if __name__ == '__main__':
+    Fire(main)
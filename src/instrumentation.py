@@ -0,0 +1,329 @@
+"""
+This module records performance metrics for the pipeline tools and saves them
+as one machine-readable JSON report per run.
+
+Tools are wrapped with @instrumented, which adds a run report, and mark their
+(sub-)stages with the stage() context manager:
+
+    with stage('normalize_tweets', rows_in=len(data_frame)) as metrics:
+        ...
+        metrics.rows_out = len(tweets)
+
+Each stage records its wall time, CPU time, rows in/out, the bytes
+read/written and its memory use:
+- rss_growth_mb -- the largest growth of the resident set size between the
+    start and end of a call of the stage
+- peak_rss_growth_mb -- how much the stage's calls raised the process peak
+    RSS, which pinpoints the stages that set the peak
+- process_peak_rss_mb -- the process peak RSS at the end of the stage's last
+    call, which includes the peaks of earlier stages
+The peak RSS is None where the platform doesn't report it. Repeated stages (e.g., one per chunk) are summed
+into one entry per stage path (e.g., create_dataset/process_chunk). Outside an
+instrumented run, stage() records nothing.
+
+A run can also capture a cProfile profile (saved next to the report as .prof,
+with the top functions included in the report) and tracemalloc allocation
+statistics.
+"""
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# The report of the instrumented run in progress, if any.
+__current_report_global__ = None
+
+TOP_ENTRY_COUNT = 25
+
+
+def get_rss_mb():
+    """Returns the current resident set size of this process, in MB."""
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident set size of this process so far, in MB, or
+    None if the platform doesn't report it.
+    """
+    if resource is None:
+        # Windows reports the peak working set.
+        peak_wset = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        return None if peak_wset is None else peak_wset / 2**20
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere.
+    return peak_rss / 2**20 if sys.platform == 'darwin' else peak_rss / 2**10
+
+
+def get_io_bytes():
+    """Returns the (read, written) bytes of this process so far, including
+    reads served from the page cache where the platform reports them.
+    """
+    try:
+        counters = psutil.Process().io_counters()
+    except (AttributeError, psutil.Error):
+        return 0, 0
+    return (
+        getattr(counters, 'read_chars', counters.read_bytes),
+        getattr(counters, 'write_chars', counters.write_bytes)
+        )
+
+
+class StageMetrics:
+    """The metrics of one execution of a stage. Callers set rows_in/rows_out."""
+
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.rss_growth_mb = 0.0
+        self.peak_rss_growth_mb = None
+        self.peak_rss_mb = None
+
+    @contextmanager
+    def measure(self):
+        """Measures the time, I/O and memory of the enclosed block."""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        read_start, write_start = get_io_bytes()
+        rss_start = get_rss_mb()
+        peak_rss_start = get_peak_rss_mb()
+        try:
+            yield self
+        finally:
+            read_end, write_end = get_io_bytes()
+            self.rss_growth_mb = get_rss_mb() - rss_start
+            self.peak_rss_mb = get_peak_rss_mb()
+            if self.peak_rss_mb is not None:
+                self.peak_rss_growth_mb = self.peak_rss_mb - peak_rss_start
+            self.wall_time = time.perf_counter() - wall_start
+            self.cpu_time = time.process_time() - cpu_start
+            self.read_bytes = read_end - read_start
+            self.write_bytes = write_end - write_start
+
+
+class RunReport:
+    """The metrics of one run of a tool, aggregated per stage path."""
+
+    def __init__(self, tool, arguments):
+        self.tool = tool
+        self.arguments = arguments
+        self.started = datetime.now()
+        self.stages = {}
+        self.stage_path = []
+        self.totals = None
+        self.profile = None
+        self.allocations = None
+
+    def add(self, path, metrics):
+        """Adds the given stage metrics to the totals of the given stage path."""
+        entry = self.stages.setdefault(path, {
+            'stage': path,
+            'calls': 0,
+            'wall_time_s': 0.0,
+            'cpu_time_s': 0.0,
+            'rows_in': None,
+            'rows_out': None,
+            'rss_growth_mb': None,
+            'peak_rss_growth_mb': None,
+            'process_peak_rss_mb': None,
+            'read_bytes': 0,
+            'write_bytes': 0,
+            })
+        entry['calls'] += 1
+        entry['wall_time_s'] += metrics.wall_time
+        entry['cpu_time_s'] += metrics.cpu_time
+        entry['read_bytes'] += metrics.read_bytes
+        entry['write_bytes'] += metrics.write_bytes
+        entry['rss_growth_mb'] = max(entry['rss_growth_mb'] or 0.0, metrics.rss_growth_mb)
+        if metrics.peak_rss_mb is not None:
+            entry['peak_rss_growth_mb'] = (entry['peak_rss_growth_mb'] or 0.0) + metrics.peak_rss_growth_mb
+            entry['process_peak_rss_mb'] = metrics.peak_rss_mb
+        for rows in ['rows_in', 'rows_out']:
+            if getattr(metrics, rows) is not None:
+                entry[rows] = (entry[rows] or 0) + getattr(metrics, rows)
+
+    def to_dict(self):
+        """Returns the report as a JSON-serializable dictionary."""
+        return {
+            'tool': self.tool,
+            'arguments': self.arguments,
+            'started': self.started.isoformat(timespec='seconds'),
+            'pid': os.getpid(),
+            'totals': self.totals,
+            'stages': list(self.stages.values()),
+            'profile': self.profile,
+            'allocations': self.allocations,
+            }
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Records the metrics of the enclosed block as a (sub-)stage of the current
+    instrumented run, yielding a StageMetrics on which to set rows_in/rows_out.
+    """
+    report = __current_report_global__
+    metrics = StageMetrics(rows_in)
+    if report is None:
+        yield metrics
+        return
+    report.stage_path.append(name)
+    path = '/'.join(report.stage_path)
+    try:
+        with metrics.measure():
+            yield metrics
+    finally:
+        report.stage_path.pop()
+        report.add(path, metrics)
+
+
+def staged(name, iterable):
+    """Yields the items of the given iterable (e.g., a chunked file reader),
+    recording each fetch as a stage with the item's length as rows_out.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as metrics:
+            item = next(iterator, None)
+            if item is not None and hasattr(item, '__len__'):
+                metrics.rows_out = len(item)
+        if item is None:
+            return
+        yield item
+
+
+def get_top_functions(profiler):
+    """Returns the functions with the highest cumulative time in the given profile."""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    entries = sorted(
+        stats.stats.items(),
+        key=lambda item: item[1][3],
+        reverse=True
+        )[:TOP_ENTRY_COUNT]
+    return [
+        {
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'total_time_s': total_time,
+            'cumulative_time_s': cumulative_time,
+            }
+        for (filename, line, function), (_, calls, total_time, cumulative_time, _) in entries
+        ]
+
+
+def get_top_allocations(snapshot):
+    """Returns the source lines with the most memory allocated in the given snapshot."""
+    return [
+        {
+            'line': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+            'size_mb': stat.size / 2**20,
+            'count': stat.count,
+            }
+        for stat in snapshot.statistics('lineno')[:TOP_ENTRY_COUNT]
+        ]
+
+
+def save_report(report, report_dirname):
+    """Saves the given report as JSON in the given directory."""
+    report_dirpath = Path(report_dirname)
+    report_dirpath.mkdir(parents=True, exist_ok=True)
+    report_filepath = report_dirpath / \
+        f'{report.tool}-{report.started.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}.json'
+    with open(report_filepath, 'w', encoding='utf-8') as fout:
+        json.dump(report.to_dict(), fout, indent=2, default=str)
+    logger.info('saved run report to %s', report_filepath)
+    return report_filepath
+
+
+@contextmanager
+def run_report(tool, arguments=None, report_dirname='reports', cprofile=False, trace_memory=False):
+    """Records the enclosed run of the given tool and saves its report. Nested
+    runs (e.g., a tool called by another tool) are recorded as stages of the
+    enclosing run.
+    """
+    global __current_report_global__
+    if __current_report_global__ is not None:
+        with stage(tool) as metrics:
+            yield metrics
+        return
+
+    report = RunReport(tool, arguments)
+    metrics = StageMetrics()
+    profiler = cProfile.Profile() if cprofile else None
+    if trace_memory:
+        tracemalloc.start()
+    __current_report_global__ = report
+    try:
+        with metrics.measure():
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield metrics
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+    finally:
+        __current_report_global__ = None
+        report.totals = {
+            'wall_time_s': metrics.wall_time,
+            'cpu_time_s': metrics.cpu_time,
+            'process_peak_rss_mb': get_peak_rss_mb(),
+            'read_bytes': metrics.read_bytes,
+            'write_bytes': metrics.write_bytes,
+            }
+        if trace_memory:
+            _, traced_peak = tracemalloc.get_traced_memory()
+            report.allocations = {
+                'traced_peak_mb': traced_peak / 2**20,
+                'top_lines': get_top_allocations(tracemalloc.take_snapshot()),
+                }
+            tracemalloc.stop()
+        if profiler is not None:
+            report.profile = get_top_functions(profiler)
+        if report_dirname is not None:
+            report_filepath = save_report(report, report_dirname)
+            if profiler is not None:
+                profiler.dump_stats(report_filepath.with_suffix('.prof'))
+
+
+def instrumented(tool_function):
+    """Decorates a tool (Fire entry point) so that each run produces a report.
+    The tool must accept report_dirname (None to skip the report), cprofile
+    and trace_memory keyword arguments.
+    """
+    signature = inspect.signature(tool_function)
+
+    @functools.wraps(tool_function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        with run_report(
+                tool_function.__name__,
+                {name: str(value) for name, value in arguments.arguments.items()},
+                arguments.arguments['report_dirname'],
+                arguments.arguments['cprofile'],
+                arguments.arguments['trace_memory']
+                ):
+            return tool_function(*args, **kwargs)
+
+    return wrapper
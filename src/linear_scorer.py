@@ -0,0 +1,172 @@
+"""
+This module exports a fitted stance model (see model_svm.get_model()) into a
+LinearScorer, which predicts single x values (see model_utilities.get_x())
+without the scikit-learn machinery around the dot product: Pipeline.predict()
+runs each FeatureUnion branch, builds the CountVectorizers' CSR matrices,
+stacks them and validates the result, which costs milliseconds per tweet.
+
+A LinearScorer holds the LinearSVC's weights as one (feature x class) array
+and, for each n-gram branch, its analyzer and a dict of its terms' feature ids
+(offset to the branch's columns of the stacked features). Scoring an x value
+extracts its n-grams with the branch analyzers, looks their ids up, adds their
+weight rows and the dense branches' (target, embedding) values times their
+weight rows, and the intercepts. The rows are added in the order of the
+stacked CSR features that LinearSVC.decision_function() multiplies, so the
+scores, and therefore the predictions, are the pipeline's, whether the
+pipeline is given plain strings or ParsedDocuments (whose embedding means
+EmbeddingVectorizer computes in the same order as for strings).
+
+get_linear_scorer() exports a Pipeline, or each shard of a ShardedModel (see
+model_sharded.py). A pickled scorer (see model_build's scorer_filename) can be
+tested/served like a pickled model. See benchmarks/benchmark_linear_scorer.py
+for single-tweet latencies.
+"""
+import copy
+import logging
+import warnings
+from collections import Counter
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.pipeline import FeatureUnion, Pipeline
+
+from src.model_utilities import ParsedDocuments
+
+logger = logging.getLogger(__name__)
+
+
+def get_analyzer(vectorizer):
+    """Return the given count vectorizer's analyzer, built on a copy without
+    its vocabulary, so the analyzer doesn't keep (or pickle) the vocabulary.
+    """
+    vectorizer = copy.copy(vectorizer)
+    for attribute in ('vocabulary_', 'stop_words_'):
+        vectorizer.__dict__.pop(attribute, None)
+    with warnings.catch_warnings():
+        # e.g., that ngram_range is unused with a callable analyzer.
+        warnings.simplefilter('ignore')
+        return vectorizer.build_analyzer()
+
+
+def get_feature_count(transformer):
+    """Return the number of features of the given (fitted) dense branch."""
+    if hasattr(transformer, 'get_feature_names_out'):
+        return len(transformer.get_feature_names_out())
+    return len(transformer.get_feature_names())
+
+
+class LinearScorer:
+    """The weights of a fitted linear stance model, applied to one x value at
+    a time (see the module docstring).
+    """
+
+    def __init__(self, model):
+        if not isinstance(model, Pipeline) or len(model.steps) != 2 \
+                or not isinstance(model.steps[0][1], FeatureUnion) or not hasattr(model.steps[-1][1], 'coef_'):
+            raise ValueError(f'expected a fitted FeatureUnion + linear classifier pipeline, got {type(model)}')
+        union, classifier = model.steps[0][1], model.steps[-1][1]
+        coef = np.asarray(classifier.coef_, dtype=np.float64)
+        transformer_weights = union.transformer_weights or {}
+
+        # Each branch is (analyzer, vocabulary, binary) for n-grams, or
+        # (transformer, offset) for dense features, in feature order.
+        self.branches = []
+        offset = 0
+        weights = []
+        for name, transformer in union.transformer_list:
+            if transformer in ('drop', None):
+                continue
+            if isinstance(transformer, CountVectorizer):
+                vocabulary = transformer.vocabulary_
+                size = len(vocabulary)
+                self.branches.append((
+                    get_analyzer(transformer),
+                    {term: offset + index for term, index in vocabulary.items()},
+                    transformer.binary
+                    ))
+            else:
+                size = get_feature_count(transformer)
+                self.branches.append((transformer, offset))
+            branch_weights = coef[:, offset:offset + size].T
+            if name in transformer_weights:
+                branch_weights = branch_weights * transformer_weights[name]
+            weights.append(branch_weights)
+            offset += size
+        if offset != coef.shape[1]:
+            raise ValueError(f'the branches have {offset} features but the classifier has {coef.shape[1]}')
+
+        self.weights = np.ascontiguousarray(np.concatenate(weights))
+        self.intercept = np.asarray(classifier.intercept_, dtype=np.float64)
+        self.classes_ = classifier.classes_
+
+    def get_features(self, x_value):
+        """Return the feature ids and values of the given x value, in the order
+        of the stacked CSR features.
+        """
+        ids = []
+        values = []
+        for branch in self.branches:
+            if len(branch) == 3:
+                analyzer, vocabulary, binary = branch
+                if binary:
+                    feature_ids = set(map(vocabulary.get, analyzer(x_value)))
+                    feature_ids.discard(None)
+                    feature_ids = sorted(feature_ids)
+                    values.extend([1] * len(feature_ids))
+                else:
+                    counts = Counter(map(vocabulary.get, analyzer(x_value)))
+                    counts.pop(None, None)
+                    feature_ids = sorted(counts)
+                    values.extend([counts[i] for i in feature_ids])
+                ids.extend(feature_ids)
+            else:
+                transformer, offset = branch
+                row = transformer.transform([x_value])
+                row = (row.toarray() if scipy.sparse.issparse(row) else np.asarray(row)).ravel()
+                columns = np.flatnonzero(row)
+                ids.extend((columns + offset).tolist())
+                values.extend(row[columns].astype(np.float64).tolist())
+        return ids, values
+
+    def score(self, x_value):
+        """Return the decision function value(s) of the given x value."""
+        ids, values = self.get_features(str(x_value))
+        scores = (self.weights[ids] * np.asarray(values, dtype=np.float64)[:, np.newaxis]).sum(axis=0) \
+            if ids else np.zeros(self.weights.shape[1])
+        return scores + self.intercept
+
+    def predict_one(self, x_value):
+        """Return the predicted class of the given x value."""
+        scores = self.score(x_value)
+        if len(scores) == 1:
+            return self.classes_[int(scores[0] > 0)]
+        return self.classes_[scores.argmax()]
+
+    def decision_function(self, x_values):
+        if isinstance(x_values, ParsedDocuments):
+            x_values = x_values.x_values
+        scores = np.array([self.score(x_value) for x_value in np.asarray(x_values, dtype=str).tolist()])
+        return scores.reshape(-1, self.weights.shape[1])[:, 0] if self.weights.shape[1] == 1 else scores
+
+    def predict(self, x_values):
+        if isinstance(x_values, ParsedDocuments):
+            x_values = x_values.x_values
+        return np.array(
+            [self.predict_one(x_value) for x_value in np.asarray(x_values, dtype=str).tolist()],
+            dtype=self.classes_.dtype
+            )
+
+
+def get_linear_scorer(model):
+    """Return a LinearScorer of the given fitted model, or for a ShardedModel,
+    a ShardedModel of its shards' scorers (constant shards are kept as is).
+    """
+    # model_sharded imports gensim and the model modules, so import it here.
+    from src.model_sharded import ShardedModel
+
+    if isinstance(model, ShardedModel):
+        return ShardedModel({
+            company: LinearScorer(shard) if isinstance(shard, Pipeline) else shard
+            for company, shard in model.models.items()
+            })
+    return LinearScorer(model)
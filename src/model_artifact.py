@@ -0,0 +1,359 @@
+"""
+This module saves/loads trained models as slim, versioned artifact directories
+rather than as one monolithic pickle file.
+
+An artifact directory (model_dirpath/<version>/) contains:
+- manifest.json -- the artifact format version, model version and component files
+- components.pkl -- the pipeline with its heavy state stripped out (small)
+- vocabulary-<component>.txt -- n-gram vocabularies, one term per line in
+    feature-index order (i.e., sorted, as CountVectorizer sorts its features)
+- <component>-coef.npy, <component>-intercept.npy, <component>-classes.npy
+    -- the linear classifier arrays, memory-mapped on load
+- the word vectors are referenced by path to a gensim .kv file (converted once
+    from the word2vec text file, and named by a digest of its content) or a
+    compact .cwv file (see compact_vectors.py), which is memory-mapped on load
+
+save_model_artifact(keep_versions=...) / prune_model_versions delete all but
+the latest versions, so that rebuilding a model doesn't grow its directory
+without bound.
+
+Vocabularies are only materialized on the first lookup, so loading an artifact
+costs little more than reading the manifest. gensim, scikit-learn and the model
+modules are only imported by the functions that need them, so that importing
+this module (e.g., for model_test) stays fast.
+"""
+import copy
+import json
+import logging
+import os
+import pickle
+import shutil
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+COMPONENTS_FILENAME = 'components.pkl'
+CLASSIFIER_ARRAYS = ['coef_', 'intercept_', 'classes_']
+
+
+class LazyVocabulary(dict):
+    """A CountVectorizer vocabulary that reads its terms file on first use.
+
+    Lookups are plain dict lookups once loaded. The first call to len(), a
+    missing key or iteration loads the terms; CountVectorizer.transform()
+    always checks len(vocabulary_) before looking anything up.
+    """
+
+    def __init__(self, terms_filepath):
+        super().__init__()
+        self.terms_filepath = str(terms_filepath)
+        self.loaded = False
+
+    def load(self):
+        """Read the terms file, mapping each term to its line number."""
+        if not self.loaded:
+            # newline='' keeps any '\r' in the terms, as save_vocabulary()
+            # writes them.
+            with open(self.terms_filepath, encoding='utf-8', newline='') as fin:
+                text = fin.read()
+            terms = text.split('\n') if text else []
+            self.update(zip(terms, range(len(terms))))
+            self.loaded = True
+        return self
+
+    def __len__(self):
+        return super().__len__() if self.loaded else self.load().__len__()
+
+    def __missing__(self, key):
+        if self.loaded:
+            raise KeyError(key)
+        return self.load()[key]
+
+    def __iter__(self):
+        return super().__iter__() if self.loaded else self.load().__iter__()
+
+    def __contains__(self, key):
+        return super().__contains__(key) if self.loaded else self.load().__contains__(key)
+
+    def get(self, key, default=None):
+        self.load()
+        return super().get(key, default)
+
+    def keys(self):
+        self.load()
+        return super().keys()
+
+    def values(self):
+        self.load()
+        return super().values()
+
+    def items(self):
+        self.load()
+        return super().items()
+
+    def __reduce__(self):
+        # Pickle the file reference, not the (large) term mapping.
+        return (LazyVocabulary, (self.terms_filepath,))
+
+
+def get_mmap_embedding_filepath(word_vectors_filepath):
+    """Return the path of a memory-mappable (gensim .kv) copy of the given
+    word2vec text file, converting it the first time it is requested.
+
+    The copy is named <stem>.<content digest>.kv, so retrained word vectors
+    get a new copy rather than overwriting the one that earlier artifacts
+    reference (and that readers may have memory-mapped).
+    """
+    from src.compact_vectors import get_file_digest, save_word_vectors
+
+    word_vectors_filepath = Path(word_vectors_filepath)
+    # Compact word vectors (see compact_vectors.py) are memory-mappable too.
+    if word_vectors_filepath.suffix in ('.kv', '.cwv'):
+        return word_vectors_filepath
+    kv_filepath = word_vectors_filepath.with_name(
+        f'{word_vectors_filepath.stem}.{get_file_digest(word_vectors_filepath)}.kv'
+        )
+    if not kv_filepath.exists():
+        logger.info('\tconverting %s to %s...', word_vectors_filepath, kv_filepath)
+        from gensim.models import KeyedVectors
+        wordvec = KeyedVectors.load_word2vec_format(word_vectors_filepath, binary=False)
+        save_word_vectors(wordvec, kv_filepath)
+    return kv_filepath
+
+
+def save_vocabulary(vocabulary, terms_filepath):
+    """Write the given term -> index mapping as one term per line, in index order."""
+    terms = sorted(vocabulary, key=vocabulary.get)
+    if any('\n' in term for term in terms):
+        raise ValueError(f'cannot save vocabulary {terms_filepath} - terms contain newlines')
+    # An empty file is read back as an empty vocabulary.
+    if terms == ['']:
+        raise ValueError(f'cannot save vocabulary {terms_filepath} - its only term is empty')
+    with open(terms_filepath, 'w', encoding='utf-8', newline='') as fout:
+        fout.write('\n'.join(terms))
+
+
+def strip_component(estimator, name, artifact_dirpath, manifest, embedding_filepath):
+    """Return a shallow copy of the given (fitted) estimator with its heavy state
+    written to the artifact directory and recorded in the manifest.
+    """
+    from sklearn.pipeline import FeatureUnion, Pipeline
+    from src.compact_vectors import CompactKeyedVectors
+    from src.model_svm import EmbeddingVectorizer
+    from src.model_sharded import ShardedModel
+
+    shell = copy.copy(estimator)
+    if isinstance(estimator, Pipeline):
+        shell.steps = [
+            (step_name, strip_component(
+                step, f'{name}.{step_name}', artifact_dirpath, manifest, embedding_filepath
+                ))
+            for step_name, step in estimator.steps
+            ]
+    elif isinstance(estimator, ShardedModel):
+        shell.models = {
+            company: strip_component(
+                model, f'{name}.{company}', artifact_dirpath, manifest, embedding_filepath
+                )
+            for company, model in estimator.models.items()
+            }
+    elif isinstance(estimator, FeatureUnion):
+        shell.transformer_list = [
+            (branch_name, strip_component(
+                branch, f'{name}.{branch_name}', artifact_dirpath, manifest, embedding_filepath
+                ))
+            for branch_name, branch in estimator.transformer_list
+            ]
+    elif isinstance(getattr(estimator, 'vocabulary_', None), dict):
+        terms_filename = f'vocabulary-{name}.txt'
+        save_vocabulary(estimator.vocabulary_, Path(artifact_dirpath, terms_filename))
+        shell.vocabulary_ = None
+        # The pruned-terms set is only kept for introspection and can be huge.
+        if hasattr(shell, 'stop_words_'):
+            del shell.stop_words_
+        manifest['vocabularies'][name] = terms_filename
+    elif isinstance(estimator, EmbeddingVectorizer):
+        if embedding_filepath is None:
+            # No shared word vectors file, so keep a copy in the artifact itself.
+            suffix = '.cwv' if isinstance(estimator.wordvec, CompactKeyedVectors) else '.kv'
+            embedding_filename = f'embedding-{name}{suffix}'
+            estimator.wordvec.save(
+                str(Path(artifact_dirpath, embedding_filename)), separately=['vectors']
+                )
+            manifest['embeddings'][name] = embedding_filename
+        else:
+            manifest['embeddings'][name] = str(embedding_filepath)
+        shell.wordvec = None
+    elif hasattr(estimator, 'coef_'):
+        manifest['classifiers'][name] = {}
+        for attribute in CLASSIFIER_ARRAYS:
+            array_filename = f'{name}-{attribute.rstrip("_")}.npy'
+            np.save(Path(artifact_dirpath, array_filename), getattr(estimator, attribute))
+            setattr(shell, attribute, None)
+            manifest['classifiers'][name][attribute] = array_filename
+    return shell
+
+
+def attach_component(shell, name, artifact_dirpath, manifest):
+    """Re-attach the heavy state recorded in the manifest to the given shell
+    estimator (in place), memory-mapping it where possible.
+    """
+    from sklearn.pipeline import FeatureUnion, Pipeline
+    from src.compact_vectors import load_word_vectors
+    from src.model_sharded import ShardedModel
+
+    if isinstance(shell, Pipeline):
+        for step_name, step in shell.steps:
+            attach_component(step, f'{name}.{step_name}', artifact_dirpath, manifest)
+    elif isinstance(shell, ShardedModel):
+        for company, model in shell.models.items():
+            attach_component(model, f'{name}.{company}', artifact_dirpath, manifest)
+    elif isinstance(shell, FeatureUnion):
+        for branch_name, branch in shell.transformer_list:
+            attach_component(branch, f'{name}.{branch_name}', artifact_dirpath, manifest)
+    elif name in manifest['vocabularies']:
+        shell.vocabulary_ = LazyVocabulary(
+            Path(artifact_dirpath, manifest['vocabularies'][name])
+            )
+    elif name in manifest['embeddings']:
+        shell.wordvec = load_word_vectors(Path(artifact_dirpath, manifest['embeddings'][name]))
+    elif name in manifest['classifiers']:
+        for attribute, array_filename in manifest['classifiers'][name].items():
+            setattr(shell, attribute, np.load(Path(artifact_dirpath, array_filename), mmap_mode='r'))
+
+
+def save_model_artifact(
+        model,
+        model_dirpath,
+        word_vectors_filepath=None,
+        version=None,
+        keep_versions=None
+        ):
+    """Save the given fitted pipeline as a new version in the given model
+    directory and return the path of the new artifact directory. The artifact
+    is written to a temporary directory and renamed into place, so readers never
+    see a partial version. If keep_versions is given, only that many of the
+    latest versions (including the new one) are kept (see
+    prune_model_versions).
+    """
+    version = version or datetime.now().strftime('%Y%m%dT%H%M%S')
+    model_dirpath = Path(model_dirpath)
+    artifact_dirpath = model_dirpath / version
+    if artifact_dirpath.exists():
+        raise ValueError(f'model version {artifact_dirpath} already exists')
+    tmp_dirpath = model_dirpath / f'.{version}.tmp'
+    shutil.rmtree(tmp_dirpath, ignore_errors=True)
+    tmp_dirpath.mkdir(parents=True)
+
+    embedding_filepath = None
+    if word_vectors_filepath is not None:
+        embedding_filepath = get_mmap_embedding_filepath(word_vectors_filepath).resolve()
+
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'version': version,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'vocabularies': {},
+        'embeddings': {},
+        'classifiers': {},
+        }
+    shell = strip_component(model, 'model', tmp_dirpath, manifest, embedding_filepath)
+    # Reference shared word vectors relative to the final artifact directory so
+    # that the data directory can be moved as a whole.
+    manifest['embeddings'] = {
+        name: os.path.relpath(path, artifact_dirpath.resolve()) if os.path.isabs(path) else path
+        for name, path in manifest['embeddings'].items()
+        }
+    with open(tmp_dirpath / COMPONENTS_FILENAME, 'wb') as fout:
+        pickle.dump(shell, fout)
+    with open(tmp_dirpath / MANIFEST_FILENAME, 'w', encoding='utf-8') as fout:
+        json.dump(manifest, fout, indent=2)
+
+    tmp_dirpath.rename(artifact_dirpath)
+    logger.info('\tsaved model artifact %s', artifact_dirpath)
+    if keep_versions is not None:
+        prune_model_versions(model_dirpath, keep_versions)
+    return artifact_dirpath
+
+
+def list_model_versions(model_dirpath):
+    """Return the complete artifact directories in the given model directory,
+    oldest first.
+    """
+    return sorted(
+        path for path in Path(model_dirpath).iterdir()
+        if path.is_dir() and (path / MANIFEST_FILENAME).exists()
+        )
+
+
+def prune_model_versions(model_dirpath, keep):
+    """Delete all but the given number of latest artifact directories in the
+    given model directory and return the paths of the deleted ones.
+
+    Each version's manifest is deleted first, which takes it out of
+    list_model_versions, so readers never see a partial version. A ModelRegistry (see model_registry.py) can
+    still roll back to a deleted version it has loaded, but to keep its history
+    on disk, keep must exceed its history_size.
+    """
+    if keep < 1:
+        raise ValueError(f'cannot keep {keep} model versions: the latest one must be kept')
+    pruned = list_model_versions(model_dirpath)[:-keep]
+    for artifact_dirpath in pruned:
+        (artifact_dirpath / MANIFEST_FILENAME).unlink()
+        shutil.rmtree(artifact_dirpath)
+        logger.info('\tpruned model artifact %s', artifact_dirpath)
+    return pruned
+
+
+def load_model_artifact(artifact_dirpath):
+    """Load the model from the given artifact directory or, if given a model
+    directory of versioned artifacts, from its latest version.
+    """
+    # The lazy vocabularies keep their files' paths, which must not depend on
+    # the working directory.
+    artifact_dirpath = Path(artifact_dirpath).resolve()
+    if not (artifact_dirpath / MANIFEST_FILENAME).exists():
+        versions = list_model_versions(artifact_dirpath)
+        if not versions:
+            raise FileNotFoundError(f'no model artifacts found in {artifact_dirpath}')
+        artifact_dirpath = versions[-1]
+
+    with open(artifact_dirpath / MANIFEST_FILENAME, encoding='utf-8') as fin:
+        manifest = json.load(fin)
+    if manifest['format_version'] > ARTIFACT_FORMAT_VERSION:
+        raise ValueError(
+            f'model artifact {artifact_dirpath} has unsupported format '
+            f'version {manifest["format_version"]}'
+            )
+
+    with open(artifact_dirpath / COMPONENTS_FILENAME, 'rb') as fin:
+        model = pickle.load(fin)
+    attach_component(model, 'model', artifact_dirpath, manifest)
+    logger.info('\tloaded model artifact %s', artifact_dirpath)
+    return model
+
+
+def load_vocabularies(model):
+    """Replace the lazy vocabularies of the given (artifact) model with plain
+    dicts, in place, so that pickling the model copies its vocabularies rather
+    than referencing the artifact's files. Returns the model.
+    """
+    from sklearn.pipeline import FeatureUnion, Pipeline
+    from src.model_sharded import ShardedModel
+
+    if isinstance(model, Pipeline):
+        for _, step in model.steps:
+            load_vocabularies(step)
+    elif isinstance(model, ShardedModel):
+        for shard in model.models.values():
+            load_vocabularies(shard)
+    elif isinstance(model, FeatureUnion):
+        for _, branch in model.transformer_list:
+            load_vocabularies(branch)
+    elif isinstance(getattr(model, 'vocabulary_', None), LazyVocabulary):
+        model.vocabulary_ = dict(model.vocabulary_.items())
+    return model
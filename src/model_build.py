@@ -6,20 +6,39 @@ import pickle
 from pathlib import Path
 from fire import Fire
 
-from src.model_utilities import load_dataset, set_labels
-from src.model_svm import get_model
+from src.model_utilities import load_dataset, load_sample_weights, set_labels
+from src.model_artifact import save_model_artifact, get_mmap_embedding_filepath
+from src.instrumentation import instrumented, stage
 
 logger = logging.getLogger(__name__)
 
 
+@instrumented
 def model_build(
         dataset_path='.',
         trainset_filename='autocode.csv',
         word_vectors_filename='wordvec.vec',
+        embedding_precision='float32',
+        embedding_corpus_filename=None,
         labels=None,
         model_filename='model.pkl',
+        artifact_dirname=None,
+        keep_versions=None,
+        scorer_filename=None,
         profile=True,
+        compact=False,
+        min_df=2,
+        max_features=None,
+        target_aliases=False,
+        n_jobs=None,
+        sharded=False,
+        companies=None,
+        pooled_shard=True,
+        sample_weight_column=None,
         encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
         logging_level=logging.INFO
         ):
     """This tool builds the stance detection model using the specified trainset
@@ -32,14 +51,71 @@ def model_build(
             (default='autocode.csv')
         word_vectors_filename -- the name of the word vectors file
             (default='word_vectors.csv')
+        embedding_precision -- the precision at which to store/use the word
+            vectors: 'float32', 'float16' or 'int8' (see compact_vectors.py)
+            (default: 'float32')
+        embedding_corpus_filename -- the name of a text file (e.g., the
+            dataset_norm.txt tokens file) to whose tokens the word vectors'
+            vocabulary is pruned
+            (default: None -- keep the whole vocabulary)
         labels -- the training target labels
             (default: ['against', 'for', 'neutral', 'na'])
         model_filename -- the name of the model file to save
             (default='model.pkl')
+        artifact_dirname -- the name of a model directory in which to also save
+            the model as a new, versioned slim artifact (see model_artifact.py)
+            (default: None -- save the pickle file only)
+        keep_versions -- with artifact_dirname, the number of latest versions
+            to keep in the model directory, deleting the older ones
+            (default: None -- keep every version)
+        scorer_filename -- the name of a file in which to also save the model
+            as a pickled single-tweet scorer (see linear_scorer.py), which
+            model_test can test as a model file
+            (default: None -- no scorer)
         profile -- whether to include use profile texts
             (default: True)
+        compact -- whether to use the memory-saving n-gram featurization
+            (see model_svm.CompactCountVectorizer)
+            (default: False)
+        min_df -- with compact, the minimum number of training documents in
+            which an n-gram must appear to be used as a feature
+            (default: 2)
+        max_features -- with compact, the maximum number of word (and of char)
+            n-gram features to keep
+            (default: None -- no maximum)
+        target_aliases -- whether the target feature also recognizes the
+            company name forms of settings.PTN_companies (e.g., 'rio tinto')
+            (default: False)
+        n_jobs -- the number of worker processes in which to extract the
+            features (-1 for all cores), see model_svm.ParallelFeatureUnion,
+            or with sharded, in which to train the shards
+            (default: None -- extract the features in this process, or train
+            the shards in one process per core)
+        sharded -- whether to train one model per company, in parallel, and
+            save them as a bundle that routes each item to its company's model
+            (see model_sharded.py)
+            (default: False)
+        companies -- with sharded, the companies whose shards to (re)train; the
+            other shards of an existing model file are kept
+            (default: None -- train all the companies)
+        pooled_shard -- with sharded, whether to also train a shard on all the
+            items, which predicts the items of companies without a shard of
+            their own (e.g., 'adani|bhp')
+            (default: True)
+        sample_weight_column -- the trainset column of per-item training
+            weights, e.g., cluster_size for a trainset built from a
+            deduplicated dataset (see dataset_deduplicator.py)
+            (default: None -- unweighted)
         encoding -- the file encoding to use
             (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
         logging_level -- the level of logging to use
             (default: logging.INFO)
     """
@@ -57,17 +133,84 @@ def model_build(
 
     labels = set_labels(labels)
 
+    if embedding_precision != 'float32' or embedding_corpus_filename is not None:
+        from src.compact_vectors import get_compact_embedding_filepath
+        with stage('compact_embedding'):
+            word_vectors_filepath = get_compact_embedding_filepath(
+                word_vectors_filepath,
+                embedding_precision,
+                Path(dataset_path, embedding_corpus_filename) if embedding_corpus_filename else None
+                )
+
     logger.info('\tloading training set from %s...', trainset_filepath)
-    x_train_arrays, y_train_arrays = load_dataset(trainset_filepath, labels, encoding, profile)
+    with stage('load_dataset') as metrics:
+        x_train_arrays, y_train_arrays = load_dataset(trainset_filepath, labels, encoding, profile)
+        fit_params = {}
+        if sample_weight_column is not None:
+            fit_params['clf__sample_weight'] = load_sample_weights(
+                trainset_filepath, sample_weight_column, encoding
+                )
+        metrics.rows_out = len(x_train_arrays)
 
-    logger.info('\tbuilding/training SVM model...')
-    model = get_model(word_vectors_filepath, profile)
-    model.fit(x_train_arrays, y_train_arrays)
+    model_options = {
+        'profile': profile,
+        'compact': compact,
+        'min_df': min_df,
+        'max_features': max_features,
+        'target_aliases': target_aliases,
+        }
+    # The model modules import scikit-learn and gensim (seconds), so they are
+    # only imported once the trainset has loaded.
+    if sharded:
+        from src.model_sharded import train_sharded_model, ShardedModel
+        logger.info('\tbuilding/training sharded SVM model...')
+        with stage('fit_shards', rows_in=len(x_train_arrays)):
+            sharded_model = None
+            if companies is not None and model_filepath.exists():
+                logger.info('\t\tupdating the shards of %s...', model_filepath)
+                with open(model_filepath, 'rb') as model_fin:
+                    sharded_model = pickle.load(model_fin)
+                if not isinstance(sharded_model, ShardedModel):
+                    raise ValueError(
+                        f'{model_filepath} holds a {type(sharded_model).__name__}, not a sharded model, '
+                        'so its shards cannot be updated'
+                        )
+            model = train_sharded_model(
+                x_train_arrays,
+                y_train_arrays,
+                get_mmap_embedding_filepath(word_vectors_filepath),
+                model_options,
+                companies=companies,
+                sharded_model=sharded_model,
+                n_jobs=n_jobs,
+                sample_weights=fit_params.get('clf__sample_weight'),
+                pooled=pooled_shard
+                )
+    else:
+        from src.model_svm import get_model
+        logger.info('\tbuilding/training SVM model...')
+        with stage('get_model'):
+            model = get_model(word_vectors_filepath, n_jobs=n_jobs, **model_options)
+        with stage('fit', rows_in=len(x_train_arrays)):
+            model.fit(x_train_arrays, y_train_arrays, **fit_params)
 
     logger.info('\tsaving model in %s...', model_filepath)
-    with open(model_filepath, 'wb') as model_fout:
+    with stage('save_model'), open(model_filepath, 'wb') as model_fout:
         pickle.dump(model, model_fout)
 
+    if artifact_dirname is not None:
+        logger.info('\tsaving model artifact in %s...', Path(dataset_path, artifact_dirname))
+        with stage('save_model_artifact'):
+            save_model_artifact(
+                model, Path(dataset_path, artifact_dirname), word_vectors_filepath, keep_versions=keep_versions
+                )
+
+    if scorer_filename is not None:
+        from src.linear_scorer import get_linear_scorer
+        logger.info('\tsaving linear scorer in %s...', Path(dataset_path, scorer_filename))
+        with stage('save_scorer'), open(Path(dataset_path, scorer_filename), 'wb') as scorer_fout:
+            pickle.dump(get_linear_scorer(model), scorer_fout)
+
 
 if __name__ == '__main__':
     Fire(model_build)
@@ -0,0 +1,333 @@
+"""
+This module builds a two-stage (cascade) stance model, which cuts the average
+cost of a prediction: every item of the full model (see model_svm.get_model())
+pays for its char 2-5 grams and word embedding average, although most tweets
+can be classified from cheaper features.
+
+A CascadeClassifier first predicts each item with a small first-stage model --
+a LinearSVC on the word unigrams and the target feature only -- and, if its
+rules are enabled, the auto-coding keyword rules (settings.PTN_for and
+PTN_against, as autocoding_processor applies them): a tweet that matches
+only its company's for (or only its against) patterns takes that stance.
+Items whose first-stage decision margin (the difference between the two
+highest class scores, or the absolute score of a binary model) is below the
+threshold, and that no rule decides, go to the second-stage (full) model.
+
+The rules are applied as decisions rather than learned as features since the
+auto-coded trainset is labeled by those very patterns, which load_dataset()
+strips from its tweets.
+
+model_cascade trains the first stage and splits the given (e.g., gold) testset
+into a tuning part and a held-out part. It tunes the threshold (and whether to
+use the rules) against the macro-F1 of the tuning part, measuring the
+throughput of each operating point, and saves the cascade at the fastest
+operating point within max_f1_loss of the full model's macro-F1. The held-out
+part's macro-F1 of every operating point is reported alongside, as an unbiased
+estimate of the chosen one's. The pickled cascade can be tested/served like a
+pickled model. It is self-contained: a second stage loaded from a model
+artifact has its vocabularies copied in, and its word vectors and classifier
+arrays are pickled along with it.
+"""
+import logging
+import pickle
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from src.model_utilities import load_dataset, set_labels, compute_macro_f1, ParsedDocuments
+from src.model_artifact import load_model_artifact, load_vocabularies
+from src.instrumentation import instrumented, stage
+from src.settings import PTN_against, PTN_for
+
+logger = logging.getLogger(__name__)
+
+
+def get_first_stage_model(profile=True, C=1.0):
+    """Return the (unfitted) first-stage model: a LinearSVC on the word
+    unigram and target features of the full model.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.pipeline import FeatureUnion, Pipeline
+    from sklearn.svm import LinearSVC
+    from src.model_svm import SLO_WordAnalyzer, TargetVectorizer
+
+    features = FeatureUnion([
+        ('ngram_w', CountVectorizer(analyzer=SLO_WordAnalyzer(profile), binary=True, lowercase=False)),
+        ('target', TargetVectorizer(profile)),
+    ])
+    return Pipeline([('vect', features), ('clf', LinearSVC(C=C))])
+
+
+def get_rule_stances(x_values, for_class, against_class):
+    """Return the auto-coding rule stance of each of the given x values: the
+    for (or against) class if the tweet matches only its company's for (or
+    only its against) patterns, else -1.
+    """
+    stances = np.full(len(x_values), -1, dtype=np.int64)
+    for index, x_value in enumerate(x_values):
+        target, tweet = x_value.split('\t', 2)[:2]
+        if target not in PTN_for:
+            continue
+        is_for = PTN_for[target].search(tweet) is not None
+        is_against = PTN_against[target].search(tweet) is not None
+        if is_for != is_against:
+            stances[index] = for_class if is_for else against_class
+    return stances
+
+
+class CascadeClassifier:
+    """A first-stage model and rules that hand their low-margin items to a
+    second-stage model (see the module docstring).
+    """
+
+    def __init__(self, first_stage, second_stage, threshold=1.0, rule_classes=None):
+        self.first_stage = first_stage
+        self.second_stage = second_stage
+        self.threshold = threshold
+        # The (for, against) classes of the keyword rules, or None for no rules.
+        self.rule_classes = rule_classes
+        self.first_stage_count = 0
+        self.second_stage_count = 0
+
+    def get_first_stage_predictions(self, x_values):
+        """Return the first stage's predictions and decision margins of the
+        given x values, the rule-decided items having infinite margins.
+        """
+        scores = self.first_stage.decision_function(x_values)
+        classes = self.first_stage.classes_
+        if scores.ndim == 1:
+            y_predicted = classes[(scores > 0).astype(int)]
+            margins = np.abs(scores)
+        else:
+            top_scores = np.partition(scores, -2, axis=1)[:, -2:]
+            y_predicted = classes[scores.argmax(axis=1)]
+            margins = top_scores[:, 1] - top_scores[:, 0]
+        if self.rule_classes is not None:
+            strings = x_values.x_values if isinstance(x_values, ParsedDocuments) else x_values
+            stances = get_rule_stances(np.asarray(strings).tolist(), *self.rule_classes)
+            decided = stances >= 0
+            y_predicted[decided] = stances[decided]
+            margins[decided] = np.inf
+        return y_predicted, margins
+
+    def predict(self, x_values):
+        if not isinstance(x_values, ParsedDocuments):
+            x_values = np.asarray(x_values, dtype=str)
+        y_predicted, margins = self.get_first_stage_predictions(x_values)
+        escalated = np.flatnonzero(margins < self.threshold)
+        if len(escalated):
+            y_predicted[escalated] = self.second_stage.predict(x_values[escalated])
+        self.first_stage_count += len(y_predicted) - len(escalated)
+        self.second_stage_count += len(escalated)
+        return y_predicted
+
+
+def tune_cascade(cascade, x_values, y_values, thresholds, rule_options=(False, True), rule_classes=None):
+    """Return a table of the macro-F1, first-stage fraction and throughput of
+    the given cascade at each threshold, with and without its rules, and of
+    its second stage alone.
+    """
+    # Warm up both stages (e.g., a model artifact's lazy vocabularies) before
+    # timing them.
+    cascade.first_stage.decision_function(x_values[:1])
+    cascade.second_stage.predict(x_values[:1])
+    rows = []
+    start = time.perf_counter()
+    y_predicted = cascade.second_stage.predict(x_values)
+    seconds = time.perf_counter() - start
+    rows.append({
+        'rules': False,
+        'threshold': np.inf,
+        'first_stage_fraction': 0.0,
+        'f1': compute_macro_f1(y_values, y_predicted),
+        'seconds': seconds,
+        })
+    for rules in rule_options:
+        cascade.rule_classes = rule_classes if rules else None
+        for threshold in thresholds:
+            cascade.threshold = threshold
+            cascade.first_stage_count = cascade.second_stage_count = 0
+            start = time.perf_counter()
+            y_predicted = cascade.predict(x_values)
+            seconds = time.perf_counter() - start
+            rows.append({
+                'rules': rules,
+                'threshold': threshold,
+                'first_stage_fraction': cascade.first_stage_count / len(y_predicted),
+                'f1': compute_macro_f1(y_values, y_predicted),
+                'seconds': seconds,
+                })
+            logger.info('\t\t%s', rows[-1])
+    results = pd.DataFrame(rows)
+    results['f1_change'] = results['f1'] - results['f1'].iloc[0]
+    results['items_per_s'] = len(y_values) / results['seconds']
+    results['speedup'] = results['seconds'].iloc[0] / results['seconds']
+    return results
+
+
+@instrumented
+def model_cascade(
+        dataset_path='.',
+        trainset_filename='autocode.csv',
+        testset_filename='testset.csv',
+        labels=None,
+        model_filename='model.pkl',
+        cascade_filename='cascade.pkl',
+        results_filename='cascade_results.csv',
+        thresholds=(0.25, 0.5, 0.75, 1.0, 1.5, 2.0),
+        rules=(False, True),
+        max_f1_loss=0.01,
+        tune_fraction=0.5,
+        seed=0,
+        first_stage_c=1.0,
+        profile=True,
+        encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
+        logging_level=logging.INFO
+        ):
+    """This tool builds a cascade of a fast first-stage model and the given
+    (full) stance detection model, tunes its threshold on part of the specified
+    testset, evaluates it on the rest and saves it and the tuning table.
+
+    Keyword Arguments:
+        dataset_path -- the system path from which to load the datasets
+            (default='.')
+        trainset_filename -- the name of the first stage's training set file
+            (default='autocode.csv')
+        testset_filename -- the name of the (e.g., gold) testset file on which
+            to tune and evaluate the threshold
+            (default='testset.csv')
+        labels -- the training target labels
+            (default: ['against', 'for', 'neutral', 'na'])
+        model_filename -- the name of the second-stage model file, or of a
+            model artifact directory (see model_artifact.py)
+            (default='model.pkl')
+        cascade_filename -- the name of the cascade model file to save
+            (default='cascade.pkl')
+        results_filename -- the name of the tuning table (.csv) to save
+            (default='cascade_results.csv')
+        thresholds -- the first-stage decision margins to try (a margin of
+            0.0 never uses the second stage)
+            (default: (0.25, 0.5, 0.75, 1.0, 1.5, 2.0))
+        rules -- whether to try the cascade without/with the keyword rules
+            (default: (False, True))
+        max_f1_loss -- the largest macro-F1 loss vs. the full model at which
+            an operating point can be chosen
+            (default: 0.01)
+        tune_fraction -- the fraction of the testset (stratified by stance) on
+            which to tune the threshold; the rest is held out
+            (default: 0.5)
+        seed -- the random seed of the testset split
+            (default: 0)
+        first_stage_c -- the first-stage SVM's regularization setting
+            (default: 1.0)
+        profile -- whether to include use profile texts
+            (default: True)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('building cascade model...')
+
+    trainset_filepath = Path(dataset_path, trainset_filename)
+    testset_filepath = Path(dataset_path, testset_filename)
+    model_filepath = Path(dataset_path, model_filename)
+
+    labels = set_labels(labels)
+    rule_classes = (labels.index('for'), labels.index('against'))
+    rule_options = [rules] if isinstance(rules, bool) else list(rules)
+
+    with stage('load_dataset') as metrics:
+        x_train, y_train = load_dataset(trainset_filepath, labels, encoding, profile)
+        x_test, y_test = load_dataset(testset_filepath, labels, encoding, profile)
+        metrics.rows_out = len(x_train) + len(x_test)
+
+    logger.info('\tloading second-stage model from %s', model_filepath)
+    with stage('load_model'):
+        if model_filepath.is_dir():
+            # Copy the artifact's vocabularies into the model, so that the
+            # pickled cascade doesn't depend on the artifact version's files.
+            model = load_vocabularies(load_model_artifact(model_filepath))
+        else:
+            model = pickle.load(open(model_filepath, 'rb'))
+
+    logger.info('\ttraining first-stage model...')
+    with stage('fit_first_stage', rows_in=len(x_train)), warnings.catch_warnings():
+        # The unigram analyzer is callable, so CountVectorizer warns that it
+        # doesn't use its (default) token pattern.
+        warnings.simplefilter('ignore', UserWarning)
+        first_stage = get_first_stage_model(profile, first_stage_c).fit(x_train, y_train)
+
+    from sklearn.model_selection import train_test_split
+
+    tune_indexes, heldout_indexes = train_test_split(
+        np.arange(len(y_test)), train_size=tune_fraction, random_state=seed, stratify=y_test
+        )
+    logger.info(
+        '\ttuning the threshold on %s items of %s (%s held out)...',
+        len(tune_indexes), testset_filepath, len(heldout_indexes)
+        )
+    cascade = CascadeClassifier(first_stage, model)
+    with stage('tune_threshold', rows_in=len(x_test)):
+        results = tune_cascade(
+            cascade, x_test[tune_indexes], y_test[tune_indexes], list(thresholds), rule_options, rule_classes
+            )
+        heldout_results = tune_cascade(
+            cascade, x_test[heldout_indexes], y_test[heldout_indexes], list(thresholds), rule_options, rule_classes
+            )
+    results['heldout_f1'] = heldout_results['f1']
+    results['heldout_f1_change'] = heldout_results['f1_change']
+
+    candidates = results.iloc[1:]
+    candidates = candidates[candidates['f1_change'] >= -max_f1_loss]
+    if candidates.empty:
+        logger.warning('\tno operating point within %s of the full model\'s F1 - using the full model', max_f1_loss)
+        cascade.threshold, cascade.rule_classes = np.inf, None
+    else:
+        best = candidates.sort_values(by='seconds').iloc[0]
+        cascade.threshold = float(best['threshold'])
+        cascade.rule_classes = rule_classes if best['rules'] else None
+    cascade.first_stage_count = cascade.second_stage_count = 0
+    chosen = (results['threshold'] == cascade.threshold) & (results['rules'] == (cascade.rule_classes is not None))
+    heldout_f1 = results.loc[chosen, 'heldout_f1'].iloc[0]
+    logger.info(
+        '\tchose threshold %s (rules: %s), held-out F1 %s (full model: %s)',
+        cascade.threshold, cascade.rule_classes is not None, heldout_f1, results['heldout_f1'].iloc[0]
+        )
+
+    results.to_csv(Path(dataset_path, results_filename), index=False)
+    with stage('save_model'), open(Path(dataset_path, cascade_filename), 'wb') as cascade_fout:
+        pickle.dump(cascade, cascade_fout)
+    print(results.round(4).to_string(index=False))
+    print(
+        f'chose threshold {cascade.threshold} (rules: {cascade.rule_classes is not None}), '
+        f'held-out F1 {heldout_f1:.4f} (full model: {results["heldout_f1"].iloc[0]:.4f})'
+        )
+
+
+if __name__ == '__main__':
+    # Run the imported module's tool, so that the cascade is pickled as a
+    # src.model_cascade.CascadeClassifier rather than a __main__ one, which
+    # model_test couldn't unpickle.
+    from src.model_cascade import model_cascade as imported_model_cascade
+    Fire(imported_model_cascade)
@@ -0,0 +1,177 @@
+"""
+This module serves the latest version of a model directory of versioned
+artifacts (see model_artifact.py) to a long-running process, picking up the
+new versions that model_build saves without a restart.
+
+A ModelRegistry polls the model directory in a background thread. When a new
+version appears, it loads the artifact and warms it up -- a predict() call on
+a small batch, which materializes the lazy vocabularies and pages in the
+memory-mapped arrays -- while the current version keeps serving. It then swaps
+the new version in with a single attribute assignment, so predict() calls see
+either the old or the new version, never a partial one, and never wait for a
+load. The versions it replaced are kept (up to history_size) for rollback().
+
+A version that fails to load/warm up, or that is rolled back, is skipped by
+later polls; only a newer version replaces it.
+
+If given a PredictionCache (see prediction_cache.py), predict() goes through
+it, tagged with the current version, so each swap/rollback invalidates it.
+
+See benchmarks/benchmark_model_registry.py for predict() latencies around a
+swap under steady load.
+"""
+import logging
+import threading
+import time
+from pathlib import Path
+
+from src.model_artifact import list_model_versions, load_model_artifact
+from src.settings import company_list
+
+logger = logging.getLogger(__name__)
+
+# The default warm-up batch: one x value (see model_utilities.get_x()) per
+# trainset company.
+WARMUP_X = [f'{company}\tslo_mention {company} slo_url\t{company}' for company in company_list]
+
+
+class ModelVersion:
+    """A loaded, warmed-up model artifact version."""
+
+    def __init__(self, version, model, load_seconds, warmup_seconds):
+        self.version = version
+        self.model = model
+        self.load_seconds = load_seconds
+        self.warmup_seconds = warmup_seconds
+        self.activated = None
+
+
+class ModelRegistry:
+    """The current model version of the given model directory, hot-reloaded
+    (see the module docstring).
+    """
+
+    def __init__(self, model_dirpath, warmup_x=None, poll_seconds=5.0, history_size=1, cache=None):
+        self.model_dirpath = Path(model_dirpath)
+        self.warmup_x = list(WARMUP_X if warmup_x is None else warmup_x)
+        self.poll_seconds = poll_seconds
+        self.history_size = history_size
+        self.cache = cache
+        self.current = None
+        self.history = []
+        self.skipped_versions = set()
+        self.swap_count = 0
+        # Serializes refresh()/rollback(); predict() never takes it.
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def load_version(self, artifact_dirpath):
+        """Load and warm up the given artifact directory."""
+        start = time.perf_counter()
+        model = load_model_artifact(artifact_dirpath)
+        loaded = time.perf_counter()
+        if self.warmup_x:
+            model.predict(self.warmup_x)
+        return ModelVersion(
+            Path(artifact_dirpath).name, model, loaded - start, time.perf_counter() - loaded
+            )
+
+    def activate(self, model_version):
+        """Make the given version the current one (with the lock held)."""
+        model_version.activated = time.time()
+        previous, self.current = self.current, model_version
+        if previous is not None:
+            self.history = (self.history + [previous])[-self.history_size:] if self.history_size else []
+        self.swap_count += 1
+
+    def refresh(self):
+        """Load, warm up and swap in the latest version, if it is new, and
+        return whether the current version changed.
+        """
+        with self.lock:
+            versions = [
+                path for path in list_model_versions(self.model_dirpath)
+                if path.name not in self.skipped_versions
+                ]
+            if not versions or (self.current is not None and versions[-1].name <= self.current.version):
+                return False
+            artifact_dirpath = versions[-1]
+            logger.info('\tloading model version %s...', artifact_dirpath.name)
+            try:
+                model_version = self.load_version(artifact_dirpath)
+            except Exception:
+                logger.exception('\tskipping model version %s, which failed to load', artifact_dirpath.name)
+                self.skipped_versions.add(artifact_dirpath.name)
+                return False
+            self.activate(model_version)
+            logger.info(
+                '\tswapped in model version %s (load: %.3fs, warm-up: %.3fs)',
+                model_version.version, model_version.load_seconds, model_version.warmup_seconds
+                )
+            return True
+
+    def rollback(self):
+        """Swap the previous version back in, skipping the current one from
+        then on, and return the restored version's name.
+        """
+        with self.lock:
+            if not self.history:
+                raise ValueError('no previous model version to roll back to')
+            rolled_back = self.current
+            self.skipped_versions.add(rolled_back.version)
+            self.current = self.history.pop()
+            self.current.activated = time.time()
+            self.swap_count += 1
+            logger.warning('\trolled back model version %s to %s', rolled_back.version, self.current.version)
+            return self.current.version
+
+    def get_version(self):
+        """Return the current version's name, or None before the first load."""
+        model_version = self.current
+        return None if model_version is None else model_version.version
+
+    def predict(self, x_values):
+        """Predict with the current version."""
+        # Read the current version once, so a concurrent swap can't mix versions.
+        model_version = self.current
+        if model_version is None:
+            raise RuntimeError(f'no model version loaded from {self.model_dirpath}')
+        if self.cache is not None:
+            return self.cache.predict(model_version.model, x_values, model_version.version)
+        return model_version.model.predict(x_values)
+
+    def poll(self):
+        """Refresh the registry every poll_seconds until stop() is called."""
+        while not self.stop_event.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the current version, e.g., if the directory is
+                # briefly unavailable.
+                logger.exception('\tfailed to poll %s', self.model_dirpath)
+
+    def start(self):
+        """Load the latest version (synchronously) and start polling for new
+        versions in a background thread.
+        """
+        self.refresh()
+        if self.current is None:
+            raise FileNotFoundError(f'no loadable model artifacts found in {self.model_dirpath}')
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.poll, name='model-registry', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop polling."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,171 @@
+"""
+This module trains and applies sharded stance models: one model per company,
+trained in parallel processes and bundled in a ShardedModel, which routes each
+item to its company's model by the company (target) field of its x value (see
+model_utilities.get_x()).
+
+A company's shard can be retrained without retraining the others (see
+train_sharded_model()), and each prediction only goes through the (smaller)
+model of its company. Items of companies without a shard of their own (e.g.,
+a company missing from the trainset, or a tweet that mentions several
+companies, such as 'adani|bhp') are predicted by a pooled shard, trained on
+all the items.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.dummy import DummyClassifier
+
+from src.model_svm import get_model, EmbeddingVectorizer
+from src.model_utilities import ParsedDocuments
+from src.compact_vectors import load_word_vectors
+
+logger = logging.getLogger(__name__)
+
+# The name of the shard trained on all the companies' items.
+POOLED_SHARD = '_pooled'
+
+
+def get_companies(x_values):
+    """Returns the company (target) of each of the given x values."""
+    if isinstance(x_values, ParsedDocuments):
+        return np.asarray(x_values.target_names, dtype=str)[x_values.target_codes]
+    return np.asarray([x_value.split('\t', 1)[0] for x_value in x_values], dtype=str)
+
+
+def set_word_vectors(model, wordvec):
+    """Sets the word vectors of the given model's embedding branch, if any."""
+    vect = getattr(model, 'named_steps', {}).get('vect')
+    for _, transformer in getattr(vect, 'transformer_list', []):
+        if isinstance(transformer, EmbeddingVectorizer):
+            transformer.wordvec = wordvec
+
+
+def get_word_vectors(model):
+    """Returns the word vectors of the given model's embedding branch, or None."""
+    vect = getattr(model, 'named_steps', {}).get('vect')
+    for _, transformer in getattr(vect, 'transformer_list', []):
+        if isinstance(transformer, EmbeddingVectorizer):
+            return transformer.wordvec
+    return None
+
+
+class ShardedModel:
+    """A bundle of per-company stance models, which predicts each item with its
+    company's model, or with the pooled shard if its company has none. The
+    shards share one set of word vectors, so the bundle pickles them once.
+    """
+
+    def __init__(self, models):
+        self.models = dict(models)
+
+    def predict(self, x_values):
+        if not isinstance(x_values, ParsedDocuments):
+            x_values = np.asarray(x_values)
+        companies = get_companies(x_values).astype(object)
+        unknown = ~np.isin(companies, [company for company in self.models if company != POOLED_SHARD])
+        if unknown.any():
+            unknown_companies = sorted(set(companies[unknown].tolist()))
+            if POOLED_SHARD not in self.models:
+                raise ValueError(f'no model shards for companies {unknown_companies} and no pooled shard')
+            logger.warning(
+                '\t\tpredicting %s items of companies without shards %s with the pooled shard',
+                unknown.sum(), unknown_companies
+                )
+            companies[unknown] = POOLED_SHARD
+
+        y_predicted = np.empty(len(companies), dtype=np.int64)
+        for company in np.unique(companies):
+            indexes = np.flatnonzero(companies == company)
+            y_predicted[indexes] = self.models[company].predict(x_values[indexes])
+        return y_predicted
+
+    def update(self, models):
+        """Replaces (or adds) the given company shards, making them share this
+        bundle's word vectors (if it has any yet).
+        """
+        wordvec = next(
+            (get_word_vectors(model) for model in self.models.values() if get_word_vectors(model) is not None),
+            None
+            )
+        for company, model in models.items():
+            if wordvec is not None and get_word_vectors(model) is not None:
+                set_word_vectors(model, wordvec)
+            self.models[company] = model
+
+
+def train_shard(company, x_values, y_values, word_vectors_filepath, model_options, sample_weights=None):
+    """Trains the given company's model (see model_svm.get_model()) and returns
+    it without its word vectors, which the bundle shares. A company coded with
+    only one stance gets a constant model.
+    """
+    if len(np.unique(y_values)) < 2:
+        logger.warning('\t\t%s has only one stance - using a constant model', company)
+        return company, DummyClassifier(strategy='most_frequent').fit(x_values, y_values)
+
+    fit_params = {} if sample_weights is None else {'clf__sample_weight': sample_weights}
+    model = get_model(word_vectors_filepath, **model_options)
+    model.fit(ParsedDocuments(x_values), y_values, **fit_params)
+    set_word_vectors(model, None)
+    return company, model
+
+
+def train_sharded_model(
+        x_values,
+        y_values,
+        word_vectors_filepath,
+        model_options=None,
+        companies=None,
+        sharded_model=None,
+        n_jobs=None,
+        sample_weights=None,
+        pooled=True
+        ):
+    """Trains the shards of the given (or all the) companies in n_jobs processes
+    (default, or -1: one per core) and returns them as a new ShardedModel or, if one is
+    given, as updated shards of sharded_model.
+
+    Training all the companies also trains the pooled shard (unless pooled is
+    false) on all the items, which takes about as long as an unsharded model;
+    it can also be retrained on its own by giving POOLED_SHARD as a company.
+
+    The word vectors are given as a gensim .kv file (see
+    model_artifact.get_mmap_embedding_filepath()) so that every process
+    memory-maps the same vectors.
+    """
+    model_options = model_options or {}
+    x_companies = get_companies(x_values)
+    x_strings = np.asarray(x_values)
+    if companies is None:
+        # The pooled shard first, as it takes the longest.
+        companies = ([POOLED_SHARD] if pooled else []) + sorted(set(x_companies.tolist()))
+    else:
+        companies = [companies] if isinstance(companies, str) else list(companies)
+
+    job_count = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+    with ProcessPoolExecutor(min(job_count, len(companies))) as executor:
+        futures = []
+        for company in companies:
+            mask = np.ones(len(x_companies), dtype=bool) if company == POOLED_SHARD else x_companies == company
+            if not mask.any():
+                raise ValueError(f'no training items for company {company}')
+            logger.info('\t\ttraining the %s shard on %s items...', company, mask.sum())
+            futures.append(executor.submit(
+                train_shard,
+                company,
+                x_strings[mask],
+                y_values[mask],
+                word_vectors_filepath,
+                model_options,
+                None if sample_weights is None else sample_weights[mask]
+                ))
+        models = dict(future.result() for future in futures)
+
+    wordvec = load_word_vectors(word_vectors_filepath)
+    for model in models.values():
+        set_word_vectors(model, wordvec)
+    if sharded_model is None:
+        sharded_model = ShardedModel({})
+    sharded_model.update(models)
+    return sharded_model
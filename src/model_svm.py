@@ -21,8 +21,18 @@ Specification
 """
 
 # from datetime import datetime
+import copy
+from array import array
+import heapq
+import numbers
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from functools import lru_cache
 from typing import List
 import numpy as np
+import scipy.sparse
 from gensim.models import KeyedVectors
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.feature_extraction.text import CountVectorizer
@@ -32,7 +42,11 @@ from sklearn.model_selection import GridSearchCV
 from sklearn.pipeline import FeatureUnion, Pipeline
 from sklearn.svm import LinearSVC
 
-from src.model_utilities import split_x_value
+from src.model_utilities import (
+    split_x_value, iter_chunks, ParsedDocument, ParsedDocuments, share_arrays, attach_arrays
+    )
+from src.settings import PTN_companies
+from src.compact_vectors import CompactKeyedVectors, load_word_vectors
 
 
 class TargetVectorizer(BaseEstimator, TransformerMixin):
@@ -41,10 +55,15 @@ class TargetVectorizer(BaseEstimator, TransformerMixin):
     Mohammad '17 says:
         For instance, for 'Hillary Clinton', the mention of either 'Hillary' or 'Clinton'
         (case insensitive; with or without hashtag) in the tweet shows the presence of target.
+
+    The target mention forms are expanded once per target and cached as frozensets.
+    With aliases set, the company's pattern in settings.PTN_companies (e.g.,
+    'rio tinto', 'b.h.p.') also marks the target as present.
     """
 
-    def __init__(self, profile: bool) -> None:
+    def __init__(self, profile: bool, aliases: bool=False) -> None:
         self.profile = profile
+        self.aliases = aliases
 
     def get_feature_names(self) -> np.ndarray:
         return np.array(['target'])
@@ -56,20 +75,72 @@ class TargetVectorizer(BaseEstimator, TransformerMixin):
         """Create list of target mention forms, e.g.,
         'Hillary Clinton' -> hillary, clinton, #hillary, #clinton
         """
-        targets = [t.lower() for t in target.split()]
-        targets.extend(['#' + t.lower() for t in target.split()])
-        return targets
+        return list(get_target_forms(target))
 
     def transform(self, x_values):
-        presences = [0] * len(x_values)
-        for i, x_value in enumerate(x_values):
-            target, tweet, _ = split_x_value(x_value, self.profile)
-            targets = self.expand_target_words(target)
-            for word in tweet.split():
-                if word.lower() in targets:
+        # Models pickled before aliases was added don't have the attribute.
+        aliases = getattr(self, 'aliases', False)
+        if isinstance(x_values, ParsedDocuments):
+            presences = self.transform_parsed(x_values)
+            if aliases:
+                for i in np.flatnonzero(presences == 0):
+                    target, tweet = x_values.x_values[i].split('\t')[:2]
+                    pattern = PTN_company_aliases.get(target)
+                    if pattern is not None and pattern.search(tweet.lower()):
+                        presences[i] = 1
+            return presences[:, np.newaxis]
+
+        x_values = x_values.tolist() if isinstance(x_values, np.ndarray) else list(x_values)
+        # The target and tweet are the first two fields (see split_x_value()).
+        targets, tweets = zip(*(x_value.split('\t', 2)[:2] for x_value in x_values)) \
+            if x_values else ((), ())
+        tweets = [tweet.lower() for tweet in tweets]
+        presences = np.fromiter(
+            (
+                not get_target_forms(target).isdisjoint(tweet.split())
+                for target, tweet in zip(targets, tweets)
+            ),
+            dtype=np.int64,
+            count=len(x_values)
+            )
+        if aliases:
+            for i in np.flatnonzero(presences == 0):
+                pattern = PTN_company_aliases.get(targets[i])
+                if pattern is not None and pattern.search(tweets[i]):
                     presences[i] = 1
-                    break
-        return np.array([presences]).T
+        return presences[:, np.newaxis]
+
+    def transform_parsed(self, documents):
+        """Return the target presences of the given ParsedDocuments, matching
+        the lowercase forms of all the tweet tokens against each target's
+        mention forms at once.
+        """
+        token_ids, lengths = documents.get_token_ids('tweet', 'tweet')
+        lowercase_ids = documents.lowercase_ids[token_ids]
+        token_documents = np.repeat(np.arange(len(documents)), lengths)
+        token_targets = documents.target_codes[token_documents]
+        matches = np.zeros(len(token_ids), dtype=bool)
+        for target_code, target in enumerate(documents.target_names):
+            form_ids = [
+                documents.lowercase_index[form] for form in get_target_forms(target)
+                if form in documents.lowercase_index
+                ]
+            target_tokens = token_targets == target_code
+            matches[target_tokens] = np.isin(lowercase_ids[target_tokens], form_ids)
+        return (np.bincount(token_documents[matches], minlength=len(documents)) > 0).astype(np.int64)
+
+
+# The PTN_companies pattern of each company, for TargetVectorizer's aliases.
+PTN_company_aliases = {company: pattern for company, pattern, _ in PTN_companies}
+
+
+@lru_cache(maxsize=None)
+def get_target_forms(target):
+    """Return the set of (lowercase) mention forms of the given target, e.g.,
+    'Hillary Clinton' -> {hillary, clinton, #hillary, #clinton}
+    """
+    words = target.lower().split()
+    return frozenset(words + ['#' + word for word in words])
 
 
 class EmbeddingVectorizer(BaseEstimator, TransformerMixin):
@@ -78,9 +149,13 @@ class EmbeddingVectorizer(BaseEstimator, TransformerMixin):
     def __init__(self, wordvec: KeyedVectors, profile: bool) -> None:
         self.wordvec = wordvec
         self.wordvec_dim = self.wordvec.vector_size
-        self.zeros = np.zeros(self.wordvec_dim)
+        # Compact word vectors are averaged in float32.
+        self.zeros = np.zeros(self.wordvec_dim, dtype=self.get_dtype())
         self.profile = profile
 
+    def get_dtype(self):
+        return np.float32 if isinstance(self.wordvec, CompactKeyedVectors) else np.float64
+
     def get_feature_names(self) -> np.ndarray:
         return np.array([f'd{i}' for i in range(1, self.wordvec_dim + 1)])
 
@@ -88,6 +163,8 @@ class EmbeddingVectorizer(BaseEstimator, TransformerMixin):
         return self
 
     def transform(self, x_values):
+        if isinstance(x_values, ParsedDocuments):
+            return self.transform_parsed(x_values)
         ret = []
         for x_value in x_values:
             # Include embeddings for target, tweet and profile texts.
@@ -100,12 +177,67 @@ class EmbeddingVectorizer(BaseEstimator, TransformerMixin):
 
         return np.array(ret)
 
+    def transform_parsed(self, documents):
+        """Return the mean word vectors of the given ParsedDocuments, looking
+        up each distinct token once. The means are computed as transform()
+        computes them: each document's vectors are summed in token order, in
+        float32 unless the document has unknown or blank (split(' ')) tokens,
+        whose float64 zero vectors make numpy sum in float64, and divided by
+        its token count. The k-th token vectors of all the documents are added
+        at once. Documents with whitespace other than spaces/tabs are averaged
+        the original way.
+        """
+        token_ids, lengths = documents.get_token_ids()
+        unique_ids, token_columns = np.unique(token_ids, return_inverse=True)
+        token_columns = token_columns.ravel()
+        vectors = np.zeros((len(unique_ids), self.wordvec_dim), dtype=np.float32)
+        known = np.zeros(len(unique_ids), dtype=bool)
+        known_words = []
+        for column, word in enumerate(documents.vocabulary[unique_ids].tolist()):
+            if word in self.wordvec:
+                known[column] = True
+                known_words.append(word)
+        if known_words:
+            vectors[known] = self.wordvec[known_words]
+
+        dtype = self.get_dtype()
+        starts = np.cumsum(lengths) - lengths
+        unknown_counts = np.bincount(
+            np.repeat(np.arange(len(documents)), lengths), weights=~known[token_columns], minlength=len(documents)
+            )
+        if dtype == np.float32:
+            wide = np.zeros(len(documents), dtype=bool)
+        else:
+            wide = (unknown_counts > 0) | (documents.blank_counts > 0)
+        sums = np.zeros((len(documents), self.wordvec_dim), dtype=np.float32)
+        wide_sums = np.zeros((len(documents), self.wordvec_dim), dtype=np.float64)
+        for k in range(lengths.max(initial=0)):
+            rows = np.flatnonzero(lengths > k)
+            columns = token_columns[starts[rows] + k]
+            is_wide = wide[rows]
+            sums[rows[~is_wide]] += vectors[columns[~is_wide]]
+            wide_sums[rows[is_wide]] += vectors[columns[is_wide]]
+
+        counts = (lengths + documents.blank_counts)[:, np.newaxis]
+        means = np.where(
+            wide[:, np.newaxis], wide_sums / counts, sums / counts.astype(np.float32)
+            ).astype(dtype, copy=False)
+        for i in np.flatnonzero(documents.irregular):
+            means[i] = self.transform([str(documents.x_values[i])])[0]
+        return means
+
 
 class SLO_WordAnalyzer(BaseEstimator):
     def __init__(self, profile: bool) -> None:
         self.profile = profile
 
     def __call__(self, doc: str) -> List[str]:
+        if isinstance(doc, ParsedDocument):
+            # Use the document's pre-split tokens, in the same order.
+            target_tokens, t_tokens, p_tokens = doc.get_field_tokens()
+            if self.profile:
+                return [f't_{tok}' for tok in target_tokens] + t_tokens + [f'p_{tok}' for tok in p_tokens]
+            return target_tokens + t_tokens + p_tokens
         if self.profile:
             # Concatenate target, tweet text and profile description,
             # prefixing target and profile tokens to distinguish them
@@ -123,33 +255,513 @@ class SLO_WordAnalyzer(BaseEstimator):
             return doc.split()
 
 
+class CompactCountVectorizer(CountVectorizer):
+    """A CountVectorizer that keeps featurization memory down on large datasets.
+
+    CountVectorizer builds the full (unpruned) document-term matrix for the
+    whole dataset, and a dict of every term, before applying
+    min_df/max_features. This version:
+    - counts document frequencies chunk by chunk by the (64-bit) hash of each
+        term, merging each chunk's counts into numpy arrays (16 bytes per
+        distinct term, rather than a dict entry and string), and prunes by
+        min_df/max_df/max_features on the counts; max_features keeps the terms
+        with the highest document frequencies (the same ranking as
+        CountVectorizer's when binary=True), ties at the cut being broken by
+        hash (which, for str terms, varies with PYTHONHASHSEED)
+    - builds the vocabulary of the kept terms only, along with the matrix, in
+        typed arrays with int32 indices, which it sorts in place
+
+    With min_df=1 (and no max_df/max_features), nothing is pruned, so the
+    vocabulary is as large as CountVectorizer's; only the counts and matrix
+    take less memory. Two terms with the same hash (a few chances in 10^6 for
+    10 million distinct terms) share their document count.
+
+    The documents must be re-iterable (e.g., a list or array), as they are
+    scanned once to count the terms and once to build the matrix.
+    """
+
+    def __init__(
+            self,
+            *,
+            analyzer='word',
+            ngram_range=(1, 1),
+            binary=False,
+            lowercase=True,
+            min_df=1,
+            max_df=1.0,
+            max_features=None,
+            dtype=np.int64,
+            chunk_size=10000
+            ):
+        super().__init__(
+            analyzer=analyzer,
+            ngram_range=ngram_range,
+            binary=binary,
+            lowercase=lowercase,
+            min_df=min_df,
+            max_df=max_df,
+            max_features=max_features,
+            dtype=dtype
+            )
+        self.chunk_size = chunk_size
+
+    def fit(self, raw_documents, y=None):
+        self.fit_transform(raw_documents)
+        return self
+
+    def fit_transform(self, raw_documents, y=None):
+        if isinstance(raw_documents, str):
+            raise ValueError('Iterable over raw text documents expected, string object received.')
+        analyze = self.build_analyzer()
+
+        # The distinct term hashes seen so far (sorted) and their document counts.
+        hashes = np.empty(0, dtype=np.int64)
+        counts = np.empty(0, dtype=np.int64)
+        document_total = 0
+        for chunk in iter_chunks(raw_documents, self.chunk_size):
+            chunk_counts = Counter(hash(term) for doc in chunk for term in set(analyze(doc)))
+            chunk_hashes = np.fromiter(chunk_counts.keys(), dtype=np.int64, count=len(chunk_counts))
+            chunk_counts = np.fromiter(chunk_counts.values(), dtype=np.int64, count=len(chunk_counts))
+            hashes, inverse = np.unique(np.concatenate([hashes, chunk_hashes]), return_inverse=True)
+            counts = np.bincount(
+                inverse, weights=np.concatenate([counts, chunk_counts]), minlength=len(hashes)
+                ).astype(np.int64)
+            document_total += len(chunk)
+        kept_hashes = set(get_pruned_hashes(self, hashes, counts, document_total).tolist())
+        del hashes, counts
+
+        # The kept terms, indexed in order of appearance until they are sorted,
+        # and the matrix, in typed arrays (4/8 bytes per entry, rather than a
+        # list's pointer and int).
+        vocabulary = {}
+        indices = array('i')
+        values = array('q')
+        indptr = array('q', [0])
+        for doc in raw_documents:
+            term_counts = Counter(term for term in analyze(doc) if hash(term) in kept_hashes)
+            indices.extend(vocabulary.setdefault(term, len(vocabulary)) for term in term_counts)
+            if not self.binary:
+                values.extend(term_counts.values())
+            indptr.append(len(indices))
+
+        # Index the features in sorted order, as CountVectorizer does,
+        # remapping the matrix indices in place, chunk by chunk.
+        terms = sorted(vocabulary)
+        sorted_indices = np.empty(len(terms), dtype=np.int32)
+        sorted_indices[[vocabulary[term] for term in terms]] = np.arange(len(terms), dtype=np.int32)
+        self.vocabulary_ = {term: index for index, term in enumerate(terms)}
+        self.fixed_vocabulary_ = False
+        del vocabulary
+        indices = np.frombuffer(indices, dtype=np.int32)
+        for start in range(0, len(indices), self.chunk_size * 100):
+            stop = start + self.chunk_size * 100
+            indices[start:stop] = sorted_indices[indices[start:stop]]
+
+        data = np.ones(len(indices), dtype=self.dtype) if self.binary \
+            else np.frombuffer(values, dtype=np.int64).astype(self.dtype)
+        indptr = np.frombuffer(indptr, dtype=np.int64)
+        if len(indices) <= np.iinfo(np.int32).max:
+            indptr = indptr.astype(np.int32)
+        matrix = scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, len(terms)))
+        matrix.sort_indices()
+        return matrix
+
+    def transform(self, raw_documents):
+        if isinstance(raw_documents, str):
+            raise ValueError('Iterable over raw text documents expected, string object received.')
+        transform_chunk = super().transform
+        blocks = [transform_chunk(chunk) for chunk in iter_chunks(raw_documents, self.chunk_size)]
+        # vstack keeps int32 indices as long as the stacked matrix fits them.
+        return scipy.sparse.vstack(blocks, format='csr', dtype=self.dtype)
+
+
+def get_document_count_range(vectorizer, document_total):
+    """Return the smallest and largest document counts of the terms that the
+    given count vectorizer's min_df and max_df settings keep.
+    """
+    min_count = vectorizer.min_df if isinstance(vectorizer.min_df, numbers.Integral) \
+        else vectorizer.min_df * document_total
+    max_count = vectorizer.max_df if isinstance(vectorizer.max_df, numbers.Integral) \
+        else vectorizer.max_df * document_total
+    return min_count, max_count
+
+
+def get_pruned_vocabulary(vectorizer, document_counts, document_total):
+    """Return the vocabulary (term -> feature index) that the given count
+    vectorizer's min_df, max_df and max_features settings keep, given the
+    number of documents in which each term appears.
+    """
+    min_count, max_count = get_document_count_range(vectorizer, document_total)
+    terms = [
+        term for term, count in document_counts.items()
+        if min_count <= count <= max_count
+        ]
+    if vectorizer.max_features is not None and len(terms) > vectorizer.max_features:
+        terms = heapq.nlargest(vectorizer.max_features, terms, key=document_counts.__getitem__)
+    if not terms:
+        raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+
+    # Index the features in sorted order, as CountVectorizer does.
+    return {term: index for index, term in enumerate(sorted(terms))}
+
+
+def get_pruned_hashes(vectorizer, hashes, counts, document_total):
+    """Return the term hashes that the given count vectorizer's min_df, max_df
+    and max_features settings keep, given the number of documents in which
+    each (hashed) term appears.
+    """
+    min_count, max_count = get_document_count_range(vectorizer, document_total)
+    kept = (counts >= min_count) & (counts <= max_count)
+    hashes, counts = hashes[kept], counts[kept]
+    if vectorizer.max_features is not None and len(hashes) > vectorizer.max_features:
+        hashes = hashes[np.argsort(-counts, kind='stable')[:vectorizer.max_features]]
+    if not len(hashes):
+        raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+    return hashes
+
+
+class CompactFeatureUnion(FeatureUnion):
+    """A FeatureUnion that stacks its branch outputs chunk by chunk.
+
+    FeatureUnion stacks a mix of sparse and dense branch outputs through an
+    intermediate COO matrix, which is several times the size of the result.
+    This version allocates the float64 CSR result that LinearSVC uses once and
+    fills it chunk_size rows at a time.
+    """
+
+    def __init__(
+            self,
+            transformer_list,
+            *,
+            n_jobs=None,
+            transformer_weights=None,
+            verbose=False,
+            chunk_size=10000
+            ):
+        super().__init__(
+            transformer_list,
+            n_jobs=n_jobs,
+            transformer_weights=transformer_weights,
+            verbose=verbose
+            )
+        self.chunk_size = chunk_size
+
+    def _hstack(self, Xs):
+        blocks = [
+            X.tocsr() if scipy.sparse.issparse(X) else scipy.sparse.csr_matrix(X)
+            for X in Xs
+            ]
+        row_count = blocks[0].shape[0]
+        column_count = sum(block.shape[1] for block in blocks)
+        nnz = sum(block.nnz for block in blocks)
+        index_dtype = np.int32 if max(nnz, column_count) < np.iinfo(np.int32).max else np.int64
+
+        indptr = np.zeros(row_count + 1, dtype=index_dtype)
+        for block in blocks:
+            indptr += block.indptr
+        data = np.empty(nnz, dtype=np.float64)
+        indices = np.empty(nnz, dtype=index_dtype)
+        for start in range(0, row_count, self.chunk_size):
+            stop = min(start + self.chunk_size, row_count)
+            chunk = scipy.sparse.hstack([block[start:stop] for block in blocks], format='csr')
+            data[indptr[start]:indptr[stop]] = chunk.data
+            indices[indptr[start]:indptr[stop]] = chunk.indices
+
+        return scipy.sparse.csr_matrix(
+            (data, indices, indptr),
+            shape=(row_count, column_count),
+            copy=False
+            )
+
+
+# The documents and transformers of a ParallelFeatureUnion worker process (see
+# initialize_feature_worker()).
+__feature_worker_global__ = {}
+
+
+def initialize_feature_worker(specs, attributes, transformers, embedding_filepath):
+    """Attaches the shared documents (see ParallelFeatureUnion) and the word
+    vectors of a ParallelFeatureUnion worker process.
+    """
+    blocks, arrays = attach_arrays(specs)
+    if embedding_filepath is not None:
+        wordvec = load_word_vectors(embedding_filepath)
+        for transformer in transformers.values():
+            if isinstance(transformer, EmbeddingVectorizer) and transformer.wordvec is None:
+                transformer.wordvec = wordvec
+    __feature_worker_global__.update(
+        blocks=blocks,
+        documents=arrays['x_values'] if attributes is None else ParsedDocuments.from_state(arrays, attributes),
+        transformers=transformers
+        )
+
+
+def count_document_terms(name, start, stop):
+    """Returns the number of the given documents in which each term of the
+    given (count vectorizer) branch appears.
+    """
+    state = __feature_worker_global__
+    analyze = state['transformers'][name].build_analyzer()
+    document_counts = Counter()
+    for doc in state['documents'][start:stop]:
+        document_counts.update(set(analyze(doc)))
+    return document_counts
+
+
+def fit_branch(name, y):
+    """Fits the given branch to all the documents and returns it, without its
+    word vectors (which the parent process already has).
+    """
+    state = __feature_worker_global__
+    transformer = state['transformers'][name].fit(state['documents'], y)
+    if isinstance(transformer, EmbeddingVectorizer):
+        transformer = copy.copy(transformer)
+        transformer.wordvec = None
+    return transformer
+
+
+def transform_branch(name, start, stop):
+    """Returns the given (fitted) branch's features of the given documents."""
+    state = __feature_worker_global__
+    return state['transformers'][name].transform(state['documents'][start:stop])
+
+
+class ParallelFeatureUnion(CompactFeatureUnion):
+    """A CompactFeatureUnion that extracts the features in n_jobs worker
+    processes:
+    - fit counts the terms of the count vectorizer branches (as used for
+        the n-grams) chunk by chunk, in parallel, and builds their vocabularies
+        from the totals; the other branches are fitted concurrently
+    - transform transforms every chunk of every branch concurrently
+
+    The documents (for ParsedDocuments, including their token vocabulary) are
+    passed to the workers in shared memory and the word vectors are
+    memory-mapped by each worker from embedding_filepath (a gensim .kv file,
+    see model_artifact.get_mmap_embedding_filepath(); best given as an
+    absolute path), so neither is pickled to every worker. Without embedding_filepath, the workers get a copy
+    of the word vectors. Fewer than min_parallel_size documents are processed
+    in this process, as CompactFeatureUnion does.
+
+    Count vectorizer vocabularies are the ones CountVectorizer would build,
+    except that max_features ranks the terms by document frequency (see
+    CompactCountVectorizer), so count vectorizers with max_features must be
+    binary.
+    """
+
+    def __init__(
+            self,
+            transformer_list,
+            *,
+            n_jobs=None,
+            transformer_weights=None,
+            verbose=False,
+            chunk_size=10000,
+            embedding_filepath=None,
+            min_parallel_size=2000
+            ):
+        super().__init__(
+            transformer_list,
+            n_jobs=n_jobs,
+            transformer_weights=transformer_weights,
+            verbose=verbose,
+            chunk_size=chunk_size
+            )
+        self.embedding_filepath = embedding_filepath
+        self.min_parallel_size = min_parallel_size
+
+    def get_job_count(self, x_values):
+        if self.n_jobs is None or len(x_values) < self.min_parallel_size:
+            return 1
+        return os.cpu_count() if self.n_jobs < 0 else self.n_jobs
+
+    def get_chunks(self, x_values, job_count):
+        """Returns the (start, stop) chunks in which to split the given documents,
+        at least one per job.
+        """
+        chunk_size = min(self.chunk_size, -(-len(x_values) // job_count))
+        return [(start, min(start + chunk_size, len(x_values))) for start in range(0, len(x_values), chunk_size)]
+
+    def get_branches(self):
+        return [
+            (name, transformer) for name, transformer in self.transformer_list
+            if transformer not in ('drop', None)
+            ]
+
+    def run_tasks(self, x_values, job_count, tasks):
+        """Runs the given (function, arguments) tasks on the given documents in
+        job_count worker processes and returns their results, in order.
+        """
+        if isinstance(x_values, ParsedDocuments):
+            arrays, attributes = x_values.get_state()
+        else:
+            x_values = np.asarray(x_values)
+            arrays, attributes = {'x_values': x_values.astype(str) if x_values.dtype == object else x_values}, None
+        transformers = {}
+        for name, transformer in self.get_branches():
+            if isinstance(transformer, EmbeddingVectorizer) and self.embedding_filepath is not None:
+                transformer = copy.copy(transformer)
+                transformer.wordvec = None
+            transformers[name] = transformer
+
+        blocks, specs = share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(
+                    job_count,
+                    initializer=initialize_feature_worker,
+                    initargs=(specs, attributes, transformers, self.embedding_filepath)
+                    ) as executor:
+                futures = [executor.submit(function, *arguments) for function, arguments in tasks]
+                return [future.result() for future in futures]
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def fit(self, X, y=None, **fit_params):
+        job_count = self.get_job_count(X)
+        if job_count == 1:
+            return super().fit(X, y, **fit_params)
+
+        branches = self.get_branches()
+        chunks = self.get_chunks(X, job_count)
+        tasks = []
+        for name, transformer in branches:
+            if isinstance(transformer, CountVectorizer) and transformer.vocabulary is None:
+                tasks.extend((count_document_terms, (name, start, stop)) for start, stop in chunks)
+            else:
+                tasks.append((fit_branch, (name, y)))
+        results = iter(self.run_tasks(X, job_count, tasks))
+
+        fitted = {}
+        for name, transformer in branches:
+            if isinstance(transformer, CountVectorizer) and transformer.vocabulary is None:
+                document_counts = Counter()
+                for _ in chunks:
+                    document_counts.update(next(results))
+                transformer.vocabulary_ = get_pruned_vocabulary(transformer, document_counts, len(X))
+                transformer.fixed_vocabulary_ = False
+                fitted[name] = transformer
+            else:
+                fitted[name] = next(results)
+                if isinstance(transformer, EmbeddingVectorizer):
+                    fitted[name].wordvec = transformer.wordvec
+        self.transformer_list = [
+            (name, fitted.get(name, transformer)) for name, transformer in self.transformer_list
+            ]
+        return self
+
+    def fit_transform(self, X, y=None, **fit_params):
+        if self.get_job_count(X) == 1:
+            return super().fit_transform(X, y, **fit_params)
+        return self.fit(X, y, **fit_params).transform(X)
+
+    def transform(self, X):
+        job_count = self.get_job_count(X)
+        if job_count == 1:
+            return super().transform(X)
+
+        branches = self.get_branches()
+        chunks = self.get_chunks(X, job_count)
+        results = iter(self.run_tasks(X, job_count, [
+            (transform_branch, (name, start, stop))
+            for name, _ in branches
+            for start, stop in chunks
+            ]))
+        Xs = []
+        for name, _ in branches:
+            chunk_features = [next(results) for _ in chunks]
+            features = scipy.sparse.vstack(chunk_features, format='csr') \
+                if scipy.sparse.issparse(chunk_features[0]) else np.vstack(chunk_features)
+            weight = (self.transformer_weights or {}).get(name)
+            Xs.append(features if weight is None else features * weight)
+        return self._hstack(Xs)
+
+
 def get_model(
     word_vectors_filepath: str,
-    profile: bool=False
+    profile: bool=False,
+    compact: bool=False,
+    min_df: int=2,
+    max_features: int=None,
+    chunk_size: int=10000,
+    target_aliases: bool=False,
+    n_jobs: int=None
     ) -> GridSearchCV:
-    """Returns an SVM model."""
+    """Returns an SVM model.
+
+    With compact set, the n-gram branches use CompactCountVectorizer, dropping
+    n-grams seen in fewer than min_df training documents (and keeping at most
+    max_features of each n-gram type), featurizing chunk_size documents at a time
+    into int8 (binary) matrices, and the branches are stacked by CompactFeatureUnion.
+
+    With target_aliases set, the target feature also recognizes the company
+    name forms of settings.PTN_companies (see TargetVectorizer).
+
+    The word vectors file is a word2vec text file, a gensim .kv file (see
+    model_artifact.get_mmap_embedding_filepath()) or a compact .cwv file (see
+    compact_vectors.py), either of which is memory-mapped.
+
+    With n_jobs set (-1 for all cores), the features are extracted in that many
+    worker processes by ParallelFeatureUnion, with the word vectors memory-mapped
+    from a .kv copy of the word vectors file.
+    """
+
+    if Path(word_vectors_filepath).suffix in ('.kv', '.cwv'):
+        wordvec = load_word_vectors(word_vectors_filepath)
+    else:
+        wordvec = KeyedVectors.load_word2vec_format(word_vectors_filepath, binary=False)
+
+    if compact:
+        def ngram_vectorizer(**kwargs):
+            return CompactCountVectorizer(
+                min_df=min_df,
+                max_features=max_features,
+                chunk_size=chunk_size,
+                dtype=np.int8,
+                **kwargs
+            )
+
+        def feature_union(transformer_list):
+            return CompactFeatureUnion(transformer_list, chunk_size=chunk_size)
+    else:
+        ngram_vectorizer = CountVectorizer
+        feature_union = FeatureUnion
+
+    if n_jobs not in (None, 1):
+        # model_artifact imports this module, so import it here.
+        from src.model_artifact import get_mmap_embedding_filepath
+
+        # An absolute path, so the (pickled) model finds the file from any
+        # working directory.
+        embedding_filepath = get_mmap_embedding_filepath(word_vectors_filepath).resolve()
 
-    wordvec = KeyedVectors.load_word2vec_format(word_vectors_filepath, binary=False)
+        def feature_union(transformer_list):
+            return ParallelFeatureUnion(
+                transformer_list,
+                n_jobs=n_jobs,
+                chunk_size=chunk_size,
+                embedding_filepath=embedding_filepath
+            )
 
     # slo_word_analyzer = SLO_WordAnalyzer(profile)
     slo_word_analyzer = SLO_WordAnalyzer(profile)
-    word_ngram = CountVectorizer(
+    word_ngram = ngram_vectorizer(
         # analyzer='word',  # we include symbols
         analyzer=slo_word_analyzer,
         binary=True,
         ngram_range=(1, 3),
         lowercase=False
     )
-    char_ngram = CountVectorizer(
+    char_ngram = ngram_vectorizer(
         analyzer='char',
         binary=True,
         ngram_range=(2, 5),
         lowercase=False
     )
-    tv = TargetVectorizer(profile)
+    tv = TargetVectorizer(profile, aliases=target_aliases)
     ev = EmbeddingVectorizer(wordvec, profile)
 
-    features = FeatureUnion([
+    features = feature_union([
         ('ngram_w', word_ngram),
         ('ngram_c', char_ngram),
         ('target', tv),
@@ -5,19 +5,36 @@ import logging
 import pickle
 from pathlib import Path
 from fire import Fire
-from sklearn.metrics import f1_score
 
-from src.model_utilities import load_dataset, translate_predicted, set_labels
+from src.model_utilities import load_dataset, translate_predicted, set_labels, compute_macro_f1
+from src.model_artifact import load_model_artifact, list_model_versions, MANIFEST_FILENAME
+from src.instrumentation import instrumented, stage
 
 logger = logging.getLogger(__name__)
 
 
+def get_model_version(model_filepath):
+    """Return the version of the given model file (its modification time) or
+    artifact directory (its latest version's name), for the prediction cache.
+    """
+    if model_filepath.is_dir():
+        if (model_filepath / MANIFEST_FILENAME).exists():
+            return model_filepath.name
+        return list_model_versions(model_filepath)[-1].name
+    return f'{model_filepath.name}@{model_filepath.stat().st_mtime_ns}'
+
+
+@instrumented
 def model_test(
         dataset_path='.',
         testset_filename='autocode.csv',
         labels=None,
         model_filename='model.pkl',
         encoding='utf-8',
+        cache_filename=None,
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
         logging_level=logging.INFO
         ):
     """This tool tests the given stance detection model using the specified testset.
@@ -30,10 +47,24 @@ def model_test(
         labels -- the training target labels, which should set
             negative = 0, positive = 1 due to the calculation for macroF measure.
             (default: None, will be set to ['against', 'for', 'neutral', 'na'])
-        model_filename -- the name of the model file to test
+        model_filename -- the name of the model file to test, or of a model
+            artifact directory (see model_artifact.py), in which case its
+            latest version is tested
             (default='model.pkl')
         encoding -- the file encoding to use
             (default: 'utf-8')
+        cache_filename -- the name of an SQLite file in which to cache the
+            predictions by x value, across runs, for the tested model version
+            (see prediction_cache.py)
+            (default: None -- no cache)
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
         logging_level -- the level of logging to use
             (default: logging.INFO)
     """
@@ -50,16 +81,34 @@ def model_test(
 
     labels = set_labels(labels)
 
-    x_test, y_test = load_dataset(testset_filepath, labels, encoding)
+    with stage('load_dataset') as metrics:
+        x_test, y_test = load_dataset(testset_filepath, labels, encoding)
+        metrics.rows_out = len(x_test)
 
     logger.info('\tloading model from %s', model_filepath)
-    model = pickle.load(open(model_filepath, 'rb'))
+    with stage('load_model'):
+        if model_filepath.is_dir():
+            model = load_model_artifact(model_filepath)
+        else:
+            model = pickle.load(open(model_filepath, 'rb'))
 
-    y_predicted = model.predict(x_test)
+    with stage('predict', rows_in=len(x_test)) as metrics:
+        if cache_filename is None:
+            y_predicted = model.predict(x_test)
+        else:
+            from src.prediction_cache import PredictionCache
+            cache = PredictionCache(
+                cache_filepath=Path(dataset_path, cache_filename),
+                model_version=get_model_version(model_filepath)
+                )
+            y_predicted = cache.predict(model, x_test)
+            cache.close()
+            logger.info('\tprediction cache: %s', cache.get_metrics())
+        metrics.rows_out = len(y_predicted)
 
     logger.info('\tcorrect labels: %s', translate_predicted(y_test, labels))
     logger.info('\tpredicted labels: %s', translate_predicted(y_predicted, labels))
-    results = f1_score(y_test, y_predicted, labels=[0, 1, 2], average='macro')
+    results = compute_macro_f1(y_test, y_predicted)
     logger.info('\tF1 score: %f', results)
     print(f'F1 score: {results}')
 
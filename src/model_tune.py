@@ -0,0 +1,295 @@
+"""
+This module tunes the SVM hyper-parameters using the specified trainset.
+
+The n-gram/target/embedding features are expensive to extract but don't depend
+on the SVM settings, so they are extracted once per cross-validation fold,
+cached on disk and shared by every candidate setting in the sweep.
+"""
+import hashlib
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from fire import Fire
+
+from src.model_utilities import load_dataset, set_labels, compute_macro_f1
+from src.instrumentation import instrumented, stage
+
+logger = logging.getLogger(__name__)
+
+TEST_FOLD = 'test'
+
+# Per-process cache of the fold matrices, so that each pool worker reads each
+# fold from disk only once.
+__fold_cache_global__ = {}
+
+
+def get_cache_dirpath(cache_path, filepaths, settings):
+    """Returns a cache directory specific to the given files (the datasets and
+    word vectors, by content) and featurization settings.
+    """
+    key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode())
+    for filepath in filepaths:
+        if filepath is not None:
+            with open(filepath, 'rb') as fin:
+                while chunk := fin.read(2**20):
+                    key.update(chunk)
+    return Path(cache_path, key.hexdigest()[:16])
+
+
+def save_fold(cache_dirpath, fold, x_train, y_train, x_test, y_test):
+    """Saves the feature matrices/labels of the given fold."""
+    scipy.sparse.save_npz(cache_dirpath / f'{fold}-x_train.npz', scipy.sparse.csr_matrix(x_train))
+    scipy.sparse.save_npz(cache_dirpath / f'{fold}-x_test.npz', scipy.sparse.csr_matrix(x_test))
+    np.save(cache_dirpath / f'{fold}-y_train.npy', y_train)
+    np.save(cache_dirpath / f'{fold}-y_test.npy', y_test)
+
+
+def load_fold(cache_dirpath, fold):
+    """Loads the feature matrices/labels of the given fold, once per process."""
+    key = (str(cache_dirpath), fold)
+    if key not in __fold_cache_global__:
+        __fold_cache_global__[key] = (
+            scipy.sparse.load_npz(cache_dirpath / f'{fold}-x_train.npz'),
+            np.load(cache_dirpath / f'{fold}-y_train.npy'),
+            scipy.sparse.load_npz(cache_dirpath / f'{fold}-x_test.npz'),
+            np.load(cache_dirpath / f'{fold}-y_test.npy'),
+            )
+    return __fold_cache_global__[key]
+
+
+def cache_fold_features(
+        cache_dirpath,
+        features,
+        x_values,
+        y_values,
+        folds,
+        x_test=None,
+        y_test=None
+        ):
+    """Extracts and caches the features of each fold (and, if given, of the
+    testset, using features fitted to the full trainset). Folds that are
+    already cached are skipped.
+    """
+    cache_dirpath.mkdir(parents=True, exist_ok=True)
+    fold_splits = list(enumerate(folds))
+    if x_test is not None:
+        fold_splits.append((TEST_FOLD, None))
+
+    for fold, split in fold_splits:
+        if (cache_dirpath / f'{fold}-y_test.npy').exists():
+            logger.info('\t\tusing cached features for fold %s', fold)
+            continue
+        logger.info('\t\textracting features for fold %s...', fold)
+        if split is None:
+            x_fold_train, y_fold_train = x_values, y_values
+            x_fold_test, y_fold_test = x_test, y_test
+        else:
+            train_index, test_index = split
+            x_fold_train, y_fold_train = x_values[train_index], y_values[train_index]
+            x_fold_test, y_fold_test = x_values[test_index], y_values[test_index]
+        save_fold(
+            cache_dirpath,
+            fold,
+            features.fit_transform(x_fold_train, y_fold_train),
+            y_fold_train,
+            features.transform(x_fold_test),
+            y_fold_test
+            )
+
+
+def score_candidate(cache_dirpath, fold, params):
+    """Fits an SVM with the given settings on the cached fold features and
+    returns its macro-F1 score on the fold's held-out items.
+    """
+    from sklearn.svm import LinearSVC
+    x_train, y_train, x_test, y_test = load_fold(cache_dirpath, fold)
+    svm = LinearSVC(**params)
+    svm.fit(x_train, y_train)
+    return compute_macro_f1(y_test, svm.predict(x_test))
+
+
+def get_candidates(c_values, class_weights, losses, max_iter):
+    """Returns the list of SVM settings to sweep."""
+    return [
+        {'C': c, 'class_weight': class_weight, 'loss': loss, 'max_iter': max_iter}
+        for c, class_weight, loss in product(c_values, class_weights, losses)
+        ]
+
+
+def summarize_results(scores):
+    """Collects the per-fold scores into a table of mean/std cross-validation
+    macro-F1 (and testset macro-F1, if scored) per candidate, best first.
+    """
+    data_frame = pd.DataFrame(scores)
+    cv_scores = data_frame[data_frame['fold'] != TEST_FOLD]
+    results = cv_scores.groupby(['C', 'class_weight', 'loss'])['f1'] \
+        .agg(cv_f1_mean='mean', cv_f1_std='std') \
+        .reset_index()
+    test_scores = data_frame[data_frame['fold'] == TEST_FOLD]
+    if not test_scores.empty:
+        results = results.merge(
+            test_scores[['C', 'class_weight', 'loss', 'f1']].rename(columns={'f1': 'test_f1'}),
+            on=['C', 'class_weight', 'loss'],
+            how='left'
+            )
+    return results.sort_values(by='cv_f1_mean', ascending=False, ignore_index=True)
+
+
+@instrumented
+def model_tune(
+        dataset_path='.',
+        trainset_filename='autocode.csv',
+        testset_filename=None,
+        word_vectors_filename='wordvec.vec',
+        labels=None,
+        results_filename='tuning_results.csv',
+        cache_dirname='tuning_cache',
+        folds=5,
+        c_values=(0.1, 0.3, 1.0, 3.0, 10.0),
+        class_weights=(None, 'balanced'),
+        losses=('squared_hinge',),
+        max_iter=1000,
+        n_jobs=None,
+        seed=0,
+        profile=True,
+        compact=False,
+        encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
+        logging_level=logging.INFO
+        ):
+    """This tool sweeps the SVM settings for the stance detection model using
+    cross-validation on the specified trainset, and saves a table of the
+    results sorted by mean cross-validation macro-F1 (the score reported by
+    model_test).
+
+    Keyword Arguments:
+        dataset_path -- the system path from which to load the datasets
+            (default='.')
+        trainset_filename -- the name of the training set file
+            (default='autocode.csv')
+        testset_filename -- the name of a testset file (e.g., the gold set) on
+            which to also score each setting, trained on the full trainset
+            (default: None -- cross-validation only)
+        word_vectors_filename -- the name of the word vectors file
+            (default='wordvec.vec')
+        labels -- the training target labels
+            (default: ['against', 'for', 'neutral', 'na'])
+        results_filename -- the name of the results table (.csv) to save
+            (default='tuning_results.csv')
+        cache_dirname -- the name of the directory in which to cache the
+            extracted fold features
+            (default='tuning_cache')
+        folds -- the number of cross-validation folds
+            (default: 5)
+        c_values -- the SVM regularization settings to try
+            (default: (0.1, 0.3, 1.0, 3.0, 10.0))
+        class_weights -- the SVM class weightings to try
+            (default: (None, 'balanced'))
+        losses -- the SVM loss functions to try
+            (default: ('squared_hinge',))
+        max_iter -- the maximum number of SVM solver iterations
+            (default: 1000)
+        n_jobs -- the number of processes to use in the sweep
+            (default: None -- one per CPU)
+        seed -- the random seed for the fold splits
+            (default: 0)
+        profile -- whether to include use profile texts
+            (default: True)
+        compact -- whether to use the memory-saving n-gram featurization
+            (default: False)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('tuning SVM model...')
+
+    trainset_filepath = Path(dataset_path, trainset_filename)
+    testset_filepath = Path(dataset_path, testset_filename) if testset_filename else None
+    word_vectors_filepath = Path(dataset_path, word_vectors_filename)
+    results_filepath = Path(dataset_path, results_filename)
+
+    labels = set_labels(labels)
+    settings = {
+        'word_vectors': str(word_vectors_filepath),
+        'labels': labels,
+        'folds': folds,
+        'seed': seed,
+        'profile': profile,
+        'compact': compact,
+        }
+    cache_dirpath = get_cache_dirpath(
+        Path(dataset_path, cache_dirname), [trainset_filepath, testset_filepath, word_vectors_filepath], settings
+        )
+
+    logger.info('\tloading training set from %s...', trainset_filepath)
+    with stage('load_dataset') as metrics:
+        x_values, y_values = load_dataset(trainset_filepath, labels, encoding, profile)
+        x_test, y_test = None, None
+        if testset_filepath is not None:
+            logger.info('\tloading testset from %s...', testset_filepath)
+            x_test, y_test = load_dataset(testset_filepath, labels, encoding, profile)
+        metrics.rows_out = len(x_values)
+
+    # scikit-learn and gensim (seconds to import) are only needed from here on.
+    from sklearn.model_selection import StratifiedKFold
+    from src.model_svm import get_model
+
+    logger.info('\tcaching fold features in %s...', cache_dirpath)
+    splits = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed) \
+        .split(x_values, y_values)
+    with stage('cache_fold_features', rows_in=len(x_values)):
+        features = get_model(word_vectors_filepath, profile, compact=compact).named_steps['vect']
+        cache_fold_features(cache_dirpath, features, x_values, y_values, splits, x_test, y_test)
+
+    candidates = get_candidates(c_values, class_weights, losses, max_iter)
+    fold_names = list(range(folds)) + ([TEST_FOLD] if x_test is not None else [])
+    tasks = list(product(range(len(candidates)), fold_names))
+    logger.info('\tscoring %s settings on %s folds...', len(candidates), len(fold_names))
+    with stage('score_candidates', rows_in=len(tasks)), \
+            ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        f1_scores = executor.map(
+            score_candidate,
+            [cache_dirpath] * len(tasks),
+            [fold for _, fold in tasks],
+            [candidates[candidate] for candidate, _ in tasks],
+            )
+        scores = [
+            dict(
+                candidates[candidate],
+                class_weight=str(candidates[candidate]['class_weight']),
+                fold=fold,
+                f1=f1
+                )
+            for (candidate, fold), f1 in zip(tasks, f1_scores)
+            ]
+
+    results = summarize_results(scores)
+    results.to_csv(results_filepath, index=False)
+    logger.info('\tsaved results in %s; best settings:\n%s', results_filepath, results.head(1))
+    print(results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(model_tune)
@@ -1,10 +1,16 @@
 """
 Utility modules of data handling on machine learning.
 """
-import csv
+import copy
 import logging
+import re
+from functools import lru_cache
+from itertools import islice
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
 from typing import Dict, List, Tuple
 import numpy as np
+import pandas as pd
 
 from src.settings import PTN_against, PTN_for
 
@@ -54,6 +60,224 @@ def split_x_value(x, profile_flag):
     return target, tweet, profile
 
 
+def iter_chunks(items, chunk_size):
+    """Yields successive chunks of the given items, slicing sequences/arrays
+    directly and batching other iterables.
+    """
+    if hasattr(items, '__getitem__') and hasattr(items, '__len__'):
+        for start in range(0, len(items), chunk_size):
+            yield items[start:start + chunk_size]
+    else:
+        iterator = iter(items)
+        while chunk := list(islice(iterator, chunk_size)):
+            yield chunk
+
+
+# The x value fields, in get_x() order, and whitespace other than the spaces
+# and tabs that separate the tokens and fields.
+X_FIELDS = ['target', 'tweet', 'profile']
+PTN_other_whitespace = re.compile(r'[^\S \t]')
+
+
+class ParsedDocument(str):
+    """An x value (see get_x()) of a ParsedDocuments collection, which gives
+    the feature extractors its pre-split tokens.
+    """
+
+    def __new__(cls, x_value, field_tokens):
+        document = super().__new__(cls, x_value)
+        document.field_tokens = field_tokens
+        return document
+
+    def __reduce__(self):
+        return ParsedDocument, (str(self), self.field_tokens)
+
+    def get_field_tokens(self):
+        """Returns the target, tweet and profile token lists."""
+        return self.field_tokens
+
+
+class ParsedDocuments:
+    """An array-like collection of x values (see get_x()), which are split into
+    their target/tweet/profile fields and tokenized once, on creation, for all
+    the feature extractors (see model_svm.py) rather than once per extractor.
+
+    The tokens of all the documents are stored as one flat int32 array of ids
+    into a shared vocabulary, with the offsets of each document's target,
+    tweet and profile tokens in offsets (one row per document, the fourth
+    column being the end of the profile tokens). Indexing with an integer
+    returns a ParsedDocument, a str (the x value) that carries its tokens;
+    indexing with a slice, an index array or a mask returns a ParsedDocuments
+    subset sharing the token arrays, which is how sklearn splits the items
+    (e.g., in cross-validation). Iterating looks up the tokens chunk_size
+    documents at a time.
+
+    The per-document blank_counts (the empty tokens that split(' ') adds for
+    repeated spaces and empty fields) and irregular (whitespace other than
+    spaces/tabs, which split(' ') doesn't split on) flags let the word
+    embedding extractor reproduce its original split(' ') tokenization.
+    """
+
+    def __init__(self, x_values, chunk_size=10000):
+        self.x_values = np.asarray(x_values, dtype=str)
+        self.chunk_size = chunk_size
+        token_index = {}
+        token_ids = []
+        target_index = {}
+        self.offsets = np.empty((len(self.x_values), len(X_FIELDS) + 1), dtype=np.int64)
+        self.blank_counts = np.empty(len(self.x_values), dtype=np.int32)
+        self.irregular = np.zeros(len(self.x_values), dtype=bool)
+        self.target_codes = np.empty(len(self.x_values), dtype=np.int32)
+        for i, x_value in enumerate(self.x_values.tolist()):
+            fields = x_value.split('\t')
+            if len(fields) > len(X_FIELDS):
+                raise ValueError(f'x value {i} has more than {len(X_FIELDS)} tab-separated fields')
+            # The profile field is optional (see get_x()).
+            fields.extend([''] * (len(X_FIELDS) - len(fields)))
+            blank_count = 0
+            for field_index, field in enumerate(fields):
+                self.offsets[i, field_index] = len(token_ids)
+                tokens = field.split()
+                token_ids.extend([token_index.setdefault(token, len(token_index)) for token in tokens])
+                blank_count += field.count(' ') + 1 - len(tokens)
+            self.offsets[i, -1] = len(token_ids)
+            self.blank_counts[i] = blank_count
+            self.irregular[i] = PTN_other_whitespace.search(x_value) is not None
+            self.target_codes[i] = target_index.setdefault(fields[0], len(target_index))
+        self.token_ids = np.asarray(token_ids, dtype=np.int32)
+        self.vocabulary = np.array(list(token_index), dtype=object)
+        self.target_names = list(target_index)
+
+        # The lowercase form of each vocabulary token, as ids into lowercase_index.
+        self.lowercase_index = {}
+        self.lowercase_ids = np.fromiter(
+            (
+                self.lowercase_index.setdefault(token.lower(), len(self.lowercase_index))
+                for token in token_index
+            ),
+            dtype=np.int32,
+            count=len(token_index)
+            )
+
+    @property
+    def shape(self):
+        return (len(self.x_values),)
+
+    def __len__(self):
+        return len(self.x_values)
+
+    def __iter__(self):
+        # Look up the tokens of chunk_size documents at a time.
+        for start in range(0, len(self.x_values), self.chunk_size):
+            chunk = self[start:start + self.chunk_size]
+            token_ids, lengths = chunk.get_token_ids()
+            tokens = chunk.vocabulary[token_ids].tolist()
+            # The field offsets into the chunk's tokens.
+            bounds = (chunk.offsets - chunk.offsets[:, :1] + (np.cumsum(lengths) - lengths)[:, np.newaxis]).tolist()
+            for x_value, (target_start, tweet_start, profile_start, stop) in zip(chunk.x_values.tolist(), bounds):
+                yield ParsedDocument(x_value, (
+                    tokens[target_start:tweet_start],
+                    tokens[tweet_start:profile_start],
+                    tokens[profile_start:stop]
+                    ))
+
+    def __array__(self, dtype=None, copy=None):
+        return self.x_values if dtype is None else self.x_values.astype(dtype)
+
+    def __getitem__(self, key):
+        # sklearn may index arrays with (key, Ellipsis).
+        if isinstance(key, tuple) and len(key) == 2 and key[1] is Ellipsis:
+            key = key[0]
+        if isinstance(key, (int, np.integer)):
+            return ParsedDocument(self.x_values[key], self.get_field_tokens(key))
+        subset = copy.copy(self)
+        subset.x_values = self.x_values[key]
+        subset.offsets = self.offsets[key]
+        subset.blank_counts = self.blank_counts[key]
+        subset.irregular = self.irregular[key]
+        subset.target_codes = self.target_codes[key]
+        return subset
+
+    def get_state(self):
+        """Returns the array attributes (which can be shared between processes,
+        see share_arrays()) and the other attributes. The vocabulary (an object
+        array) is given as its tokens, which have no whitespace, joined by
+        newlines into one UTF-8 byte array; lowercase_index is rebuilt from it.
+        """
+        arrays = {name: value for name, value in vars(self).items() if isinstance(value, np.ndarray)}
+        arrays['vocabulary'] = np.frombuffer('\n'.join(self.vocabulary.tolist()).encode('utf-8'), dtype=np.uint8)
+        attributes = {
+            name: value for name, value in vars(self).items()
+            if name not in arrays and name != 'lowercase_index'
+            }
+        return arrays, attributes
+
+    @classmethod
+    def from_state(cls, arrays, attributes):
+        """Returns the ParsedDocuments with the given get_state() attributes."""
+        documents = cls.__new__(cls)
+        vars(documents).update(attributes, **arrays)
+        text = arrays['vocabulary'].tobytes().decode('utf-8')
+        documents.vocabulary = np.array(text.split('\n') if text else [], dtype=object)
+        # Each token's lowercase form maps to its (first occurrence's) id.
+        documents.lowercase_index = dict(zip(
+            (token.lower() for token in documents.vocabulary.tolist()), documents.lowercase_ids.tolist()
+            ))
+        return documents
+
+    def get_field_tokens(self, index):
+        """Returns the target, tweet and profile token lists of the given document."""
+        row = self.offsets[index].tolist()
+        tokens = self.vocabulary[self.token_ids[row[0]:row[-1]]].tolist()
+        return tuple(
+            tokens[start - row[0]:stop - row[0]]
+            for start, stop in zip(row[:-1], row[1:])
+            )
+
+    def get_token_ids(self, first_field='target', last_field='profile'):
+        """Returns the (flat) token ids of the given range of fields of all the
+        documents and the number of tokens of each document.
+        """
+        starts = self.offsets[:, X_FIELDS.index(first_field)]
+        stops = self.offsets[:, X_FIELDS.index(last_field) + 1]
+        lengths = stops - starts
+        # Each document's token positions are its start plus 0, 1, ... length - 1.
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.token_ids[positions], lengths
+
+
+def share_arrays(arrays):
+    """Copies the given numpy arrays (a name -> array dictionary) into new shared
+    memory blocks and returns the blocks, which the caller must close and unlink
+    when done, and their specs, with which other processes attach them (see
+    attach_arrays()).
+    """
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    """Attaches the shared memory blocks of the given share_arrays() specs and
+    returns the blocks, which must be kept open while the arrays are in use,
+    and the (read-only) arrays.
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = SharedMemory(block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        arrays[name].flags.writeable = False
+    return blocks, arrays
+
+
 # def load_dataset(dataset_filepath: str, labels: list, encoding: str) -> Tuple[Dsets, Dsets]:
 #     """Loads the specified dataset, with no splitting of train/test sets"""
 
@@ -81,30 +305,88 @@ def split_x_value(x, profile_flag):
 
 #     return x_arrays, y_arrays
 
+# The dataset columns of the x value fields, in get_x() order.
+X_COLUMNS = ['company', 'tweet_norm', 'profile_norm']
+
+
+@lru_cache(maxsize=None)
+def get_auto_tag_pattern(company):
+    """Returns one pattern matching all the auto-coding (for and against)
+    search patterns of the given company.
+    """
+    return re.compile(f'{PTN_for[company].pattern}|{PTN_against[company].pattern}')
+
+
+def read_dataset_columns(dataset_filepath, columns, encoding='utf-8'):
+    """Reads only the given columns of a SLO dataset (a CSV file or, e.g., for
+    faster loading, a Parquet file), as strings, with missing values as
+    empty strings.
+    """
+    if Path(dataset_filepath).suffix == '.parquet':
+        return pd.read_parquet(dataset_filepath, columns=columns).fillna('').astype(str)
+    # Adding na_filter here to ensure that empty strings are not converted to NaN.
+    data_frame = pd.read_csv(
+        dataset_filepath, usecols=columns, dtype=str, na_filter=False, encoding=encoding
+        )
+    return data_frame[columns]
+
+
+def get_x_values(data_frame, auto_tagged, profile):
+    """Returns the x values (see get_x()) of all the rows of the given data
+    frame, built column-wise.
+    """
+    x_values = data_frame['company'] + '\t' + data_frame['tweet_norm']
+    if profile:
+        x_values += '\t' + data_frame['profile_norm']
+
+    # If the data was auto-coded, remove auto-tagging hashtags, company by company.
+    if auto_tagged:
+        for company, indexes in data_frame.groupby('company', sort=False).indices.items():
+            x_values.iloc[indexes] = x_values.iloc[indexes].str.replace(
+                get_auto_tag_pattern(company), '', regex=True
+                )
+    return x_values
+
+
+def get_label_codes(stances, labels):
+    """Returns the index of each of the given stances in labels, raising a
+    ValueError for stances that aren't labels.
+    """
+    stances = stances.str.strip()
+    codes = pd.Categorical(stances, categories=labels).codes.astype(np.int64)
+    if (codes < 0).any():
+        unknown = sorted(set(stances[codes < 0]))
+        raise ValueError(f'unknown stance labels {unknown} - expected one of {labels}')
+    return codes
+
+
 def load_dataset(dataset_filepath, labels, encoding='utf-8', profile=True):
     """Load a SLO dataset and return X and Y.
 
     Mostly same as `load_data` but doesn't split the target datasets and
-    doesn't remove query hashtags.
-    """
-    x_items = []
-    y_items = []
+    doesn't remove query hashtags. X is returned as ParsedDocuments, which
+    tokenizes the items once for all the model's feature extractors.
 
+    Only the x value and stance columns are read, and X and Y are built
+    column-wise (see get_x_values() and get_label_codes()).
+    """
     # Detect whether the dataset is auto-coded.
     auto_tagged = 'auto' in str(dataset_filepath)
     if auto_tagged:
         logger.info('\t\tdetected auto-coded data - removing query hashtags from tweet texts...')
 
-    with open(dataset_filepath, encoding=encoding) as f:
+    x_columns = X_COLUMNS if profile else X_COLUMNS[:2]
+    data_frame = read_dataset_columns(dataset_filepath, x_columns + ['stance'], encoding)
+    x_values = get_x_values(data_frame, auto_tagged, profile)
+    return ParsedDocuments(x_values), get_label_codes(data_frame['stance'], labels)
 
-        for row in csv.DictReader(f):
-            x = get_x(row, auto_tagged=auto_tagged, profile=profile)
-            y = labels.index(row['stance'].strip())
 
-            x_items.append(x)
-            y_items.append(y)
-
-    return np.asarray(x_items), np.asarray(y_items)
+def load_sample_weights(dataset_filepath, column, encoding='utf-8'):
+    """Load the given column of a SLO dataset (e.g., the cluster_size count
+    weights added by dataset_deduplicator) as training sample weights, in the
+    same row order as load_dataset().
+    """
+    return read_dataset_columns(dataset_filepath, [column], encoding)[column].astype(float).to_numpy()
 
 
 def translate_predicted(y_predicted, labels):
@@ -112,6 +394,14 @@ def translate_predicted(y_predicted, labels):
     return [labels[x] for x in y_predicted]
 
 
+def compute_macro_f1(y_true, y_predicted):
+    """Computes the macro-F1 score over the against/for/neutral codes (0, 1, 2),
+    which is the score reported for the SLO models.
+    """
+    from sklearn.metrics import f1_score
+    return f1_score(y_true, y_predicted, labels=[0, 1, 2], average='macro')
+
+
 def set_labels(labels):
     """Sets the labels for the dataset to the default labels if not specified.
     Set to negative = 0, positive = 1 due to the calculation for macroF measure.
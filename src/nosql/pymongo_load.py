@@ -2,25 +2,50 @@
 This module is a *one-time-use-only* utility that reads the records in the SLO
 noSQL coding and tag datasets and loads them into MongoDB database collections.
 
+The datasets are loaded with unordered bulk upserts keyed on the tweet `id` --
+or, if a dataset has a `coder` column (i.e., one record per coder per tweet,
+rather than the majority tags), on `id` and `coder` (see `pymongo_loader.py`)
+-- so re-running this script updates the collections rather than rebuilding
+them. Each collection's document count is
+checked against its file's record count after the load.
+
 See `pymongo_utilities.py` for details.
 """
-import pymongo_utilities
 import pandas as pd
 
+import pymongo_utilities
+import pymongo_loader
+
+DATASET_NAMES = ['slo_code', 'slo_tags']
+
 
-def write_collection(database, collection_name, df):
-    """ Write the given DataFrame to the given MongoDB collection. """
-    collection = database[collection_name]
-    # Delete all documents if they're there so that we can re-run this script.
-    collection.delete_many({})
-    collection.insert_many([dict(zip(df.columns, list(x))) for x in df.values])
+def get_dataset_key(dataset_filepath):
+    """Return the upsert key of the given dataset file: id and, if it has one
+    record per coder, coder.
+    """
+    columns = pd.read_csv(dataset_filepath, nrows=0).columns
+    return ['id', 'coder'] if 'coder' in columns else 'id'
 
 
 client, database = pymongo_utilities.get_mongo_client_db("data562")
 
 
-for dataset_name in ["slo_code", "slo_tags"]:
-    df = pd.read_csv(f'../../data/nosql/{dataset_name}.csv')
-    write_collection(database, dataset_name, df)
+for dataset_name in DATASET_NAMES:
+    dataset_filepath = f'../../data/nosql/{dataset_name}.csv'
+    key = get_dataset_key(dataset_filepath)
+    # Earlier loads keyed every dataset on id, with a unique index that
+    # rejects a second coder's tag of the same tweet.
+    if key != 'id' and 'id_1' in database[dataset_name].index_information():
+        database[dataset_name].drop_index('id_1')
+    counts = pymongo_loader.load_file(
+        database, dataset_filepath, dataset_name, key=key
+        )
+    print(dataset_name, counts)
+    document_count = database[dataset_name].count_documents({})
+    if document_count != counts['documents']:
+        raise RuntimeError(
+            f'{dataset_name} has {document_count} documents after loading {counts["documents"]} records '
+            f'- check that its key {key} is unique'
+            )
 
 client.close()
@@ -0,0 +1,93 @@
+"""
+This module measures MongoDB load throughput for synthetic coded tweets,
+comparing the original one-shot `insert_many` load with the chunked bulk
+upserts of `pymongo_loader.py` at several batch sizes, and the cost of an
+incremental re-load.
+
+Run it against the configured database (see `pymongo_utilities.py`) or a local
+mongod for throughput numbers. With --mock, it runs against an in-memory
+mongomock stand-in, which checks that the loads work offline; mongomock scans
+the collection for every upsert, so its upsert timings are not representative.
+"""
+import random
+import time
+import pandas as pd
+from fire import Fire
+
+import pymongo_utilities
+import pymongo_loader
+
+COMPANIES = ['adani', 'bhp', 'fortescue', 'riotinto', 'santos']
+STANCES = ['against', 'for', 'neutral', 'na']
+
+
+def get_records(count, seed=0):
+    """Return the given number of synthetic coded tweet records."""
+    rng = random.Random(seed)
+    return [
+        {
+            'id': 1000000000000000000 + i,
+            'company': rng.choice(COMPANIES),
+            'created_at': f'2018-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'stance': rng.choice(STANCES),
+            'confidence': rng.choice(['low', 'medium', 'high']),
+            'tweet_norm': ' '.join(f'w{rng.randint(0, 5000)}' for _ in range(20)),
+            }
+        for i in range(count)
+        ]
+
+
+def time_load(load):
+    """Return the number of seconds taken by the given load function."""
+    start = time.perf_counter()
+    load()
+    return time.perf_counter() - start
+
+
+def pymongo_load_benchmark(
+        count=20000,
+        batch_sizes=(100, 1000, 5000),
+        database_name='data562_benchmark',
+        mock=False
+        ):
+    """This tool prints the load throughput (documents per second) of each
+    load method, dropping its benchmark collections afterwards.
+
+    Keyword Arguments:
+        count -- the number of records to load
+            (default: 20000)
+        batch_sizes -- the bulk write batch sizes to try
+            (default: (100, 1000, 5000))
+        database_name -- the name of the (scratch) database to use
+            (default: 'data562_benchmark')
+        mock -- whether to use an in-memory mongomock database instead
+            (default: False)
+    """
+    records = get_records(count)
+    client, database = pymongo_utilities.get_mongo_client_db(database_name, mock=mock)
+    results = []
+    try:
+        collection = database['insert_many']
+        seconds = time_load(lambda: collection.insert_many([dict(record) for record in records]))
+        results.append({'method': 'insert_many', 'batch_size': count, 'seconds': seconds})
+        collection.drop()
+
+        for batch_size in batch_sizes:
+            collection = database[f'bulk_load_{batch_size}']
+            pymongo_loader.create_indexes(collection, ['id'])
+            for method in ['bulk_upsert', 'bulk_upsert_reload']:
+                seconds = time_load(lambda: pymongo_loader.bulk_load(
+                    collection, (dict(record) for record in records), 'id', batch_size
+                    ))
+                results.append({'method': method, 'batch_size': batch_size, 'seconds': seconds})
+            collection.drop()
+    finally:
+        client.close()
+
+    data_frame = pd.DataFrame(results)
+    data_frame['documents_per_second'] = (count / data_frame['seconds']).round()
+    print(data_frame.to_string(index=False))
+
+
+if __name__ == '__main__':
+    Fire(pymongo_load_benchmark)
@@ -0,0 +1,203 @@
+"""
+This module streams pipeline output files (e.g., coded sets, predictions,
+aggregates) into MongoDB collections.
+
+Records are read in chunks and written with unordered bulk writes, upserting
+on the key field(s) (the tweet `id` by default), so re-loading a file, or a
+newer version of it, updates the collection in place rather than duplicating
+it. A file whose records lack a key field is rejected; key=None inserts every
+record instead. The key, `company` and `created_at` fields are indexed.
+
+See `pymongo_utilities.py` for details.
+"""
+import logging
+import time
+from itertools import chain, islice
+from pathlib import Path
+import pandas as pd
+from fire import Fire
+from pymongo import ASCENDING, InsertOne, UpdateOne
+
+import pymongo_utilities
+
+logger = logging.getLogger(__name__)
+
+INDEX_FIELDS = ['company', 'created_at']
+
+
+def iter_records(filepath, chunk_size=50000, encoding='utf-8'):
+    """Yield the records of the given CSV or JSON-lines file as dictionaries,
+    reading chunk_size rows at a time. Missing values become None (null).
+    """
+    filepath = Path(filepath)
+    if filepath.suffix == '.csv':
+        chunks = pd.read_csv(filepath, chunksize=chunk_size, encoding=encoding)
+    elif filepath.suffix in ['.json', '.jsonl']:
+        chunks = pd.read_json(filepath, lines=True, chunksize=chunk_size, encoding=encoding)
+    else:
+        raise ValueError(f'file {filepath} not valid - only CSV and JSON lines accepted...')
+    for df_chunk in chunks:
+        df_chunk = df_chunk.astype(object).where(df_chunk.notna(), None)
+        yield from df_chunk.to_dict('records')
+
+
+def get_key_fields(key):
+    """Return the upsert key as a list of field names."""
+    return [key] if isinstance(key, str) else list(key or [])
+
+
+def check_key_fields(record, key_fields):
+    """Raise a ValueError if the given record lacks any of the key fields."""
+    missing = [field for field in key_fields if field not in record]
+    if missing:
+        raise ValueError(
+            f'record has no key field(s) {missing} (fields: {sorted(record)}) - '
+            'give its key fields, or key=None to insert every record'
+            )
+
+
+def get_operation(record, key_fields):
+    """Return the bulk write operation for the given record: an upsert on its
+    key fields or, if no key is given, a plain insert.
+    """
+    if not key_fields:
+        return InsertOne(record)
+    check_key_fields(record, key_fields)
+    return UpdateOne(
+        {field: record[field] for field in key_fields},
+        {'$set': record},
+        upsert=True
+        )
+
+
+def create_indexes(collection, key_fields, index_fields=INDEX_FIELDS):
+    """Create a unique index on the key fields, which makes upserts idempotent,
+    and ascending indexes on the given query fields.
+    """
+    if key_fields:
+        collection.create_index(
+            [(field, ASCENDING) for field in key_fields], unique=True
+            )
+    for field in index_fields:
+        if field not in key_fields:
+            collection.create_index([(field, ASCENDING)])
+
+
+def bulk_load(collection, records, key='id', batch_size=1000, ordered=False):
+    """Write the given records to the given collection in unordered bulk
+    writes of batch_size operations and return the write counts and
+    throughput.
+    """
+    key_fields = get_key_fields(key)
+    counts = {'documents': 0, 'inserted': 0, 'upserted': 0, 'matched': 0, 'modified': 0}
+    start = time.perf_counter()
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        result = collection.bulk_write(
+            [get_operation(record, key_fields) for record in batch],
+            ordered=ordered
+            )
+        counts['documents'] += len(batch)
+        counts['inserted'] += result.inserted_count
+        counts['upserted'] += result.upserted_count
+        counts['matched'] += result.matched_count
+        counts['modified'] += result.modified_count
+    counts['seconds'] = time.perf_counter() - start
+    counts['documents_per_second'] = counts['documents'] / counts['seconds'] \
+        if counts['seconds'] > 0 else 0.0
+    return counts
+
+
+def load_file(
+        database,
+        filepath,
+        collection_name,
+        key='id',
+        index_fields=INDEX_FIELDS,
+        batch_size=1000,
+        chunk_size=50000,
+        replace=False,
+        encoding='utf-8'
+        ):
+    """Load the given file into the given collection of the given database,
+    creating its indexes first, and return the load statistics. Raises a
+    ValueError, before writing anything, if the file's first record lacks any
+    of the key fields.
+    """
+    records = iter_records(filepath, chunk_size, encoding)
+    first_record = next(records, None)
+    if first_record is not None:
+        try:
+            check_key_fields(first_record, get_key_fields(key))
+        except ValueError as error:
+            raise ValueError(f'cannot load {filepath} with key {key}: {error}') from None
+        records = chain([first_record], records)
+
+    collection = database[collection_name]
+    if replace:
+        collection.drop()
+    create_indexes(collection, get_key_fields(key), index_fields)
+    return bulk_load(collection, records, key, batch_size)
+
+
+def pymongo_loader(
+        input_filepath,
+        collection_name=None,
+        database_name='data562',
+        key='id',
+        index_fields=INDEX_FIELDS,
+        batch_size=1000,
+        chunk_size=50000,
+        replace=False,
+        encoding='utf-8',
+        mock=False,
+        logging_level=logging.INFO
+        ):
+    """This tool loads the given CSV or JSON-lines file into a MongoDB
+    collection, upserting by key so that it can be re-run incrementally.
+
+    Keyword Arguments:
+        input_filepath -- the file to load
+        collection_name -- the name of the collection to load into
+            (default: None -- the file's name, without its extension)
+        database_name -- the name of the database
+            (default: 'data562')
+        key -- the field (or list of fields) identifying a record, on which
+            to upsert; None to insert every record
+            (default: 'id')
+        index_fields -- the (non-key) fields to index
+            (default: ['company', 'created_at'])
+        batch_size -- the number of records per bulk write
+            (default: 1000)
+        chunk_size -- the number of rows read from the file at a time
+            (default: 50000)
+        replace -- whether to drop the collection before loading
+            (default: False)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        mock -- whether to load into an in-memory mongomock database instead
+            (e.g., to test the loader offline)
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    collection_name = collection_name or Path(input_filepath).stem
+    logger.info('loading %s into %s.%s...', input_filepath, database_name, collection_name)
+
+    with pymongo_utilities.mongo_database(database_name, mock=mock) as database:
+        counts = load_file(
+            database, input_filepath, collection_name, key, index_fields,
+            batch_size, chunk_size, replace, encoding
+            )
+    logger.info('\tloaded %s; connection pool: %s', counts, pymongo_utilities.get_pool_metrics())
+    print(counts)
+
+
+if __name__ == '__main__':
+    Fire(pymongo_loader)
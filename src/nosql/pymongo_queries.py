@@ -0,0 +1,317 @@
+"""
+This module implements the common dashboard/analysis queries on the SLO
+noSQL coding (`slo_code`) and tag (`slo_tags`) collections:
+- stance counts by company and time period
+- coded tweets (with their stance codes) per company
+- tweets on which the coders disagree
+
+Unlike the demonstrations in `pymongo_read.py`, the queries filter and project
+on the server before any join, so that `$lookup` only fetches the tag documents
+of the matching tweets, through an index on the tag `id`. The results are read
+from batched cursors and assembled into a DataFrame (or an Arrow table) batch
+by batch.
+
+Run this module to measure the latency of each query, e.g., against a local
+mongod (see `pymongo_utilities.py`), optionally loading synthetic collections
+first. mongomock (--mock) doesn't use indexes, so its latencies only show that
+the queries run.
+
+See `pymongo_utilities.py` for details.
+"""
+import logging
+import random
+import statistics
+import time
+from itertools import islice
+import pandas as pd
+from fire import Fire
+from pymongo import ASCENDING
+
+import pymongo_utilities
+import pymongo_loader
+
+logger = logging.getLogger(__name__)
+
+CODE_COLLECTION = 'slo_code'
+TAGS_COLLECTION = 'slo_tags'
+
+# The created_at prefix length for each period (created_at is an ISO-formatted
+# string, e.g., '2018-06-12 10:00:00+00:00').
+PERIOD_LENGTHS = {'year': 4, 'month': 7, 'day': 10}
+
+CODED_TWEET_FIELDS = ['id', 'company', 'created_at', 'tweet_norm']
+
+
+def ensure_indexes(database):
+    """Create the indexes used by the queries (if they don't already exist):
+    - slo_code (company, created_at) -- company/time filters and sorts
+    - slo_tags (id, coder, stance) -- the $lookup join on id and the
+        per-tweet grouping of the coder disagreement query
+    """
+    database[CODE_COLLECTION].create_index(
+        [('company', ASCENDING), ('created_at', ASCENDING)]
+        )
+    database[TAGS_COLLECTION].create_index(
+        [('id', ASCENDING), ('coder', ASCENDING), ('stance', ASCENDING)]
+        )
+
+
+def get_tweet_filter(companies=None, start=None, end=None):
+    """Return the slo_code filter for the given companies and the given
+    [start, end) created_at range (e.g., '2018-01', '2018-07').
+    """
+    tweet_filter = {}
+    if companies is not None:
+        tweet_filter['company'] = {'$in': [companies] if isinstance(companies, str) else list(companies)}
+    if start is not None or end is not None:
+        tweet_filter['created_at'] = {}
+        if start is not None:
+            tweet_filter['created_at']['$gte'] = str(start)
+        if end is not None:
+            tweet_filter['created_at']['$lt'] = str(end)
+    return tweet_filter
+
+
+def get_tags_lookup(as_field='tags'):
+    """Return the $lookup stage joining each tweet to its tag documents."""
+    return {'$lookup': {
+        'from': TAGS_COLLECTION,
+        'localField': 'id',
+        'foreignField': 'id',
+        'as': as_field
+        }}
+
+
+def read_cursor(cursor, batch_size=1000, as_arrow=False):
+    """Read the given cursor batch by batch into a DataFrame or, if as_arrow is
+    set, an Arrow table (which requires pyarrow).
+    """
+    if as_arrow:
+        import pyarrow
+        batches = []
+        while batch := list(islice(cursor, batch_size)):
+            batches.append(pyarrow.RecordBatch.from_pylist(batch))
+        return pyarrow.Table.from_batches(batches) if batches else pyarrow.table({})
+
+    frames = []
+    while batch := list(islice(cursor, batch_size)):
+        frames.append(pd.DataFrame.from_records(batch))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def stance_counts(
+        database,
+        period='month',
+        companies=None,
+        start=None,
+        end=None,
+        batch_size=1000,
+        as_arrow=False
+        ):
+    """Return the number of codes of each stance per company and period."""
+    pipeline = [
+        {'$match': get_tweet_filter(companies, start, end)},
+        {'$project': {
+            '_id': 0,
+            'id': 1,
+            'company': 1,
+            'period': {'$substr': ['$created_at', 0, PERIOD_LENGTHS[period]]}
+            }},
+        get_tags_lookup(),
+        {'$unwind': '$tags'},
+        {'$group': {
+            '_id': {'company': '$company', 'period': '$period', 'stance': '$tags.stance'},
+            'count': {'$sum': 1}
+            }},
+        {'$project': {
+            '_id': 0,
+            'company': '$_id.company',
+            'period': '$_id.period',
+            'stance': '$_id.stance',
+            'count': 1
+            }},
+        {'$sort': {'company': 1, 'period': 1, 'stance': 1}},
+    ]
+    cursor = database[CODE_COLLECTION].aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+    return read_cursor(cursor, batch_size, as_arrow)
+
+
+def coded_tweets(
+        database,
+        company,
+        fields=CODED_TWEET_FIELDS,
+        start=None,
+        end=None,
+        batch_size=1000,
+        as_arrow=False
+        ):
+    """Return the given fields of the given company's tweets that have been
+    coded, in created_at order, each with the list of its stance codes.
+    """
+    pipeline = [
+        {'$match': get_tweet_filter(company, start, end)},
+        {'$sort': {'created_at': 1}},
+        {'$project': dict({'_id': 0}, **{field: 1 for field in fields})},
+        get_tags_lookup(),
+        {'$match': {'tags': {'$ne': []}}},
+        {'$project': dict(
+            {'_id': 0, 'stances': '$tags.stance'},
+            **{field: 1 for field in fields}
+            )},
+    ]
+    cursor = database[CODE_COLLECTION].aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+    return read_cursor(cursor, batch_size, as_arrow)
+
+
+def coder_disagreement(database, min_coders=2, batch_size=1000):
+    """Return the tweets coded by at least min_coders coders that did not all
+    agree, with their stance codes, company and majority-stance share.
+    """
+    pipeline = [
+        {'$sort': {'id': 1, 'coder': 1}},
+        {'$group': {
+            '_id': '$id',
+            'coders': {'$sum': 1},
+            'stances': {'$push': '$stance'},
+            'distinct_stances': {'$addToSet': '$stance'}
+            }},
+        {'$match': {'coders': {'$gte': min_coders}}},
+        {'$project': {
+            '_id': 0,
+            'id': '$_id',
+            'coders': 1,
+            'stances': 1,
+            'distinct_stance_count': {'$size': '$distinct_stances'}
+            }},
+        {'$match': {'distinct_stance_count': {'$gt': 1}}},
+        # Only the (few) disagreeing tweets are joined to their company.
+        {'$lookup': {
+            'from': CODE_COLLECTION,
+            'localField': 'id',
+            'foreignField': 'id',
+            'as': 'tweet'
+            }},
+        {'$unwind': {'path': '$tweet', 'preserveNullAndEmptyArrays': True}},
+        {'$project': {
+            'id': 1,
+            'company': '$tweet.company',
+            'coders': 1,
+            'stances': 1,
+            'distinct_stance_count': 1
+            }},
+    ]
+    cursor = database[TAGS_COLLECTION].aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+    data_frame = read_cursor(cursor, batch_size)
+    if not data_frame.empty:
+        data_frame['majority_share'] = data_frame['stances'].apply(
+            lambda stances: max(map(stances.count, set(stances))) / len(stances)
+            )
+    return data_frame
+
+
+def load_synthetic_collections(database, count, seed=0):
+    """Load count synthetic tweets into slo_code and their codes, by one to
+    three coders each, into slo_tags, replacing any existing documents.
+    """
+    rng = random.Random(seed)
+    tweets = [
+        {
+            'id': 1000000000000000000 + i,
+            'company': rng.choice(['adani', 'bhp', 'fortescue', 'riotinto', 'santos']),
+            'created_at': f'2018-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00:00+00:00',
+            'tweet_norm': ' '.join(f'w{rng.randint(0, 5000)}' for _ in range(20)),
+            }
+        for i in range(count)
+        ]
+    tags = [
+        {'id': tweet['id'], 'coder': f'coder{coder}', 'stance': rng.choice(['against', 'for', 'neutral', 'na'])}
+        for tweet in tweets
+        for coder in range(rng.randint(1, 3))
+        ]
+    for collection_name, documents, key in [
+            (CODE_COLLECTION, tweets, 'id'),
+            (TAGS_COLLECTION, tags, ['id', 'coder'])
+            ]:
+        database[collection_name].drop()
+        pymongo_loader.create_indexes(database[collection_name], pymongo_loader.get_key_fields(key), [])
+        # The collections are empty, so plain inserts (no key) suffice.
+        pymongo_loader.bulk_load(database[collection_name], documents, key=None)
+
+
+def time_query(query, repeats):
+    """Run the given query function repeats times and return its latencies (in
+    milliseconds) and the number of rows it returned.
+    """
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = query()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, len(result)
+
+
+def pymongo_queries(
+        database_name='data562',
+        company='adani',
+        period='month',
+        repeats=5,
+        synthetic_count=None,
+        mock=False,
+        logging_level=logging.INFO
+        ):
+    """This tool creates the query indexes and prints the latency (median and
+    maximum over the repeats) of each query.
+
+    Keyword Arguments:
+        database_name -- the name of the database
+            (default: 'data562')
+        company -- the company for the per-company queries
+            (default: 'adani')
+        period -- the stance count period: 'year', 'month' or 'day'
+            (default: 'month')
+        repeats -- the number of times to run each query
+            (default: 5)
+        synthetic_count -- the number of synthetic tweets with which to replace
+            the collections first, e.g., in a scratch database
+            (default: None -- query the existing collections)
+        mock -- whether to use an in-memory mongomock database (requires
+            synthetic_count)
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    with pymongo_utilities.mongo_database(database_name, mock=mock) as database:
+        if synthetic_count:
+            logger.info('loading %s synthetic tweets into %s...', synthetic_count, database_name)
+            load_synthetic_collections(database, synthetic_count)
+        ensure_indexes(database)
+
+        queries = {
+            'stance_counts': lambda: stance_counts(database, period),
+            'stance_counts_company': lambda: stance_counts(database, period, company),
+            'coded_tweets': lambda: coded_tweets(database, company),
+            'coder_disagreement': lambda: coder_disagreement(database),
+            }
+        rows = []
+        for name, query in queries.items():
+            latencies, row_count = time_query(query, repeats)
+            rows.append({
+                'query': name,
+                'rows': row_count,
+                'median_ms': round(statistics.median(latencies), 1),
+                'max_ms': round(max(latencies), 1),
+                })
+            logger.info('\t%s', rows[-1])
+    print(pd.DataFrame(rows).to_string(index=False))
+    if not mock:
+        print('connection pool:', pymongo_utilities.get_pool_metrics())
+
+
+if __name__ == '__main__':
+    Fire(pymongo_queries)
@@ -10,24 +10,244 @@ Notes:
     See: https://docs.github.com/en/codespaces/managing-your-codespaces/managing-your-account-specific-secrets-for-github-codespaces # noqa: E501
 - I had to add my IP address to the MongoDB cloud database's "Network Access"
     settings, which worked for multiple machines.
+- Long-running code (e.g., a classifier writing predictions continuously)
+    should use the shared client (`get_client()`/`mongo_database()`), which is
+    created once per process, on first use, and reuses its connection pool.
+    MongoClient isn't fork-safe, so a forked process (e.g., a process pool
+    worker) gets its own shared client rather than the parent's.
+- Without MONGODB_URI or MONGODB_URL set, the clients connect to a local mongod
+    (MONGODB_LOCAL_URI, default: mongodb://localhost:27017), e.g., for offline
+    testing.
 """
+import atexit
+import logging
 import os
-from pymongo import MongoClient
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlsplit
+from pymongo import MongoClient, monitoring
 
+logger = logging.getLogger(__name__)
 
-def get_mongo_client_db(database_name):
-    """ Return the MongoDB client and database objects for the given
-    MongoDB cloud database name.
+LOCAL_URI = 'mongodb://localhost:27017'
+
+# The default client settings, overridable per client (see get_client()). A
+# setting given in MONGODB_URI (e.g., ?maxPoolSize=20) takes precedence over its
+# default. The write concern is left to the URI/server (e.g., Atlas's majority).
+CLIENT_OPTIONS = {
+    'maxPoolSize': 100,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    'waitQueueTimeoutMS': 10000,
+    'connectTimeoutMS': 10000,
+    'serverSelectionTimeoutMS': 10000,
+    'socketTimeoutMS': 60000,
+    'retryWrites': True,
+    }
+
+# The shared clients (and their settings/metrics), real and mock, of this process.
+__shared_clients_global__ = {}
+__shared_clients_pid_global__ = os.getpid()
+__shared_clients_lock_global__ = threading.Lock()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """A connection pool listener that counts connections and checkouts and
+    measures how long checkouts wait for a connection.
     """
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkout_starts = {}
+        self.open_connections = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def connection_check_out_started(self, event):
+        self.checkout_starts[threading.get_ident()] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - self.checkout_starts.pop(threading.get_ident(), time.perf_counter())
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def connection_check_out_failed(self, event):
+        self.checkout_starts.pop(threading.get_ident(), None)
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self):
+        """Return the current metric values."""
+        with self.lock:
+            return {
+                'open_connections': self.open_connections,
+                'checked_out': self.checked_out,
+                'max_checked_out': self.max_checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'mean_wait_ms': self.total_wait_seconds / self.checkouts * 1000 if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait_seconds * 1000,
+                }
+
+
+def get_connection_string():
+    """ Return the MongoDB connection string: MONGODB_URI if set, otherwise the
+    cloud database given by MONGODB_USERNAME/MONGODB_PASSWORD/MONGODB_URL if
+    set, otherwise the local URI.
+    """
     # Read the username/password/url from the environment, set by
     # running a gitignored .env file (in the shell running this script).
-    username = os.environ.get("MONGODB_USERNAME")
-    password = os.environ.get("MONGODB_PASSWORD")
+    if os.environ.get("MONGODB_URI"):
+        return os.environ["MONGODB_URI"]
     url = os.environ.get("MONGODB_URL")
-    connection_string = f"mongodb+srv://{username}:{password}@{url}"
+    if url:
+        username = os.environ.get("MONGODB_USERNAME")
+        password = os.environ.get("MONGODB_PASSWORD")
+        return f"mongodb+srv://{username}:{password}@{url}"
+    local_uri = os.environ.get("MONGODB_LOCAL_URI", LOCAL_URI)
+    logger.warning('MONGODB_URI/MONGODB_URL not set - using local MongoDB %s', local_uri)
+    return local_uri
+
+
+def get_default_options(connection_string):
+    """ Return the default client settings that the given connection string
+    doesn't set (MongoDB option names are case-insensitive).
+    """
+    uri_options = {name.lower() for name, _ in parse_qsl(urlsplit(connection_string).query)}
+    return {name: value for name, value in CLIENT_OPTIONS.items() if name.lower() not in uri_options}
+
 
-    client = MongoClient(connection_string)
+def create_client(mock=False, **options):
+    """ Return a new client with the default settings that the connection
+    string doesn't set, overridden by the given options (e.g., maxPoolSize=10,
+    w='majority'), and its pool metrics. If mock is set, return an in-memory
+    mongomock client (with no metrics) instead.
+    """
+    if mock:
+        import mongomock
+        return mongomock.MongoClient(), None
+    metrics = PoolMetrics()
+    connection_string = get_connection_string()
+    client = MongoClient(
+        connection_string,
+        event_listeners=[metrics],
+        **dict(get_default_options(connection_string), **options)
+        )
+    return client, metrics
+
+
+def reset_shared_clients():
+    """ Forget the shared clients inherited from the parent process, without
+    closing them (their sockets belong to the parent).
+    """
+    global __shared_clients_global__, __shared_clients_pid_global__, __shared_clients_lock_global__
+    __shared_clients_global__ = {}
+    __shared_clients_pid_global__ = os.getpid()
+    __shared_clients_lock_global__ = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_shared_clients)
+
+
+def get_client(mock=False, **options):
+    """ Return this process's shared client, creating it on first use with the
+    given options (see create_client()). Options given once the client exists
+    are ignored, with a warning.
+    """
+    if __shared_clients_pid_global__ != os.getpid():
+        reset_shared_clients()
+    with __shared_clients_lock_global__:
+        if mock not in __shared_clients_global__:
+            client, metrics = create_client(mock, **options)
+            __shared_clients_global__[mock] = {'client': client, 'metrics': metrics, 'options': options}
+        elif options and options != __shared_clients_global__[mock]['options']:
+            logger.warning('ignoring options %s - the shared MongoDB client already exists', options)
+        return __shared_clients_global__[mock]['client']
+
+
+def get_pool_metrics(mock=False):
+    """ Return the connection pool metrics of the shared client (see
+    PoolMetrics), or None if it doesn't exist (or is a mock).
+    """
+    shared_client = __shared_clients_global__.get(mock)
+    if shared_client is None or shared_client['metrics'] is None:
+        return None
+    return shared_client['metrics'].snapshot()
+
+
+def close_client():
+    """ Close this process's shared clients; the next get_client() call creates
+    a new one.
+    """
+    with __shared_clients_lock_global__:
+        for shared_client in __shared_clients_global__.values():
+            shared_client['client'].close()
+        __shared_clients_global__.clear()
+
+
+atexit.register(close_client)
+
+
+@contextmanager
+def mongo_database(database_name, mock=False, write_concern=None, close=False, **options):
+    """ Yield the given database of the shared client (see get_client()), with
+    the given write concern (a pymongo WriteConcern) if any. The shared client
+    stays open for reuse unless close is set.
+    """
+    client = get_client(mock, **options)
+    try:
+        yield client.get_database(database_name, write_concern=write_concern)
+    finally:
+        if close:
+            close_client()
+
+
+def get_mongo_client_db(database_name, mock=False):
+    """ Return the MongoDB client and database objects for the given
+    MongoDB cloud database name. If mock is set, return an in-memory
+    mongomock client/database instead, e.g., for testing offline.
+
+    The client is the caller's own, to be closed when done; use
+    mongo_database() to share one pooled client across the process.
+    """
+    client, _ = create_client(mock)
     database = client[database_name]
 
     return client, database
@@ -0,0 +1,206 @@
+"""
+This module compiles the catalogue of tweet sub-string patterns (see
+settings.py) that dataset_normalizer runs on every tweet and profile, for a
+linear-time regex engine where possible.
+
+Each pattern is parsed (with the stdlib regex parser) for the features that
+RE2 either can't run or runs differently:
+- lookaround -- lookahead/lookbehind assertions (unsupported)
+- backreference -- \\1 etc. (unsupported)
+- atomic -- atomic groups and possessive repeats (unsupported)
+- unicode_class -- \\w, \\s, \\d and \\b, which RE2 limits to ASCII
+- end_anchor -- $, which re also matches before a final newline
+- flags -- compile flags other than the (default) re.UNICODE
+
+Patterns with none of these can be compiled with RE2, if google-re2 is
+installed (pip install google-re2), which guarantees linear-time matching. The
+others stay on re and are flagged in the registry's report. PTN_cash, whose
+lookahead rescans the rest of the text at every $, is replaced by CashPattern,
+which matches the same amounts in linear time on either engine.
+
+PATTERNS, the registry dataset_normalizer uses, takes its engine from
+settings.REGEX_ENGINE.
+
+See benchmarks/benchmark_patterns.py for a fuzz benchmark of the catalogue.
+"""
+import re
+import pandas as pd
+
+import src.settings
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# The settings.py patterns run on every tweet/profile, in dataset_normalizer's order.
+CATALOGUE = [
+    'PTN_rt',
+    'PTN_whitespace',
+    'PTN_concatenated_url',
+    'PTN_mention',
+    'PTN_url',
+    'PTN_elongation',
+    'PTN_year',
+    'PTN_time',
+    'PTN_cash',
+    'PTN_hash',
+]
+
+INCOMPATIBLE_OPCODES = {
+    'ASSERT': 'lookaround',
+    'ASSERT_NOT': 'lookaround',
+    'GROUPREF': 'backreference',
+    'GROUPREF_EXISTS': 'backreference',
+    'ATOMIC_GROUP': 'atomic',
+    'POSSESSIVE_REPEAT': 'atomic',
+    'CATEGORY': 'unicode_class',
+}
+INCOMPATIBLE_POSITIONS = {
+    'AT_END': 'end_anchor',
+    'AT_BOUNDARY': 'unicode_class',
+    'AT_NON_BOUNDARY': 'unicode_class',
+}
+
+
+def iter_subpatterns(value):
+    """Yield the parsed sub-patterns nested in the given opcode argument."""
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from iter_subpatterns(item)
+
+
+def get_incompatibilities(pattern):
+    """Return the sorted features of the given compiled re pattern that keep it
+    from running (identically) on RE2, see the module docstring.
+    """
+    incompatibilities = set()
+    if pattern.flags & ~re.UNICODE:
+        incompatibilities.add('flags')
+
+    def walk(subpattern):
+        for opcode, value in subpattern:
+            name = str(opcode)
+            if name in INCOMPATIBLE_OPCODES:
+                incompatibilities.add(INCOMPATIBLE_OPCODES[name])
+            elif name == 'AT' and str(value) in INCOMPATIBLE_POSITIONS:
+                incompatibilities.add(INCOMPATIBLE_POSITIONS[str(value)])
+            elif name == 'IN' and any(str(item_opcode) == 'CATEGORY' for item_opcode, _ in value):
+                incompatibilities.add('unicode_class')
+            for nested in iter_subpatterns(value):
+                walk(nested)
+
+    walk(sre_parse.parse(pattern.pattern, pattern.flags))
+    return sorted(incompatibilities)
+
+
+def compile_pattern(pattern, engine='auto'):
+    """Return the given re pattern compiled for the given engine ('re2', 're'
+    or 'auto' -- RE2 if installed), the name of the engine used and the
+    features that kept it on re. Incompatible patterns always stay on re.
+    """
+    if engine == 're2' and re2 is None:
+        raise ImportError('the re2 engine requires google-re2 (pip install google-re2)')
+    incompatibilities = get_incompatibilities(pattern)
+    if engine == 're' or re2 is None or incompatibilities:
+        return pattern, 're', incompatibilities
+    return re2.compile(pattern.pattern), 're2', incompatibilities
+
+
+def find_forward(text, char, start):
+    """Return the index of the given character in text from start on, or
+    len(text) if there is none.
+    """
+    index = text.find(char, start)
+    return len(text) if index < 0 else index
+
+
+class CashPattern:
+    """A linear-time equivalent of settings.PTN_cash, which only matches a $
+    amount that is followed by '(' and a ')' later on its line, or that has no
+    parenthesis after it at all. PTN_cash checks this with a lookahead that
+    rescans the rest of the text at every $ (quadratic in the number of $s);
+    this class matches the lookahead-free PTN_cash_amount and checks the
+    parentheses with searches that only move forward.
+    """
+
+    def __init__(self, amount_pattern):
+        self.amount_pattern = amount_pattern
+        self.pattern = src.settings.PTN_cash.pattern
+
+    def finditer(self, text):
+        last_parenthesis = max(text.rfind('('), text.rfind(')'))
+        next_close = next_newline = -1
+        for match in self.amount_pattern.finditer(text):
+            # The position right after the $, where PTN_cash's lookahead starts.
+            start = match.start() + 1
+            if start > last_parenthesis:
+                yield match
+            elif text.startswith('(', start):
+                if next_close <= start:
+                    next_close = find_forward(text, ')', start + 1)
+                if next_newline <= start:
+                    next_newline = find_forward(text, '\n', start + 1)
+                if next_close < next_newline:
+                    yield match
+
+    def sub(self, repl, text):
+        pieces = []
+        end = 0
+        for match in self.finditer(text):
+            pieces.append(text[end:match.start()])
+            pieces.append(repl(match) if callable(repl) else match.expand(repl))
+            end = match.end()
+        if not pieces:
+            return text
+        pieces.append(text[end:])
+        return ''.join(pieces)
+
+
+# The linear rewrites of catalogue patterns that can't be compiled as is.
+REWRITES = {
+    'PTN_cash': ('PTN_cash_amount', CashPattern),
+}
+
+
+class PatternRegistry:
+    """The catalogue patterns, by settings.py name, compiled for the given
+    engine (see compile_pattern()).
+    """
+
+    def __init__(self, names=CATALOGUE, engine='auto'):
+        self.patterns = {}
+        self.rows = []
+        for name in names:
+            rewrite_name, wrapper = REWRITES.get(name, (None, None))
+            pattern, engine_name, incompatibilities = compile_pattern(
+                getattr(src.settings, rewrite_name or name), engine
+                )
+            self.patterns[name] = wrapper(pattern) if wrapper else pattern
+            self.rows.append({
+                'name': name,
+                'engine': engine_name,
+                # The rewrites match in linear time on either engine.
+                'linear_time': engine_name == 're2' or rewrite_name is not None,
+                'rewrite': rewrite_name or '',
+                'incompatibilities': ','.join(incompatibilities),
+                })
+
+    def __getitem__(self, name):
+        return self.patterns[name]
+
+    def get_report(self):
+        """Return a table of the patterns' engines and the features that kept
+        any of them on re.
+        """
+        return pd.DataFrame(self.rows)
+
+
+PATTERNS = PatternRegistry(engine=src.settings.REGEX_ENGINE)
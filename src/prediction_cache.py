@@ -0,0 +1,183 @@
+"""
+This module caches stance predictions by x value (see model_utilities.get_x()),
+since retweets and copy-paste campaigns send the same (company, tweet_norm,
+profile_norm) triple to the model over and over.
+
+A PredictionCache sits in front of a fitted pipeline's predict(): each x value
+is keyed by a 64-bit BLAKE2b hash of its text, the keys are looked up in a
+bounded in-memory LRU and then, optionally, in a persistent SQLite tier, and
+only the (unique) misses of a batch go to the model. Their predictions are
+merged back in the batch's order and cached in both tiers.
+
+Entries are tagged with the model version that computed them, so a new
+version (e.g., a retrained model artifact, see model_artifact.py) invalidates
+them. The cache counts its memory hits, disk hits and misses (see
+get_metrics()).
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on the number of parameters of a query is 999.
+SQLITE_BATCH_SIZE = 500
+
+
+def get_key(x_value):
+    """Return the 64-bit (signed, as SQLite stores integers) BLAKE2b hash of
+    the given x value.
+    """
+    digest = hashlib.blake2b(x_value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+class PredictionCache:
+    """A two-tier cache of predictions by x value, for one model version at a
+    time (see the module docstring).
+    """
+
+    def __init__(self, max_size=100000, cache_filepath=None, model_version=None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.model_version = model_version
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # predict() may be called from several threads (e.g., by a ModelRegistry).
+        self.lock = threading.RLock()
+        self.connection = None
+        if cache_filepath is not None:
+            self.connection = sqlite3.connect(str(cache_filepath), check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'model_version TEXT NOT NULL, key INTEGER NOT NULL, prediction, '
+                'PRIMARY KEY (model_version, key)) WITHOUT ROWID'
+                )
+            if model_version is not None:
+                self.delete_other_versions()
+            self.connection.commit()
+
+    def delete_other_versions(self):
+        """Delete the disk tier's entries of the other model versions."""
+        cursor = self.connection.execute(
+            'DELETE FROM predictions WHERE model_version != ?', (str(self.model_version),)
+            )
+        if cursor.rowcount:
+            logger.info('\tdeleted %s cached predictions of old model versions', cursor.rowcount)
+
+    def set_model_version(self, model_version):
+        """Invalidate the entries of any other model version."""
+        with self.lock:
+            if model_version == self.model_version:
+                return
+            logger.info('\tinvalidating the prediction cache for model version %s', model_version)
+            self.model_version = model_version
+            self.entries.clear()
+            if self.connection is not None:
+                self.delete_other_versions()
+                self.connection.commit()
+
+    def get_disk_predictions(self, keys):
+        """Return the disk tier's predictions of the given keys, by key."""
+        predictions = {}
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            rows = self.connection.execute(
+                'SELECT key, prediction FROM predictions WHERE model_version = ? AND key IN '
+                f'({",".join("?" * len(batch))})',
+                [str(self.model_version)] + batch
+                )
+            predictions.update(rows)
+        return predictions
+
+    def add(self, key, prediction):
+        """Add the given prediction to the in-memory tier, evicting the least
+        recently used entry if it is full.
+        """
+        self.entries[key] = prediction
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def predict(self, model, x_values, model_version=None):
+        """Return the given model's predictions of the given x values (e.g., a
+        list or ParsedDocuments), predicting only the cache misses.
+
+        The model version is set and the cache looked up under one acquisition
+        of the lock, but the misses are predicted outside it, so that threads
+        don't wait for each other's model calls. Their predictions are only
+        cached if the model version hasn't changed in the meantime.
+        """
+        if isinstance(x_values, (list, tuple)):
+            x_values = np.asarray(x_values, dtype=str)
+        keys = [get_key(x_value) for x_value in np.asarray(x_values).tolist()]
+
+        with self.lock:
+            if model_version is not None:
+                self.set_model_version(model_version)
+            model_version = self.model_version
+            predictions = [None] * len(keys)
+            # The indexes of the missed keys, by key, in order of first appearance.
+            missing = OrderedDict()
+            for index, key in enumerate(keys):
+                prediction = self.entries.get(key)
+                if prediction is None:
+                    missing.setdefault(key, []).append(index)
+                else:
+                    self.entries.move_to_end(key)
+                    predictions[index] = prediction
+            self.hits += len(keys) - sum(map(len, missing.values()))
+
+            if missing and self.connection is not None:
+                for key, prediction in self.get_disk_predictions(list(missing)).items():
+                    indexes = missing.pop(key)
+                    for index in indexes:
+                        predictions[index] = prediction
+                    self.add(key, prediction)
+                    self.disk_hits += len(indexes)
+
+        if not missing:
+            return np.asarray(predictions)
+
+        # Predict each missed x value once; its duplicates count as hits.
+        first_indexes = [indexes[0] for indexes in missing.values()]
+        y_predicted = model.predict(x_values[np.asarray(first_indexes)])
+        for indexes, prediction in zip(missing.values(), y_predicted.tolist()):
+            for index in indexes:
+                predictions[index] = prediction
+
+        with self.lock:
+            self.misses += len(missing)
+            self.hits += sum(map(len, missing.values())) - len(missing)
+            if model_version == self.model_version:
+                rows = []
+                for key, prediction in zip(missing, y_predicted.tolist()):
+                    self.add(key, prediction)
+                    rows.append((str(model_version), key, prediction))
+                if self.connection is not None:
+                    self.connection.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)', rows)
+                    self.connection.commit()
+        return np.asarray(predictions, dtype=y_predicted.dtype)
+
+    def get_metrics(self):
+        """Return the cache's hit/miss counts and hit rate."""
+        requests = self.hits + self.disk_hits + self.misses
+        return {
+            'model_version': self.model_version,
+            'requests': requests,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0.0,
+            'size': len(self.entries),
+            }
+
+    def close(self):
+        """Close the disk tier, if any."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -106,7 +106,10 @@ PTN_companies = [
 
 # Patterns for important tweet sub-strings
 PTN_rt = re.compile(r'^(RT @\w+: )')
-PTN_url = re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
+# One character class, equivalent to the alternation
+# (?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+ since the
+# $-_ range already covers the digits, upper-case letters, % and hex digits.
+PTN_url = re.compile(r"http[s]?://[a-zA-Z0-9$-_@.&+!*(),]+")
 PTN_concatenated_url = re.compile(r'(.)http')
 PTN_mention = re.compile(r'@[a-zA-Z_0-9]+')
 PTN_stock_symbol = re.compile(r'$[a-zA-Z]+')
@@ -117,9 +120,18 @@ PTN_year = re.compile(r'[12][0-9]{3}')
 PTN_time = re.compile(r'[012]?[0-9]:[0-5][0-9]')
 # See: https://stackoverflow.com/a/13848829
 PTN_cash = re.compile(r'\$(?=\(.*\)|[^()]*$)\(?\d{1,3}(,?\d{3})?(\.\d\d?)?\)?([bmk]| hundred| thousand| million| billion)?')
+# PTN_cash without its lookahead, which rescans the rest of the text at every $
+# (see pattern_registry.CashPattern for the linear-time equivalent).
+PTN_cash_amount = re.compile(r'\$\(?\d{1,3}(,?\d{3})?(\.\d\d?)?\)?([bmk]| hundred| thousand| million| billion)?')
 
 RETWEET_START = 'RT @'
 
+# The regex engine of the pattern catalogue (see pattern_registry.py): 'auto'
+# compiles the compatible patterns with RE2 (if installed), 're' keeps them on
+# the stdlib engine, which is faster on tweet-length texts and, with the linear
+# rewrites of PTN_url/PTN_cash, has a bounded cost per tweet.
+REGEX_ENGINE = 're'
+
 # This regex identifies the UTF-8 characters that mess up Polyglot/cld2.
 REGEX_BAD_CHARS = regex.compile(r"[\p{Cc}\p{Cs}]+")
 
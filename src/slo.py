@@ -0,0 +1,77 @@
+"""
+This module is a single command-line entry point for the SLO tools, e.g.:
+
+    python src/slo.py dataset_normalizer --dataset_path=data
+    python src/slo.py model_test --help
+    python src/slo.py
+
+Each command is dispatched to its tool's Fire entry point, and only the tool's
+module is imported, so a command doesn't load the dependencies of the others
+(e.g., dataset_preprocessor doesn't import scikit-learn or gensim). The tools'
+heavy dependencies are also imported on first use, so --help and argument
+errors come back quickly. See benchmarks/benchmark_startup.py for the
+per-command import times.
+"""
+import importlib
+import sys
+from pathlib import Path
+
+# The tools, by command: (module, entry point, description).
+COMMANDS = {
+    'dataset_preprocessor': ('src.dataset_preprocessor', 'dataset_preprocessor', 'rebuild the dataset from raw tweets'),
+    'dataset_normalizer': ('src.dataset_normalizer', 'dataset_normalizer', 'normalize/tokenize the dataset'),
+    'dataset_summarizer': ('src.dataset_summarizer', 'main', 'summarize the dataset for EDA'),
+    'dataset_deduplicator': ('src.dataset_deduplicator', 'main', 'remove near-duplicate tweets'),
+    'trending_topics': ('src.trending_topics', 'main', 'find trending hashtags/n-grams'),
+    'dataset_pipeline': ('src.dataset_pipeline', 'dataset_pipeline', 'build the tokens/auto-coded files in one pass'),
+    'token_extractor': ('src.token_extractor', 'token_extractor', 'extract the normalized tokens'),
+    'coding_processor': ('src.coding_processor', 'coding_processor', 'sample a testset for manual coding'),
+    'autocoding_processor': ('src.autocoding_processor', 'main', 'auto-code a trainset'),
+    'model_build': ('src.model_build', 'model_build', 'train and save a model'),
+    'model_test': ('src.model_test', 'model_test', 'test a model on a coded testset'),
+    'model_tune': ('src.model_tune', 'model_tune', 'tune the model hyper-parameters'),
+    'model_cascade': ('src.model_cascade', 'model_cascade', 'build a fast two-stage cascade model'),
+    'pymongo_loader': ('pymongo_loader', 'pymongo_loader', 'load a dataset into MongoDB'),
+    'pymongo_queries': ('pymongo_queries', 'pymongo_queries', 'time the MongoDB queries'),
+    'pymongo_load_benchmark': ('pymongo_load_benchmark', 'pymongo_load_benchmark', 'time MongoDB bulk loads'),
+}
+
+# The noSQL tools import their sibling modules as top-level modules.
+NOSQL_DIRPATH = Path(__file__).parent / 'nosql'
+
+
+def get_usage():
+    """Return the usage message, listing the commands."""
+    width = max(map(len, COMMANDS))
+    lines = ['usage: slo.py <command> [--flag=value ...] | <command> --help', '', 'commands:']
+    lines.extend(f'  {command:{width}}  {description}' for command, (_, _, description) in COMMANDS.items())
+    return '\n'.join(lines)
+
+
+def get_entry_point(command):
+    """Import the given command's tool module and return its entry point."""
+    module_name, function_name, _ = COMMANDS[command]
+    if not module_name.startswith('src.') and str(NOSQL_DIRPATH) not in sys.path:
+        sys.path.insert(0, str(NOSQL_DIRPATH))
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def slo(argv=None):
+    """This tool runs the SLO tool named by the first argument with the other
+    arguments (see get_usage()).
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help', 'help'):
+        print(get_usage())
+        return
+    command, arguments = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f'unknown command: {command}\n\n{get_usage()}', file=sys.stderr)
+        sys.exit(2)
+
+    from fire import Fire
+    Fire(get_entry_point(command), command=arguments, name=command)
+
+
+if __name__ == '__main__':
+    slo()
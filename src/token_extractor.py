@@ -8,14 +8,31 @@ from pathlib import Path
 import pandas as pd
 from fire import Fire
 
+from src.instrumentation import instrumented, stage
+
 logger = logging.getLogger(__name__)
 
 
+def save_tokens(output_filepath, tweets, profiles, encoding='utf-8'):
+    """This function writes the given unique tweet texts and then the given
+    unique profile texts to the given text file, one per line.
+    """
+    with open(output_filepath, 'w', encoding=encoding) as fout:
+        # Dump unique tweet and profile texts (separately).
+        fout.writelines([text + '\n' for text in tweets])
+        fout.writelines([text + '\n' for text in profiles])
+    logger.info('saved to %s...', output_filepath)
+
+
+@instrumented
 def token_extractor(
         dataset_path='.',
         input_filename='dataset_norm.csv',
         output_filename='dataset_norm_tokens.txt',
         encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
         logging_level=logging.INFO
         ):
     """This function extracts the raw text from the given tokenized dataset
@@ -32,6 +49,14 @@ def token_extractor(
             (default: dataset_norm_tokens.csv)
         :param encoding: the file encoding
             (default: utf-8)
+        :param report_dirname: the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: reports)
+        :param cprofile: whether to include a cProfile profile in the report
+            (default: False)
+        :param trace_memory: whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
         logging_level -- the level of logging to use
             (default: logging.INFO)
     """
@@ -47,14 +72,18 @@ def token_extractor(
     logger.info('\tloading: %s', input_filepath)
 
     # Profiles are occasionally empty, so we need to drop the default NA handling.
-    data_frame = pd.read_csv(input_filepath, keep_default_na=False)
+    with stage('read_dataset') as metrics:
+        data_frame = pd.read_csv(input_filepath, keep_default_na=False)
+        metrics.rows_out = data_frame.shape[0]
 
     output_filepath = Path(dataset_path, output_filename)
-    with open(output_filepath, 'w', encoding=encoding) as fout:
-        # Dump unique tweet and profile texts (separately).
-        fout.writelines([text for text in data_frame['tweet_norm'].unique() + '\n'])
-        fout.writelines([text for text in data_frame['profile_norm'].unique() + '\n'])
-        logger.info('saved to %s...', output_filepath)
+    with stage('write_tokens', rows_in=data_frame.shape[0]):
+        save_tokens(
+            output_filepath,
+            data_frame['tweet_norm'].unique(),
+            data_frame['profile_norm'].unique(),
+            encoding
+            )
 
 
 if __name__ == '__main__':
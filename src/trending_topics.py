@@ -0,0 +1,377 @@
+"""
+This module extracts the topics (hashtags and word n-grams) trending in the
+tweets about each company, from a stream of normalized tweets, in bounded
+memory.
+
+For each company and topic kind, a TopicTracker keeps:
+- a Space-Saving summary of the current time window's heaviest topics (the
+    trending candidates), whose size is fixed, however long the stream;
+- a Count-Min sketch of the current window's topic counts; and
+- a Count-Min sketch of the baseline (earlier windows' counts, exponentially
+    decayed), folded in whenever a window closes.
+
+A topic's trend score is its share of the current window's topics relative
+to its (smoothed) share of the baseline, so a topic that is always frequent
+doesn't trend, while one that suddenly becomes frequent does.
+
+See main() for the details.
+"""
+import heapq
+import logging
+import zlib
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fire import Fire
+
+from src.instrumentation import instrumented, stage
+
+logger = logging.getLogger(__name__)
+
+TOPIC_KINDS = ['hashtag', 'ngram']
+
+# The number of topics counted in the Count-Min sketches at a time.
+PENDING_TOPICS_SIZE = 4096
+
+
+class SpaceSaving:
+    """A Space-Saving summary of the capacity heaviest items of a stream. An
+    item's count over-estimates its true count by at most its error, which is
+    at most the total count divided by the capacity.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # A lazy min-heap of (count, item) entries: an item's entry is pushed
+        # when it's added and refreshed only when found stale on eviction.
+        self.heap = []
+
+    def add(self, item, count=1):
+        """Count the given item."""
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            # Replace the item with the minimum count, inheriting its count.
+            min_count, min_item = heapq.heappop(self.heap)
+            while self.counts[min_item] != min_count:
+                heapq.heappush(self.heap, (self.counts[min_item], min_item))
+                min_count, min_item = heapq.heappop(self.heap)
+            del self.counts[min_item]
+            del self.errors[min_item]
+            self.counts[item] = min_count + count
+            self.errors[item] = min_count
+        heapq.heappush(self.heap, (self.counts[item], item))
+
+    def top(self, k=None):
+        """Return the (up to) k heaviest (item, count) pairs, heaviest first."""
+        return heapq.nlargest(k or self.capacity, self.counts.items(), key=lambda entry: entry[1])
+
+
+class CountMinSketch:
+    """A Count-Min sketch of item counts: width x depth counters, whose
+    estimates over-count by at most 2/width of the total with probability
+    1 - 1/2**depth.
+    """
+
+    def __init__(self, width=2**14, depth=4, dtype=np.int32):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=dtype)
+        self.total = 0
+
+    def get_columns(self, items):
+        """Return the counter column of each of the given items in each row
+        (a depth x len(items) array), derived from two crc32 hashes of the
+        item by double hashing (h1 + row * h2).
+        """
+        encoded = [item.encode() for item in items]
+        h1 = np.fromiter((zlib.crc32(item) for item in encoded), np.int64, len(encoded))
+        h2 = np.fromiter((zlib.crc32(item, 0x9E3779B9) | 1 for item in encoded), np.int64, len(encoded))
+        return (h1[None, :] + np.arange(self.depth)[:, None] * h2[None, :]) % self.width
+
+    def add(self, items):
+        """Count each of the given items once."""
+        if items:
+            np.add.at(self.table, (np.arange(self.depth)[:, None], self.get_columns(items)), 1)
+            self.total += len(items)
+
+    def estimate(self, items):
+        """Return the estimated counts of the given items."""
+        if not items:
+            return np.zeros(0, dtype=self.table.dtype)
+        return self.table[np.arange(self.depth)[:, None], self.get_columns(items)].min(axis=0)
+
+    def merge(self, other, decay=1.0):
+        """Decay this sketch's counts by the given factor and add the counts of
+        the given sketch (of the same shape).
+        """
+        self.table = (self.table * decay + other.table).astype(self.table.dtype)
+        self.total = self.total * decay + other.total
+
+
+class TopicTracker:
+    """Tracks the trending topics of one kind for one company, window by window."""
+
+    def __init__(self, capacity=500, width=2**14, depth=4, baseline_decay=0.5):
+        self.capacity = capacity
+        self.width = width
+        self.depth = depth
+        self.baseline_decay = baseline_decay
+        self.window_start = None
+        self.candidates = SpaceSaving(capacity)
+        self.current = CountMinSketch(width, depth)
+        self.baseline = CountMinSketch(width, depth, dtype=np.float32)
+        self.windows = 0
+        # The topics not yet added to the current window's sketch, which is
+        # updated in batches.
+        self.pending_topics = []
+        # The trending topics, cached until the next update.
+        self.trending_cache = {}
+
+    def flush(self):
+        """Add the pending topics to the current window's sketch."""
+        self.current.add(self.pending_topics)
+        self.pending_topics = []
+
+    def close_window(self):
+        """Fold the current window's counts into the baseline and start a new window."""
+        self.flush()
+        self.baseline.merge(self.current, self.baseline_decay)
+        self.candidates = SpaceSaving(self.capacity)
+        self.current = CountMinSketch(self.width, self.depth)
+        self.windows += 1
+
+    def add(self, window_start, topics):
+        """Count the given topics of a tweet in the given window, closing the
+        current window first if the tweet belongs to a later one. (Tweets from
+        earlier windows are counted in the current window.)
+        """
+        if self.window_start is None:
+            self.window_start = window_start
+        elif window_start > self.window_start:
+            self.close_window()
+            self.window_start = window_start
+        for topic in topics:
+            self.candidates.add(topic)
+        self.pending_topics.extend(topics)
+        if len(self.pending_topics) >= PENDING_TOPICS_SIZE:
+            self.flush()
+        self.trending_cache = {}
+
+    def trending(self, k=10, smoothing=1.0):
+        """Return the (up to) k topics with the highest trend scores in the
+        current window as (topic, count, baseline_count, score) tuples, where
+        baseline_count is scaled to the current window's total.
+        """
+        if (k, smoothing) not in self.trending_cache:
+            self.trending_cache[(k, smoothing)] = self.score_candidates(k, smoothing)
+        return self.trending_cache[(k, smoothing)]
+
+    def score_candidates(self, k, smoothing):
+        """Score the current window's candidate topics (see trending())."""
+        self.flush()
+        if self.current.total == 0:
+            return []
+        topics = [topic for topic, _ in self.candidates.top()]
+        counts = self.current.estimate(topics)
+        scale = self.current.total / self.baseline.total if self.baseline.total else 0.0
+        baseline_counts = self.baseline.estimate(topics) * scale
+        scores = (counts + smoothing) / (baseline_counts + smoothing)
+        top_indexes = np.lexsort((-counts, -scores))[:k]
+        return [
+            (topics[index], int(counts[index]), float(baseline_counts[index]), float(scores[index]))
+            for index in top_indexes
+            ]
+
+
+def get_hashtags(hashtags):
+    """Return the lower-cased hashtags of the given comma-separated list."""
+    return [f'#{hashtag.lower()}' for hashtag in hashtags.split(',') if hashtag]
+
+
+@lru_cache(maxsize=None)
+def get_stop_words():
+    """Return scikit-learn's English stop words, importing scikit-learn (which
+    takes seconds) on first use only.
+    """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    return ENGLISH_STOP_WORDS
+
+
+def get_ngrams(tweet_norm, ngram_range=(1, 2)):
+    """Return the word n-grams of the given normalized tweet, skipping stop
+    words, placeholders (slo_*), mentions, URLs and punctuation.
+    """
+    stop_words = get_stop_words()
+    tokens = [
+        token for token in tweet_norm.split()
+        if token.isalnum() and token not in stop_words and not token.startswith('slo_')
+        ]
+    return [
+        ' '.join(tokens[start:start + n])
+        for n in range(ngram_range[0], ngram_range[1] + 1)
+        for start in range(len(tokens) - n + 1)
+        ]
+
+
+class TrendingTopics:
+    """The topic trackers of each company and topic kind, fed tweet by tweet."""
+
+    def __init__(self, window='7D', capacity=500, width=2**14, depth=4, baseline_decay=0.5):
+        self.window = window
+        self.tracker_settings = {
+            'capacity': capacity,
+            'width': width,
+            'depth': depth,
+            'baseline_decay': baseline_decay,
+            }
+        self.trackers = {}
+
+    def get_tracker(self, company, kind):
+        """Return the tracker of the given company and topic kind."""
+        key = (company, kind)
+        if key not in self.trackers:
+            self.trackers[key] = TopicTracker(**self.tracker_settings)
+        return self.trackers[key]
+
+    def get_window_starts(self, created_at):
+        """Return the start of the window of each of the given created_at values."""
+        return pd.to_datetime(created_at, utc=True, format='mixed').dt.floor(self.window)
+
+    def add(self, company, window_start, hashtags, tweet_norm):
+        """Count the topics of the given tweet, from the window starting at the
+        given time (see get_window_starts()), for each of its companies (a
+        '|'-separated list).
+        """
+        topics = {'hashtag': get_hashtags(hashtags), 'ngram': get_ngrams(tweet_norm)}
+        for single_company in filter(None, company.split('|')):
+            for kind in TOPIC_KINDS:
+                self.get_tracker(single_company, kind).add(window_start, topics[kind])
+
+    def trending(self, company, kind='hashtag', k=10):
+        """Return the trending topics of the given company and kind (see
+        TopicTracker.trending()).
+        """
+        tracker = self.trackers.get((company, kind))
+        return tracker.trending(k) if tracker is not None else []
+
+    def get_trending_frame(self, k=10):
+        """Return the current trending topics of all the companies and kinds."""
+        rows = []
+        for (company, kind), tracker in sorted(self.trackers.items()):
+            for rank, (topic, count, baseline_count, score) in enumerate(tracker.trending(k), 1):
+                rows.append({
+                    'company': company,
+                    'window_start': tracker.window_start,
+                    'kind': kind,
+                    'rank': rank,
+                    'topic': topic,
+                    'count': count,
+                    'baseline_count': round(baseline_count, 2),
+                    'score': round(score, 3),
+                    })
+        return pd.DataFrame(rows)
+
+
+@instrumented
+def main(
+        dataset_path='.',
+        input_filename='dataset_norm.csv',
+        output_filename='trending_topics.csv',
+        window='7D',
+        top_k=10,
+        capacity=500,
+        width=2**14,
+        depth=4,
+        baseline_decay=0.5,
+        chunk_size=50000,
+        encoding='utf-8',
+        report_dirname='reports',
+        cprofile=False,
+        trace_memory=False,
+        logging_level=logging.INFO
+        ):
+    """This tool streams the normalized tweets (in created_at order within
+    each chunk) through the trending-topic trackers and saves the top trending
+    hashtags and word n-grams of each company's latest window.
+
+    Keyword Arguments:
+        dataset_path -- the system path from which to load the datasets
+            (default='.')
+        input_filename -- the name of the normalized dataset file to read
+            (default='dataset_norm.csv')
+        output_filename -- the name of the trending topics file to save
+            (default='trending_topics.csv')
+        window -- the length of the time windows (a pandas frequency)
+            (default: '7D')
+        top_k -- the number of trending topics to save per company/kind
+            (default: 10)
+        capacity -- the number of candidate topics tracked per window
+            (default: 500)
+        width -- the width of the Count-Min sketches
+            (default: 2**14)
+        depth -- the depth of the Count-Min sketches
+            (default: 4)
+        baseline_decay -- the factor by which the baseline counts are decayed
+            each time a window closes
+            (default: 0.5)
+        chunk_size -- the number of tweets read at a time
+            (default: 50000)
+        encoding -- the file encoding to use
+            (default: 'utf-8')
+        report_dirname -- the directory in which to save the run's performance
+            report (see instrumentation.py), or None for no report
+            (default: 'reports')
+        cprofile -- whether to include a cProfile profile in the report
+            (default: False)
+        trace_memory -- whether to include tracemalloc allocation statistics
+            in the report
+            (default: False)
+        logging_level -- the level of logging to use
+            (default: logging.INFO)
+    """
+    logging.basicConfig(
+        level=logging_level,
+        format='%(asctime)s %(levelname)s %(message)s',
+        filename=__name__ + '.log',
+        filemode='a'
+        )
+    logger.info('extracting trending topics...')
+
+    input_filepath = Path(dataset_path, input_filename)
+    output_filepath = Path(dataset_path, output_filename)
+
+    trending_topics = TrendingTopics(window, capacity, width, depth, baseline_decay)
+    count = 0
+    with stage('count_topics') as metrics:
+        # Adding na_filter here to ensure that empty strings are not converted to NaN.
+        for df_chunk in pd.read_csv(
+                input_filepath,
+                usecols=['company', 'created_at', 'hashtags', 'tweet_norm'],
+                encoding=encoding,
+                na_filter=False,
+                chunksize=chunk_size
+                ):
+            df_chunk['window_start'] = trending_topics.get_window_starts(df_chunk['created_at'])
+            df_chunk = df_chunk.sort_values('window_start', kind='stable')
+            for row in df_chunk.itertuples(index=False):
+                trending_topics.add(row.company, row.window_start, row.hashtags, row.tweet_norm)
+            count += df_chunk.shape[0]
+            logger.info('\t\tcounted the topics of %s tweets...', count)
+        metrics.rows_in = count
+
+    with stage('save_trending_topics'):
+        df_trending = trending_topics.get_trending_frame(top_k)
+        df_trending.to_csv(output_filepath, index=False)
+    logger.info('\tsaved %s trending topics to %s', df_trending.shape[0], output_filepath)
+
+
+if __name__ == '__main__':
+    Fire(main)